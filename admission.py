@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+from upload_spool import upload_size
+from xlsx_reader import open_source
+
+# ==============================================================================
+# KIỂM SOÁT TẢI (ADMISSION CONTROL) CHO CÁC BẢNG KÊ LỚN
+# ==============================================================================
+# Cuối ngày nhiều cửa hàng cùng gửi bảng kê lớn; mỗi lần xử lý đọc cả file và dựng workbook
+# openpyxl trong bộ nhớ, nên bộ nhớ tăng vọt cùng lúc và worker bị hệ điều hành dừng (OOM).
+# Chi phí của một lần xử lý được ước lượng bằng dung lượng XML (đã giải nén) của sheet trong file
+# .xlsx, đọc từ mục lục của file ZIP nên không cần giải nén. Các file nhỏ (làn nhanh) chạy ngay;
+# file lớn phải giữ một phần ngân sách ADMISSION_BUDGET_BYTES của worker trong lúc xử lý.
+# Khi hết ngân sách, request chờ trong hàng đợi (tối đa ADMISSION_MAX_QUEUE request, mỗi request
+# chờ tối đa ADMISSION_MAX_WAIT_SECONDS), quá giới hạn thì bị từ chối kèm gợi ý thời gian thử lại.
+# Một lô /process-batch giữ ngân sách bằng tổng chi phí các file trong lô.
+# LƯU Ý: ngân sách là của TỪNG worker gunicorn (trạng thái nằm trong bộ nhớ của tiến trình), các worker
+# không chia sẻ với nhau. Bộ nhớ tối đa dành cho bảng kê lớn trên cả máy ~ WEB_CONCURRENCY x ngân sách,
+# nên khi tăng số worker cần giảm UPSSE_ADMISSION_BUDGET_MB tương ứng.
+
+ADMISSION_BUDGET_BYTES = int(os.environ.get("UPSSE_ADMISSION_BUDGET_MB", 128)) * 1024 * 1024
+FAST_LANE_MAX_BYTES = int(os.environ.get("UPSSE_FAST_LANE_MB", 4)) * 1024 * 1024
+ADMISSION_MAX_QUEUE = int(os.environ.get("UPSSE_ADMISSION_QUEUE", 4))
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("UPSSE_ADMISSION_WAIT_SECONDS", 30))
+# Ước lượng dung lượng XML của một dòng bảng kê (dùng khi chỉ còn các dòng đã đọc, ví dụ sau khi xác nhận ngày)
+BYTES_PER_BKHD_ROW = 800
+# Gợi ý thử lại khi chưa đo được thời gian xử lý file lớn nào
+DEFAULT_RETRY_AFTER_SECONDS = 15
+
+_admission_condition = threading.Condition()
+_in_flight_cost = 0
+_queue = []
+_average_heavy_seconds = None
+_admission_stats = {"fast_admitted": 0, "heavy_admitted": 0, "rejected": 0, "in_flight": 0, "wait_seconds": 0.0}
+
+class AdmissionRejected(Exception):
+    """Máy chủ đang hết ngân sách xử lý; retry_after là số giây nên chờ trước khi gửi lại."""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Máy chủ đang bận xử lý nhiều bảng kê lớn. Vui lòng gửi lại sau khoảng {retry_after} giây.")
+
+def configure(budget_bytes=None, fast_lane_max_bytes=None, max_queue=None, max_wait_seconds=None):
+    """Thay đổi cấu hình kiểm soát tải (gọi khi khởi động ứng dụng)."""
+    global ADMISSION_BUDGET_BYTES, FAST_LANE_MAX_BYTES, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_SECONDS
+    if budget_bytes is not None: ADMISSION_BUDGET_BYTES = budget_bytes
+    if fast_lane_max_bytes is not None: FAST_LANE_MAX_BYTES = fast_lane_max_bytes
+    if max_queue is not None: ADMISSION_MAX_QUEUE = max_queue
+    if max_wait_seconds is not None: ADMISSION_MAX_WAIT_SECONDS = max_wait_seconds
+
+def estimate_cost(file_content=None, bkhd_data=None):
+    """
+    Chi phí ước lượng (byte) của một lần xử lý: dung lượng giải nén của các sheet và bảng chuỗi dùng chung
+    trong file .xlsx; không có file thì tính theo số dòng đã đọc (bkhd_data).
+    """
+    if file_content is not None:
+        try:
+            archive = zipfile.ZipFile(open_source(file_content))
+        except zipfile.BadZipFile:
+            return upload_size(file_content)
+        with archive:
+            return sum(
+                info.file_size for info in archive.infolist()
+                if info.filename.startswith("xl/worksheets/") or info.filename == "xl/sharedStrings.xml"
+            )
+    if bkhd_data is not None:
+        return len(bkhd_data["rows"]) * BYTES_PER_BKHD_ROW
+    return 0
+
+def _retry_after():
+    """Gọi khi đang giữ _admission_condition: thời gian gợi ý chờ trước khi gửi lại."""
+    if _average_heavy_seconds is None:
+        return DEFAULT_RETRY_AFTER_SECONDS
+    return max(1, round(_average_heavy_seconds * (len(_queue) + 1)))
+
+@contextmanager
+def admit(cost, background=False):
+    """
+    Giữ ngân sách cho một lần xử lý có chi phí cost trong suốt khối with.
+    Chờ theo thứ tự đến (FIFO) khi hết ngân sách; hàng đợi đã đầy hoặc chờ quá ADMISSION_MAX_WAIT_SECONDS
+    thì ném AdmissionRejected. background=True (công việc chạy nền): chờ đến lượt, không bị từ chối.
+    """
+    global _in_flight_cost, _average_heavy_seconds
+    if cost < FAST_LANE_MAX_BYTES:
+        with _admission_condition:
+            _admission_stats["fast_admitted"] += 1
+            _admission_stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            with _admission_condition:
+                _admission_stats["in_flight"] -= 1
+        return
+
+    # File lớn hơn cả ngân sách vẫn được chạy, nhưng một mình
+    cost = min(cost, ADMISSION_BUDGET_BYTES)
+    ticket = object()
+    started = time.monotonic()
+    with _admission_condition:
+        if not background and (_queue or _in_flight_cost + cost > ADMISSION_BUDGET_BYTES) and len(_queue) >= ADMISSION_MAX_QUEUE:
+            _admission_stats["rejected"] += 1
+            raise AdmissionRejected(_retry_after())
+        _queue.append(ticket)
+        try:
+            deadline = None if background else started + ADMISSION_MAX_WAIT_SECONDS
+            while _queue[0] is not ticket or _in_flight_cost + cost > ADMISSION_BUDGET_BYTES:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    _admission_stats["rejected"] += 1
+                    raise AdmissionRejected(_retry_after())
+                _admission_condition.wait(remaining)
+        finally:
+            _queue.remove(ticket)
+            # Request tiếp theo trong hàng đợi có thể vừa lên đầu
+            _admission_condition.notify_all()
+        _in_flight_cost += cost
+        _admission_stats["heavy_admitted"] += 1
+        _admission_stats["in_flight"] += 1
+        _admission_stats["wait_seconds"] += time.monotonic() - started
+
+    admitted = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - admitted
+        with _admission_condition:
+            _in_flight_cost -= cost
+            _admission_stats["in_flight"] -= 1
+            _average_heavy_seconds = elapsed if _average_heavy_seconds is None else 0.8 * _average_heavy_seconds + 0.2 * elapsed
+            _admission_condition.notify_all()
+
+def get_admission_stats():
+    """Trả về bản sao các bộ đếm kiểm soát tải, kèm số request đang chờ và chi phí đang xử lý."""
+    with _admission_condition:
+        stats = dict(_admission_stats)
+        stats["queued"] = len(_queue)
+        stats["in_flight_cost_bytes"] = _in_flight_cost
+        stats["budget_bytes"] = ADMISSION_BUDGET_BYTES
+    return stats
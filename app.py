@@ -1,110 +1,291 @@
-from flask import Flask, request, render_template, flash, redirect, url_for, send_file
+from flask import Flask, request, render_template, flash, redirect, url_for, send_file, Response, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import dump_options_header
+import gc
 import io
-import base64
-import zipfile
+import logging
+import time
 
 # Import các hàm cần thiết từ logic_handler
-from logic_handler import load_static_data, process_uploaded_file
+from logic_handler import process_uploaded_file, get_normalization_stats, TRANSFORM_ENGINE
+from config_cache import get_static_data, get_cache_stats, get_config_fingerprint
+from upload_stash import stash_upload, take_upload, get_stash_stats
+from job_queue import submit_job, get_job_status, get_job_result_path
+from result_cache import make_result_key, get_result, put_result, cache_chunks, iter_result_file, get_result_cache_stats
+from incremental_processor import get_incremental_stats
+from customer_store import get_customer_store_stats
+from admission import admit, estimate_cost, AdmissionRejected, get_admission_stats
+from batch_processor import collect_batch_items, run_batch, build_batch_zip
+from zip_stream import iter_zip_chunks
+from upload_spool import UPLOAD_MAX_BYTES, SpoolingRequest, upload_too_large_message, upload_size, detach_upload
+import metrics
 
 # --- Cài đặt Flask App cơ bản ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_super_secret_key_12345'
+# Giới hạn dung lượng request; file tải lên lớn được ghi ra file tạm (xem upload_spool.py)
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES
+app.request_class = SpoolingRequest
 DATA_FILE_PATH = "Data.xlsx" 
 MAHH_FILE_PATH = "MaHH.xlsx"
 DSKH_FILE_PATH = "DSKH.xlsx"
 
+# Các endpoint được đo thời gian từng giai đoạn và ghi log tổng hợp cho mỗi request
+INSTRUMENTED_ENDPOINTS = {'process', 'process_batch', 'submit_process_job'}
+# Số liệu tức thời (có thể giảm) của các module; các số liệu còn lại chỉ tăng và được xuất dạng counter
+GAUGE_STATS = {'entries', 'memory_entries', 'memory_bytes', 'clean_string_size', 'tax_code_size',
+               'in_flight', 'queued', 'in_flight_cost_bytes', 'budget_bytes'}
+
+# --- Đo thời gian request (xem metrics.py) ---
+@app.before_request
+def _start_request_metrics():
+    if request.endpoint in INSTRUMENTED_ENDPOINTS:
+        metrics.start_request(request.endpoint)
+
+@app.after_request
+def _finish_request_metrics(response):
+    if request.endpoint in INSTRUMENTED_ENDPOINTS:
+        if response.content_length and 'attachment' in response.headers.get('Content-Disposition', ''):
+            metrics.record_bytes('output', response.content_length)
+        metrics.finish_request(response.status_code)
+    return response
+
+# --- Từ chối sớm file tải lên quá lớn (chỉ dựa vào header, chưa nhận nội dung file) ---
+@app.before_request
+def _reject_oversized_upload():
+    if request.content_length is not None and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        raise RequestEntityTooLarge()
+
+@app.errorhandler(RequestEntityTooLarge)
+def _upload_too_large(error):
+    message = upload_too_large_message()
+    if request.endpoint == 'submit_process_job':
+        return jsonify({"error": message}), 413
+    flash(message, 'danger')
+    return redirect(url_for('index'))
+
+@app.teardown_request
+def _discard_request_metrics(error=None):
+    # Trường hợp lỗi không qua được after_request
+    if error is not None and request.endpoint in INSTRUMENTED_ENDPOINTS:
+        metrics.finish_request(500)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Xuất metrics của worker hiện tại theo định dạng Prometheus."""
+    extra_gauges, extra_counters = {}, {}
+    module_stats = (
+        ("upsse_config_cache", get_cache_stats()),
+        ("upsse_upload_stash", get_stash_stats()),
+        ("upsse_result_cache", get_result_cache_stats()),
+        ("upsse_incremental", get_incremental_stats()),
+        ("upsse_customer_store", get_customer_store_stats()),
+        ("upsse_normalize", get_normalization_stats()),
+        ("upsse_admission", get_admission_stats()),
+    )
+    for prefix, stats in module_stats:
+        for name, value in stats.items():
+            target = extra_gauges if name in GAUGE_STATS else extra_counters
+            target[f"{prefix}_{name}"] = value
+    return Response(metrics.render_prometheus(extra_gauges, extra_counters), mimetype='text/plain; version=0.0.4')
+
+def _timed_zip_chunks(named_outputs, endpoint=None):
+    """
+    Các khối của file ZIP (xem zip_stream.py). Chỉ tính thời gian tạo ZIP, không tính thời gian chờ gửi
+    cho trình duyệt. Phản hồi streaming được gửi sau khi request kết thúc (after_request), nên
+    dung lượng gửi đi của endpoint được ghi thẳng vào histogram.
+    """
+    chunks = iter_zip_chunks(named_outputs)
+    busy_seconds, total_bytes = 0.0, 0
+    while True:
+        started = time.perf_counter()
+        chunk = next(chunks, None)
+        busy_seconds += time.perf_counter() - started
+        if chunk is None:
+            break
+        total_bytes += len(chunk)
+        yield chunk
+    metrics.record_stage("zip", busy_seconds)
+    if endpoint:
+        metrics.observe("upsse_request_output_bytes", total_bytes, metrics.BYTES_BUCKETS, endpoint=endpoint)
+
 # --- Route chính để hiển thị trang upload ---
 @app.route('/', methods=['GET'])
 def index():
     """Hiển thị trang upload chính."""
-    static_data, error_message = load_static_data(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
+    static_data, error_message = get_static_data(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
     chxd_list = static_data.get("DS_CHXD", []) if static_data else []
     if error_message:
         flash(error_message, "danger")
 
     return render_template('index.html', chxd_list=chxd_list, form_data={})
 
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def _attachment_header(download_name):
+    """Giá trị header Content-Disposition để tải file về (giống send_file)."""
+    return dump_options_header('attachment', {'filename': download_name})
+
+def _read_form_data():
+    """Lấy các trường của form xử lý (dùng chung cho /process và /jobs)."""
+    return {
+        "selected_chxd": request.form.get('chxd'),
+        "price_periods": request.form.get('price_periods'),
+        "invoice_number": request.form.get('invoice_number', '').strip(),
+        "confirmed_date": request.form.get('confirmed_date'),
+        "multi_day": request.form.get('multi_day') == '1',
+        "multi_day_output": request.form.get('multi_day_output', 'per_day'),
+        "incremental": request.form.get('incremental') == '1',
+        "incremental_output": request.form.get('incremental_output', 'full'),
+        "upload_token": request.form.get('upload_token')
+    }
+
+def _check_form_data(form_data):
+    """Kiểm tra các trường bắt buộc, trả về thông báo lỗi hoặc None."""
+    if not form_data["selected_chxd"]:
+        return 'Vui lòng chọn CHXD.'
+    if form_data["price_periods"] == '2' and not form_data["invoice_number"]:
+        return 'Vui lòng nhập "Số hóa đơn đầu tiên của giá mới" khi chọn 2 giai đoạn giá.'
+    if form_data["price_periods"] == 'N' and not form_data["invoice_number"]:
+        return 'Vui lòng nhập số hóa đơn đầu tiên của mỗi giai đoạn giá mới khi chọn nhiều giai đoạn giá.'
+    return None
+
+def _run_process(file_content, static_data, form_data, bkhd_data=None):
+    """Gọi hàm xử lý chính từ logic_handler với các lựa chọn trên form."""
+    return process_uploaded_file(
+        uploaded_file_content=file_content,
+        static_data=static_data,
+        selected_chxd=form_data["selected_chxd"],
+        price_periods=form_data["price_periods"],
+        new_price_invoice_number=form_data["invoice_number"],
+        confirmed_date_str=form_data["confirmed_date"],
+        bkhd_data=bkhd_data,
+        multi_day=form_data["multi_day"],
+        multi_day_output=form_data["multi_day_output"],
+        incremental_output=form_data["incremental_output"] if form_data["incremental"] else None,
+        config_fingerprint=get_config_fingerprint(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
+    )
+
+def _build_download(result):
+    """
+    Chuyển kết quả của process_uploaded_file thành (kết quả, tên file tải về, mimetype).
+    Kết quả là BytesIO (1 file Excel) hoặc danh sách [(tên file, BytesIO)] cần đóng gói ZIP.
+    """
+    if isinstance(result, dict) and 'old' in result:
+        # Trường hợp 2 giai đoạn giá, tạo file ZIP
+        named_outputs = [(name, result[key]) for key, name in (('old', 'UpSSE_gia_cu.xlsx'), ('new', 'UpSSE_gia_moi.xlsx')) if result.get(key)]
+        return named_outputs, 'UpSSE_2_giai_doan.zip', 'application/zip'
+    if isinstance(result, dict) and 'periods' in result:
+        # Trường hợp nhiều giai đoạn giá, tạo file ZIP
+        named_outputs = [(f'UpSSE_giai_doan_{period_index}.xlsx', period_output) for period_index, period_output in result['periods']]
+        return named_outputs, 'UpSSE_nhieu_giai_doan.zip', 'application/zip'
+    if isinstance(result, dict) and 'days' in result:
+        # Trường hợp bảng kê nhiều ngày, mỗi ngày một file, tạo file ZIP
+        named_outputs = [(f"UpSSE_{day.strftime('%d.%m.%Y')}.xlsx", day_output) for day, day_output in result['days']]
+        return named_outputs, 'UpSSE_nhieu_ngay.zip', 'application/zip'
+    if isinstance(result, io.BytesIO):
+        # Trường hợp 1 giai đoạn giá, trả về file Excel
+        return result, 'UpSSE.xlsx', XLSX_MIMETYPE
+    raise ValueError("Hàm xử lý không trả về kết quả hợp lệ.")
+
+def _result_key(file_content, form_data):
+    """
+    Khóa bộ đệm kết quả: nội dung file + các lựa chọn trên form + fingerprint của file cấu hình.
+    Trả về None (không lưu đệm) với chế độ xử lý nối tiếp vì kết quả phụ thuộc các lần tải lên trước.
+    """
+    if form_data["incremental"]:
+        return None
+    options = {name: value for name, value in form_data.items() if name != "upload_token"}
+    fingerprint = get_config_fingerprint(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
+    return make_result_key(fingerprint, file_content, **options)
+
+def _output_chunks(output, download_name, mimetype, result_key=None, endpoint=None):
+    """
+    Các khối của file trả về: danh sách file được đóng gói ZIP dần theo luồng, 1 file Excel là chính bộ đệm
+    của BytesIO (không sao chép). Có result_key thì các khối được ghi vào bộ đệm kết quả trong lúc gửi.
+    """
+    if mimetype == 'application/zip':
+        chunks = _timed_zip_chunks(output, endpoint)
+    else:
+        chunks = [output.getbuffer()]
+    if result_key:
+        chunks = cache_chunks(result_key, download_name, mimetype, chunks)
+    return chunks
+
+def _send_download(output, download_name, mimetype, result_key=None):
+    """Gửi kết quả: 1 file Excel gửi trực tiếp, danh sách file thì đóng gói ZIP và gửi dần theo luồng."""
+    if mimetype == 'application/zip':
+        # File ZIP được tạo và gửi dần theo luồng, không giữ cả file trong bộ nhớ
+        chunks = _output_chunks(output, download_name, mimetype, result_key, 'process')
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+        response.headers['Content-Disposition'] = _attachment_header(download_name)
+        return response
+    if result_key:
+        # Ghi thẳng bộ đệm của BytesIO ra ổ đĩa rồi gửi file như bình thường
+        put_result(result_key, download_name, mimetype, _output_chunks(output, download_name, mimetype))
+    return send_file(output, as_attachment=True, download_name=download_name, mimetype=mimetype)
+
+def _send_cached(cached):
+    """Gửi kết quả lấy từ bộ đệm: file trên ổ đĩa hoặc nội dung trong tầng bộ nhớ."""
+    source = cached["path"] if "path" in cached else io.BytesIO(cached["content"])
+    return send_file(source, as_attachment=True, download_name=cached["download_name"], mimetype=cached["mimetype"])
+
 # --- Route để xử lý file ---
 @app.route('/process', methods=['POST'])
 def process():
-    """Xử lý file, hỗ trợ 1 hoặc 2 giai đoạn giá."""
+    """Xử lý file, hỗ trợ 1, 2 hoặc nhiều giai đoạn giá."""
     try:
-        static_data, error = load_static_data(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
+        static_data, error = get_static_data(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
         if error:
             raise ValueError(error)
         chxd_list = static_data.get("DS_CHXD", [])
 
-        # --- Lấy dữ liệu từ form ---
-        form_data = {
-            "selected_chxd": request.form.get('chxd'),
-            "price_periods": request.form.get('price_periods'),
-            "invoice_number": request.form.get('invoice_number', '').strip(),
-            "confirmed_date": request.form.get('confirmed_date'),
-            "encoded_file": request.form.get('file_content_b64')
-        }
-
-        # Kiểm tra các trường bắt buộc
-        if not form_data["selected_chxd"]:
-            flash('Vui lòng chọn CHXD.', 'warning')
-            return redirect(url_for('index'))
-        if form_data["price_periods"] == '2' and not form_data["invoice_number"]:
-            flash('Vui lòng nhập "Số hóa đơn đầu tiên của giá mới" khi chọn 2 giai đoạn giá.', 'warning')
+        # --- Lấy dữ liệu từ form và kiểm tra các trường bắt buộc ---
+        form_data = _read_form_data()
+        form_error = _check_form_data(form_data)
+        if form_error:
+            flash(form_error, 'warning')
             return redirect(url_for('index'))
 
-        # Xác định nội dung file (từ file upload hoặc từ trường ẩn)
-        file_content = None
-        if form_data["encoded_file"]:
-            file_content = base64.b64decode(form_data["encoded_file"])
+        # Xác định nội dung file (từ file upload hoặc từ kho tạm qua token ở trường ẩn)
+        file_content, bkhd_data = None, None
+        if form_data["upload_token"]:
+            file_content, bkhd_data = take_upload(form_data["upload_token"])
+            if file_content is None and bkhd_data is None:
+                flash('Phiên xác nhận ngày đã hết hạn. Vui lòng tải lên lại file Bảng kê hóa đơn.', 'warning')
+                return redirect(url_for('index'))
         elif 'file' in request.files and request.files['file'].filename != '':
-            file_content = request.files['file'].read()
+            # File tạm của upload được đọc trực tiếp, không chép vào bộ nhớ
+            file_content = request.files['file'].stream
+            metrics.record_bytes('input', upload_size(file_content))
         else:
             flash('Vui lòng tải lên file Bảng kê hóa đơn.', 'warning')
             return redirect(url_for('index'))
 
-        # Gọi hàm xử lý chính từ logic_handler
-        result = process_uploaded_file(
-            uploaded_file_content=file_content, 
-            static_data=static_data, 
-            selected_chxd=form_data["selected_chxd"],
-            price_periods=form_data["price_periods"],
-            new_price_invoice_number=form_data["invoice_number"],
-            confirmed_date_str=form_data["confirmed_date"]
-        )
-        
+        # Bảng kê đã được xử lý với đúng các lựa chọn này thì trả về kết quả đã lưu
+        result_key = _result_key(file_content, form_data) if file_content is not None else None
+        cached = get_result(result_key)
+        if cached is not None:
+            return _send_cached(cached)
+
+        # File lớn phải chờ đến lượt khi worker đang xử lý nhiều file lớn khác (xem admission.py)
+        with admit(estimate_cost(file_content, bkhd_data)):
+            result = _run_process(file_content, static_data, form_data, bkhd_data)
+
         # --- Xử lý kết quả trả về ---
         if isinstance(result, dict) and result.get('choice_needed'):
-            # Trường hợp cần người dùng xác nhận ngày
-            form_data["encoded_file"] = base64.b64encode(file_content).decode('utf-8')
+            # Trường hợp cần người dùng xác nhận ngày: giữ file trên server, chỉ gửi token cho trình duyệt
+            form_data["upload_token"] = stash_upload(file_content, result['bkhd_data'])
             return render_template('index.html', chxd_list=chxd_list, date_ambiguous=True, date_options=result['options'], form_data=form_data)
-        
-        elif isinstance(result, dict) and 'old' in result:
-            # Trường hợp 2 giai đoạn giá, tạo file ZIP
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                if result.get('old'):
-                    zipf.writestr('UpSSE_gia_cu.xlsx', result['old'].getvalue())
-                if result.get('new'):
-                    zipf.writestr('UpSSE_gia_moi.xlsx', result['new'].getvalue())
-            
-            zip_buffer.seek(0)
-            return send_file(
-                zip_buffer,
-                as_attachment=True,
-                download_name='UpSSE_2_giai_doan.zip',
-                mimetype='application/zip'
-            )
-
-        elif isinstance(result, io.BytesIO):
-            # Trường hợp 1 giai đoạn giá, trả về file Excel
-            return send_file(
-                result,
-                as_attachment=True,
-                download_name='UpSSE.xlsx',
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-        else:
-            raise ValueError("Hàm xử lý không trả về kết quả hợp lệ.")
 
+        output, download_name, mimetype = _build_download(result)
+        return _send_download(output, download_name, mimetype, result_key)
+
+    except AdmissionRejected as rejected:
+        # Giữ nguyên các lựa chọn trên form, người dùng chỉ cần chọn lại file và gửi lại
+        flash(str(rejected), 'warning')
+        form_data["upload_token"] = None
+        return render_template('index.html', chxd_list=chxd_list, form_data=form_data), 503, {'Retry-After': str(rejected.retry_after)}
     except ValueError as ve:
         flash(str(ve), 'danger')
     except Exception as e:
@@ -112,6 +293,138 @@ def process():
 
     return redirect(url_for('index'))
 
+# --- Chạy nền cho file lớn (xem job_queue.py) ---
+@app.route('/jobs', methods=['POST'])
+def submit_process_job():
+    """
+    Nhận file và các lựa chọn giống /process nhưng xử lý ở chế độ chạy nền.
+    Trả về JSON gồm job_id và các đường dẫn hỏi trạng thái / tải kết quả.
+    """
+    form_data = _read_form_data()
+    form_error = _check_form_data(form_data)
+    if not form_error and ('file' not in request.files or request.files['file'].filename == ''):
+        form_error = 'Vui lòng tải lên file Bảng kê hóa đơn.'
+    if form_error:
+        return jsonify({"error": form_error}), 400
+
+    # Công việc chạy sau khi request kết thúc nên giữ lại file tạm của upload (đóng khi công việc xong)
+    file_content = detach_upload(request.files['file'])
+    metrics.record_bytes('input', upload_size(file_content))
+    result_key = _result_key(file_content, form_data)
+
+    def work():
+        try:
+            static_data, error = get_static_data(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
+            if error:
+                raise ValueError(error)
+            cached = get_result(result_key)
+            if cached is not None:
+                download_name, mimetype = cached["download_name"], cached["mimetype"]
+                chunks = iter_result_file(cached["path"]) if "path" in cached else [cached["content"]]
+            else:
+                # Công việc chạy nền chờ đến lượt, không bị từ chối
+                with admit(estimate_cost(file_content), background=True):
+                    result = _run_process(file_content, static_data, form_data)
+                if isinstance(result, dict) and result.get('choice_needed'):
+                    # Gửi lại công việc với confirmed_date là một trong các lựa chọn này
+                    return {"choice_needed": True, "options": result['options']}
+                output, download_name, mimetype = _build_download(result)
+                # Kết quả được ghi vào bộ đệm trong lúc ghi ra file kết quả của công việc
+                chunks = _output_chunks(output, download_name, mimetype, result_key)
+        finally:
+            file_content.close()
+        return {"chunks": chunks, "download_name": download_name, "mimetype": mimetype}
+
+    job_id = submit_job(work)
+    return jsonify({
+        "job_id": job_id,
+        "status_url": url_for('process_job_status', job_id=job_id),
+        "download_url": url_for('download_process_job', job_id=job_id),
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def process_job_status(job_id):
+    """Trạng thái công việc: queued, running, choice_needed, done hoặc error, kèm số dòng đã đọc/đã chuyển đổi."""
+    status = get_job_status(job_id)
+    if status is None:
+        return jsonify({"error": "Không tìm thấy công việc hoặc kết quả đã hết hạn."}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def download_process_job(job_id):
+    """Tải file UpSSE (hoặc ZIP) của công việc đã xong."""
+    result_path, status = get_job_result_path(job_id)
+    if result_path is None:
+        if status is None:
+            return jsonify({"error": "Không tìm thấy công việc hoặc kết quả đã hết hạn."}), 404
+        return jsonify({"error": "Công việc chưa hoàn thành.", "state": status["state"]}), 409
+    return send_file(result_path, as_attachment=True, download_name=status["download_name"], mimetype=status["mimetype"])
+
+# --- Route xử lý hàng loạt nhiều CHXD ---
+@app.route('/process-batch', methods=['POST'])
+def process_batch():
+    """Xử lý nhiều file bảng kê (hoặc 1 file ZIP) của nhiều CHXD song song, trả về 1 file ZIP."""
+    try:
+        static_data, error = get_static_data(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
+        if error:
+            raise ValueError(error)
+
+        uploaded_files = [(f.filename, f.stream) for f in request.files.getlist('files') if f.filename]
+        metrics.record_bytes('input', sum(upload_size(content) for _, content in uploaded_files))
+        if not uploaded_files:
+            flash('Vui lòng tải lên các file Bảng kê hóa đơn (đặt tên file theo tên CHXD) hoặc 1 file ZIP.', 'warning')
+            return redirect(url_for('index'))
+
+        items, manifest_rows = collect_batch_items(uploaded_files, static_data.get("DS_CHXD", []))
+        confirmed_date = request.form.get('batch_confirmed_date') or None
+        # Cả lô giữ ngân sách bằng tổng chi phí của các file trong lô (xem admission.py)
+        with admit(sum(estimate_cost(item["content"]) for item in items)):
+            results = run_batch(items, (DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH), confirmed_date)
+
+        with metrics.stage("zip"):
+            zip_buffer = build_batch_zip(results, manifest_rows)
+        return send_file(
+            zip_buffer,
+            as_attachment=True,
+            download_name='UpSSE_nhieu_CHXD.zip',
+            mimetype='application/zip'
+        )
+
+    except AdmissionRejected as rejected:
+        flash(str(rejected), 'warning')
+        return render_template('index.html', chxd_list=static_data.get("DS_CHXD", []), form_data={}), 503, {'Retry-After': str(rejected.retry_after)}
+    except ValueError as ve:
+        flash(str(ve), 'danger')
+    except Exception as e:
+        flash(f"Đã xảy ra lỗi không mong muốn: {e}", 'danger')
+
+    return redirect(url_for('index'))
+
+# --- Khởi động nhanh (warm-up) và app factory cho gunicorn ---
+def warm_up():
+    """Nạp sẵn cấu hình và các module cần dùng trước khi nhận request đầu tiên."""
+    _, error_message = get_static_data(DATA_FILE_PATH, MAHH_FILE_PATH, DSKH_FILE_PATH)
+    app.jinja_env.get_template('index.html')
+    if TRANSFORM_ENGINE == 'columnar':
+        import columnar_engine  # noqa: F401 (nạp numpy/pandas một lần ở tiến trình cha)
+    return error_message
+
+def create_app():
+    """
+    App factory, dùng với gunicorn --preload (xem gunicorn.conf.py): cấu hình đã biên dịch và
+    các module được nạp một lần ở tiến trình master rồi dùng chung (copy-on-write) cho các worker.
+    """
+    # Log tổng hợp thời gian từng request (xem metrics.py) ra stderr của worker
+    if not metrics.logger.handlers:
+        timing_log_handler = logging.StreamHandler()
+        timing_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        metrics.logger.addHandler(timing_log_handler)
+        metrics.logger.setLevel(logging.INFO)
+    warm_up()
+    # Chuyển các đối tượng đã nạp sang thế hệ cố định để GC không chạm vào (giữ trang nhớ dùng chung sau fork)
+    gc.freeze()
+    return app
+
 # --- Chạy App ---
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
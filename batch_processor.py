@@ -0,0 +1,188 @@
+import csv
+import io
+import os
+import unicodedata
+import zipfile
+
+import upload_spool
+from config_cache import get_static_data
+from logic_handler import process_uploaded_file, get_process_pool, reset_process_pool
+from xlsx_reader import open_source
+
+# ==============================================================================
+# XỬ LÝ HÀNG LOẠT NHIỀU CHXD TRONG MỘT LẦN GỬI
+# ==============================================================================
+# Mỗi file bảng kê được gán cho một CHXD theo tên file (ví dụ "Cộng Hoà.xlsx"),
+# sau đó được xử lý song song trên nhiều nhân CPU bằng process pool dùng chung của logic_handler.
+# Lỗi của một file chỉ được ghi vào bảng kết quả, không làm dừng các file khác.
+# MAX_CONTENT_LENGTH chỉ giới hạn file ZIP đã nén, nên dung lượng giải nén của từng file bị giới hạn bởi
+# UPLOAD_MAX_BYTES (xem upload_spool.py) và tổng dung lượng của cả lô bởi BATCH_MAX_TOTAL_BYTES; file vượt
+# giới hạn không được đọc (kiểm tra theo dung lượng ghi trong mục lục ZIP, zipfile không giải nén quá con số này).
+
+MANIFEST_FILE_NAME = "ket_qua_xu_ly.csv"
+BATCH_MAX_TOTAL_BYTES = int(os.environ.get("UPSSE_BATCH_MAX_MB", 256)) * 1024 * 1024
+
+def configure(max_total_bytes=None):
+    """Thay đổi cấu hình xử lý hàng loạt (gọi khi khởi động ứng dụng)."""
+    global BATCH_MAX_TOTAL_BYTES
+    if max_total_bytes is not None: BATCH_MAX_TOTAL_BYTES = max_total_bytes
+
+def _normalize_name(name):
+    return unicodedata.normalize("NFC", " ".join(str(name).split())).casefold()
+
+def _decode_zip_member_name(info):
+    """Tên file trong ZIP tạo bởi Windows có thể không đặt cờ UTF-8, thử giải mã lại."""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("utf-8")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+def _size_error(size, total_bytes):
+    """Thông báo lỗi nếu file size byte vượt giới hạn một file hoặc làm lô vượt giới hạn tổng, ngược lại None."""
+    mb = 1024 * 1024
+    if size > upload_spool.UPLOAD_MAX_BYTES:
+        return f"File quá lớn ({size / mb:.1f} MB sau khi giải nén, tối đa {round(upload_spool.UPLOAD_MAX_BYTES / mb, 2):g} MB)."
+    if total_bytes + size > BATCH_MAX_TOTAL_BYTES:
+        return f"Vượt tổng dung lượng cho phép của một lần gửi ({round(BATCH_MAX_TOTAL_BYTES / mb, 2):g} MB). Hãy gửi file này ở lần sau."
+    return None
+
+def _expand_uploads(uploaded_files):
+    """
+    Trải phẳng danh sách (tên file, nội dung): file .zip được bung ra thành các file .xlsx bên trong.
+    Nội dung là bytes hoặc file nhị phân (file tạm của upload); kết quả là (tên file, bytes, None) để gửi sang
+    tiến trình con, hoặc (tên file, None, thông báo lỗi) với file hỏng/vượt giới hạn dung lượng (không được đọc).
+    """
+    expanded = []
+    total_bytes = 0
+    for file_name, content in uploaded_files:
+        if file_name.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(open_source(content)) as zipf:
+                    for info in zipf.infolist():
+                        member_name = _decode_zip_member_name(info)
+                        if info.is_dir() or os.path.basename(member_name).startswith(("~$", ".")):
+                            continue
+                        error = _size_error(info.file_size, total_bytes)
+                        if error:
+                            expanded.append((member_name, None, error))
+                            continue
+                        try:
+                            expanded.append((member_name, zipf.read(info), None))
+                        except (zipfile.BadZipFile, NotImplementedError, RuntimeError):
+                            expanded.append((member_name, None, "File trong ZIP bị hỏng hoặc không đọc được."))
+                            continue
+                        total_bytes += info.file_size
+            except zipfile.BadZipFile:
+                expanded.append((file_name, None, "File ZIP bị hỏng hoặc không đọc được."))
+        else:
+            size = upload_spool.upload_size(content)
+            error = _size_error(size, total_bytes)
+            if error:
+                expanded.append((file_name, None, error))
+                continue
+            expanded.append((file_name, content if isinstance(content, bytes) else open_source(content).read(), None))
+            total_bytes += size
+    return expanded
+
+def collect_batch_items(uploaded_files, chxd_list):
+    """
+    Gán từng file bảng kê cho CHXD theo tên file.
+    Trả về (items, manifest_rows): items là các file hợp lệ cần xử lý,
+    manifest_rows chứa các file bị loại ngay từ bước này.
+    """
+    chxd_by_name = {_normalize_name(chxd): chxd for chxd in chxd_list}
+    items, manifest_rows = [], []
+    for file_name, content, error in _expand_uploads(uploaded_files):
+        base_name = os.path.basename(file_name)
+        stem, extension = os.path.splitext(base_name)
+        selected_chxd = chxd_by_name.get(_normalize_name(stem))
+        if error:
+            manifest_rows.append(_manifest_row(file_name, "", "Lỗi", "", error))
+        elif extension.lower() not in (".xlsx", ".xlsm"):
+            manifest_rows.append(_manifest_row(file_name, "", "Bỏ qua", "", "Không phải file Excel (.xlsx)."))
+        elif not selected_chxd:
+            manifest_rows.append(_manifest_row(file_name, "", "Lỗi", "", f"Tên file '{stem}' không trùng với tên CHXD nào trong Data.xlsx."))
+        else:
+            items.append({"file_name": file_name, "selected_chxd": selected_chxd, "content": content})
+    return items, manifest_rows
+
+def _manifest_row(file_name, selected_chxd, status, output_name, message):
+    return {"file": file_name, "chxd": selected_chxd, "status": status, "output": output_name, "message": message}
+
+def _convert_batch_item(config_paths, file_content, selected_chxd, confirmed_date_str):
+    """Chạy trong tiến trình con: xử lý một file bảng kê (1 giai đoạn giá), trả về (trạng thái, bytes hoặc lỗi)."""
+    try:
+        static_data, error = get_static_data(*config_paths)
+        if error:
+            raise ValueError(error)
+        result = process_uploaded_file(
+            uploaded_file_content=file_content,
+            static_data=static_data,
+            selected_chxd=selected_chxd,
+            price_periods='1',
+            new_price_invoice_number='',
+            confirmed_date_str=confirmed_date_str
+        )
+        if isinstance(result, dict) and result.get('choice_needed'):
+            options = ", ".join(option['text'] for option in result['options'])
+            return "error", f"Cần xác nhận ngày ({options}). Hãy chọn 'Ngày bảng kê' cho cả lô rồi gửi lại."
+        if not isinstance(result, io.BytesIO):
+            return "error", "Không có dữ liệu hóa đơn hợp lệ trong file Bảng kê."
+        return "ok", result.getvalue()
+    except ValueError as ve:
+        return "error", str(ve)
+    except Exception as e:
+        return "error", f"Đã xảy ra lỗi không mong muốn: {e}"
+
+def run_batch(items, config_paths, confirmed_date_str=None):
+    """Xử lý song song các file; trả về danh sách (item, trạng thái, bytes hoặc lỗi) theo đúng thứ tự đầu vào."""
+    process_pool = get_process_pool()
+    futures = [
+        process_pool.submit(_convert_batch_item, config_paths, item["content"], item["selected_chxd"], confirmed_date_str)
+        for item in items
+    ]
+    results = []
+    pool_broken = False
+    for item, future in zip(items, futures):
+        try:
+            status, payload = future.result()
+        except Exception as e:
+            # Ví dụ tiến trình con bị hệ điều hành kill vì thiếu bộ nhớ
+            pool_broken = True
+            status, payload = "error", f"Tiến trình xử lý bị dừng bất thường: {e}"
+        results.append((item, status, payload))
+    if pool_broken:
+        reset_process_pool()
+    return results
+
+def build_batch_zip(results, manifest_rows):
+    """Đóng gói các file UpSSE và bảng kết quả xử lý (CSV) vào một file ZIP trong bộ nhớ."""
+    manifest_rows = list(manifest_rows)
+    used_names = set()
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for item, status, payload in results:
+            if status != "ok":
+                manifest_rows.append(_manifest_row(item["file_name"], item["selected_chxd"], "Lỗi", "", payload))
+                continue
+            output_name = f"UpSSE_{item['selected_chxd']}.xlsx"
+            counter = 2
+            while output_name in used_names:
+                output_name = f"UpSSE_{item['selected_chxd']}_{counter}.xlsx"
+                counter += 1
+            used_names.add(output_name)
+            zipf.writestr(output_name, payload)
+            manifest_rows.append(_manifest_row(item["file_name"], item["selected_chxd"], "Thành công", output_name, ""))
+
+        manifest_buffer = io.StringIO()
+        writer = csv.writer(manifest_buffer)
+        writer.writerow(["File bảng kê", "CHXD", "Trạng thái", "File UpSSE", "Ghi chú"])
+        for row in manifest_rows:
+            writer.writerow([row["file"], row["chxd"], row["status"], row["output"], row["message"]])
+        # Thêm BOM để Excel mở đúng tiếng Việt
+        zipf.writestr(MANIFEST_FILE_NAME, "\ufeff" + manifest_buffer.getvalue())
+
+    zip_buffer.seek(0)
+    return zip_buffer
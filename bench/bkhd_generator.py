@@ -0,0 +1,109 @@
+"""
+Sinh file Bảng kê hóa đơn (BKHD) giả lập, đúng bố cục mà process_uploaded_file đọc:
+tiêu đề ở dòng 1-10, dữ liệu từ dòng 11, ký hiệu hóa đơn ở cột S (ô S11 dùng để kiểm tra CHXD),
+các cột I/J/N-U chứa số lượng, đơn giá, tiền hàng, thuế suất, tiền thuế, phải thu, mẫu số,
+ký hiệu, số hóa đơn và ngày. Dữ liệu gồm khách vãng lai mua xăng dầu, khách có tên/MST và dầu mỡ nhờn.
+
+    python bench/bkhd_generator.py 10000 -o bk_10000.xlsx --chxd "Cộng Hoà"
+"""
+import argparse
+import io
+import os
+import random
+import sys
+from datetime import datetime
+
+from openpyxl import Workbook, load_workbook
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from logic_handler import XANG_DAU_GROUP, clean_string  # noqa: E402
+
+ANONYMOUS_CUSTOMER = "Người mua không lấy hóa đơn"
+PETROL_PRICES = {"Xăng E5 RON 92-II": 19850, "Xăng RON 95-III": 20480, "Dầu DO 0,05S-II": 18760, "Dầu DO 0,001S-V": 19450}
+FALLBACK_LUBRICANTS = ["Phanh DOT 3", "PV Engine RMX 20W50 (18 lít/Can)", "Nhớt HD50  18L /can"]
+FALLBACK_CUSTOMERS = [("CÔNG TY TNHH KHO VẬN LOGIWARE", "0109234133"), ("Công ty TNHH Phú Tân", "0700504411")]
+
+def _load_reference_data(selected_chxd):
+    """Lấy ký hiệu hóa đơn của CHXD, tên dầu mỡ nhờn và khách hàng có MST từ các file cấu hình (nếu có)."""
+    khhd, lubricants, customers = "1K25TCH", list(FALLBACK_LUBRICANTS), list(FALLBACK_CUSTOMERS)
+    try:
+        ws = load_workbook(os.path.join(REPO_DIR, "Data.xlsx"), read_only=True, data_only=True).active
+        for row in ws.iter_rows(min_row=3, max_col=12, values_only=True):
+            if clean_string(row[3]) == selected_chxd and row[10]:
+                khhd = clean_string(row[10])
+        ws = load_workbook(os.path.join(REPO_DIR, "MaHH.xlsx"), read_only=True, data_only=True).active
+        names = [clean_string(row[0]) for row in ws.iter_rows(min_row=2, max_col=3, values_only=True) if row[0] and row[2]]
+        lubricants = [name for name in names if name not in XANG_DAU_GROUP][:30] or lubricants
+        ws = load_workbook(os.path.join(REPO_DIR, "DSKH.xlsx"), read_only=True, data_only=True).active
+        customers = [(clean_string(row[1]), clean_string(row[2])) for row in ws.iter_rows(min_row=2, max_col=4, values_only=True) if row[1] and row[2]][:100] or customers
+    except (FileNotFoundError, OSError):
+        pass
+    return khhd, lubricants, customers
+
+def iter_bkhd_rows(n_rows, khhd, lubricants, customers, invoice_date, seed=0, anonymous_ratio=0.7, lubricant_ratio=0.08, first_invoice_number=1):
+    """Sinh lần lượt n_rows dòng dữ liệu bảng kê (tuple 21 cột A-U)."""
+    rng = random.Random(seed)
+    ky_hieu = khhd[1:]
+    for i in range(n_rows):
+        if rng.random() < lubricant_ratio:
+            product = rng.choice(lubricants)
+            unit, price, vat = "Lít", rng.choice([65000, 85000, 120000, 1250000]), 0.1
+            so_luong = float(rng.randint(1, 4))
+        else:
+            product = rng.choice(XANG_DAU_GROUP)
+            unit, price, vat = "Lít", PETROL_PRICES[product], rng.choice([0.1, 0.08])
+            so_luong = round(rng.uniform(1, 60), 3)
+
+        if product in XANG_DAU_GROUP and rng.random() < anonymous_ratio:
+            ma_kh, ten_kh, dia_chi, mst = None, ANONYMOUS_CUSTOMER, None, None
+        else:
+            ten_kh, mst = rng.choice(customers)
+            ma_kh = rng.choice([None, None, f"KH{rng.randint(1, 999):03d}"])
+            dia_chi = f"Số {rng.randint(1, 500)} đường {rng.choice(['Trần Hưng Đạo', 'Lê Lợi', 'Hùng Vương'])}, Nam Định"
+
+        phai_thu = round(so_luong * price)
+        tien_hang = round(phai_thu / (1 + vat))
+        tien_thue = phai_thu - tien_hang
+        yield (
+            i + 1, invoice_date, ma_kh, ten_kh, dia_chi, mst, product, None,
+            so_luong, price, unit, None, None, tien_hang, vat, tien_thue, phai_thu,
+            "1", ky_hieu, f"{first_invoice_number + i:08d}", invoice_date,
+        )
+
+def write_bkhd_workbook(rows, target, header_title="BẢNG KÊ HÓA ĐƠN"):
+    """Ghi các dòng ra file Excel theo bố cục bảng kê (chế độ write-only để sinh được file lớn)."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("BKHD")
+    ws.append([header_title])
+    for row_index in range(2, 10):
+        ws.append([f"Thông tin tiêu đề dòng {row_index}"])
+    ws.append(["STT", "Ngày lập", "Mã KH", "Tên khách hàng", "Địa chỉ", "MST", "Tên hàng hóa", "", "Số lượng", "Đơn giá", "ĐVT",
+               "", "", "Tiền hàng", "Thuế suất", "Tiền thuế", "Tổng tiền", "Mẫu số", "Ký hiệu", "Số hóa đơn", "Ngày hóa đơn"])
+    for row in rows:
+        ws.append(row)
+    wb.save(target)
+
+def generate_bkhd(n_rows, selected_chxd="Cộng Hoà", invoice_date=datetime(2025, 3, 15), seed=0, **kwargs):
+    """Sinh một file bảng kê n_rows dòng cho CHXD đã chọn, trả về nội dung file (bytes)."""
+    khhd, lubricants, customers = _load_reference_data(selected_chxd)
+    buffer = io.BytesIO()
+    write_bkhd_workbook(iter_bkhd_rows(n_rows, khhd, lubricants, customers, invoice_date, seed=seed, **kwargs), buffer)
+    return buffer.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rows", type=int, help="số dòng hóa đơn")
+    parser.add_argument("-o", "--output", required=True, help="đường dẫn file .xlsx cần ghi")
+    parser.add_argument("--chxd", default="Cộng Hoà", help="tên CHXD (lấy ký hiệu hóa đơn từ Data.xlsx)")
+    parser.add_argument("--date", default="2025-03-15", help="ngày hóa đơn (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    content = generate_bkhd(args.rows, args.chxd, datetime.strptime(args.date, "%Y-%m-%d"), seed=args.seed)
+    with open(args.output, "wb") as f:
+        f.write(content)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+Đo tải đầu-cuối (end-to-end) của ứng dụng: chạy server cục bộ (gunicorn hoặc werkzeug), gửi đồng thời
+các bảng kê giả lập tới /process và báo cáo số request/giây, độ trễ p50/p95/p99 và RSS của từng worker.
+
+Kịch bản: one (1 giai đoạn giá), two (2 giai đoạn giá, kết quả ZIP) và confirm (bảng kê có ngày
+cần xác nhận: gửi file, lấy upload_token trên trang trả về rồi gửi lại kèm ngày đã chọn).
+Mỗi lần gửi, file được thêm chú thích ZIP khác nhau để không trúng bộ đệm kết quả (trừ khi --allow-cache-hits).
+
+    python bench/load_test.py --rows 2000 --concurrency 1 4 8 --requests 40
+    python bench/load_test.py --workers 4 --threads 2 --scenarios one --output load_results.json
+    python bench/load_test.py --baseline load_results.json --tolerance 0.2   # báo lỗi nếu thông lượng giảm
+    python bench/load_test.py --url http://127.0.0.1:8000   # đo server đang chạy (không đo RSS)
+"""
+import argparse
+import http.client
+import io
+import json
+import math
+import os
+import platform
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from urllib.parse import urlsplit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bkhd_generator import generate_bkhd  # noqa: E402
+
+SCENARIOS = ["one", "two", "confirm"]
+SELECTED_CHXD = "Cộng Hoà"
+INVOICE_DATE = datetime(2025, 3, 15)
+# Ngày <= 12 đọc được theo cả hai cách (ngày/tháng và tháng/ngày) nên cần xác nhận
+AMBIGUOUS_DATE = datetime(2025, 3, 4)
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+SERVER_START_TIMEOUT_SECONDS = 60
+RSS_SAMPLE_INTERVAL_SECONDS = 0.25
+
+_UPLOAD_TOKEN_PATTERN = re.compile(r'name="upload_token" value="([A-Za-z0-9_-]+)"')
+_CONFIRMED_DATE_PATTERN = re.compile(r'name="confirmed_date" value="([0-9-]+)"')
+
+# ==============================================================================
+# DỮ LIỆU GỬI ĐI
+# ==============================================================================
+
+def build_uploads(n_rows, seed):
+    """Sinh file bảng kê cho từng kịch bản: {kịch bản: (nội dung file, các trường form)}."""
+    normal = generate_bkhd(n_rows, SELECTED_CHXD, INVOICE_DATE, seed=seed)
+    ambiguous = generate_bkhd(n_rows, SELECTED_CHXD, AMBIGUOUS_DATE, seed=seed)
+    # Hóa đơn được đánh số từ 00000001: giá mới bắt đầu từ hóa đơn ở giữa bảng kê
+    boundary_invoice = f"{n_rows // 2 + 1:08d}"
+    return {
+        "one": (normal, {"chxd": SELECTED_CHXD, "price_periods": "1"}),
+        "two": (normal, {"chxd": SELECTED_CHXD, "price_periods": "2", "invoice_number": boundary_invoice}),
+        "confirm": (ambiguous, {"chxd": SELECTED_CHXD, "price_periods": "1"}),
+    }
+
+def unique_upload(content):
+    """Cùng bảng kê nhưng khác mã băm (thêm chú thích ZIP), để mỗi lần gửi đều được xử lý thật."""
+    buffer = io.BytesIO(content)
+    with zipfile.ZipFile(buffer, "a") as archive:
+        archive.comment = f"load-test {uuid.uuid4().hex}".encode("ascii")
+    return buffer.getvalue()
+
+def _encode_multipart(fields, file_content=None):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8"))
+    if file_content is not None:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bang_ke.xlsx"\r\n'
+            f'Content-Type: {XLSX_MIMETYPE}\r\n\r\n'.encode("utf-8")
+        )
+        parts.append(file_content)
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+# ==============================================================================
+# GỬI REQUEST
+# ==============================================================================
+
+def _post(base_url, path, fields, file_content=None):
+    """POST multipart, trả về (mã trạng thái, mimetype, nội dung)."""
+    url = urlsplit(base_url)
+    body, content_type = _encode_multipart(fields, file_content)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+    try:
+        conn.request("POST", path, body=body, headers={"Content-Type": content_type})
+        response = conn.getresponse()
+        payload = response.read()
+        mimetype = (response.getheader("Content-Type") or "").split(";")[0]
+        return response.status, mimetype, payload
+    finally:
+        conn.close()
+
+def run_flow(base_url, scenario, content, fields, allow_cache_hits=False):
+    """
+    Chạy một lượt của kịch bản, trả về (kết quả, số giây): kết quả là 'ok', 'rejected'
+    (503, bị kiểm soát tải từ chối) hoặc 'error: ...'.
+    """
+    content = content if allow_cache_hits else unique_upload(content)
+    started = time.perf_counter()
+    status, mimetype, payload = _post(base_url, "/process", fields, content)
+    if scenario == "confirm" and status == 200 and mimetype == "text/html":
+        token = _UPLOAD_TOKEN_PATTERN.search(payload.decode("utf-8", "replace"))
+        options = _CONFIRMED_DATE_PATTERN.findall(payload.decode("utf-8", "replace"))
+        if not token or not options:
+            return "error: không thấy bước xác nhận ngày", time.perf_counter() - started
+        status, mimetype, payload = _post(base_url, "/process", dict(fields, upload_token=token.group(1), confirmed_date=options[0]))
+    elapsed = time.perf_counter() - started
+
+    if status == 503:
+        return "rejected", elapsed
+    expected_mimetype = "application/zip" if scenario == "two" else XLSX_MIMETYPE
+    if status != 200 or mimetype != expected_mimetype:
+        return f"error: {status} {mimetype}", elapsed
+    return "ok", elapsed
+
+def percentile(sorted_values, fraction):
+    """Phân vị theo thứ hạng gần nhất (sorted_values đã sắp xếp tăng dần)."""
+    if not sorted_values:
+        return None
+    rank = min(max(1, math.ceil(fraction * len(sorted_values))), len(sorted_values))
+    return sorted_values[rank - 1]
+
+def run_level(base_url, scenario, upload, concurrency, n_requests, allow_cache_hits):
+    """Gửi n_requests lượt của kịch bản với concurrency luồng gửi đồng thời."""
+    content, fields = upload
+    outcomes = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_flow, base_url, scenario, content, fields, allow_cache_hits) for _ in range(n_requests)]
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except OSError as e:
+                outcomes.append((f"error: {e}", None))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = sorted(seconds for outcome, seconds in outcomes if outcome == "ok")
+    errors = [outcome for outcome, _ in outcomes if outcome.startswith("error")]
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "ok": len(latencies),
+        "rejected": sum(1 for outcome, _ in outcomes if outcome == "rejected"),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies) / wall_seconds, 3) if wall_seconds else 0.0,
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+# ==============================================================================
+# SERVER VÀ RSS CỦA CÁC WORKER
+# ==============================================================================
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(server, port, workers, threads, work_dir):
+    """
+    Chạy server trong tiến trình con. Mọi file server ghi ra (bộ đệm, kho tạm, các kho SQLite, snapshot cấu hình)
+    nằm trong work_dir để không lẫn với lần chạy khác và không ghi vào thư mục mã nguồn.
+    """
+    env = dict(
+        os.environ,
+        TMPDIR=work_dir,
+        UPSSE_INCREMENTAL_DB=os.path.join(work_dir, "incremental.sqlite3"),
+        UPSSE_CUSTOMER_DB=os.path.join(work_dir, "customers.sqlite3"),
+        UPSSE_CONFIG_SNAPSHOT=os.path.join(work_dir, "config.snapshot"),
+    )
+    if server == "gunicorn":
+        command = [
+            sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers), "--threads", str(threads), "--log-level", "warning",
+        ]
+    else:
+        command = [
+            sys.executable, "-c",
+            "import sys, app; from werkzeug.serving import run_simple; "
+            "run_simple('127.0.0.1', int(sys.argv[1]), app.create_app(), threaded=True)",
+            str(port),
+        ]
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server dừng khi khởi động (mã {process.returncode}).")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server không sẵn sàng sau thời gian chờ.")
+
+def _child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class RssSampler:
+    """
+    Lấy mẫu RSS (Linux, /proc) của tiến trình server, các worker và tiến trình của process pool.
+    forking_server: server có worker con (gunicorn); ngược lại (werkzeug) chính server là worker.
+    """
+
+    def __init__(self, server_pid, forking_server):
+        self.server_pid = server_pid
+        self.forking_server = forking_server
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _processes(self):
+        if not self.forking_server:
+            return [(self.server_pid, "worker")] + [(child, "pool") for child in _child_pids(self.server_pid)]
+        processes = [(self.server_pid, "master")]
+        for child in _child_pids(self.server_pid):
+            processes.append((child, "worker"))
+            processes.extend((grandchild, "pool") for grandchild in _child_pids(child))
+        return processes
+
+    def sample(self):
+        for pid, role in self._processes():
+            rss = _rss_bytes(pid)
+            if rss is None:
+                continue
+            entry = self.samples.setdefault(pid, {"pid": pid, "role": role, "peak_rss_mb": 0.0, "last_rss_mb": 0.0})
+            entry["last_rss_mb"] = round(rss / (1024 * 1024), 1)
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"], entry["last_rss_mb"])
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL_SECONDS):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def report(self):
+        return sorted(self.samples.values(), key=lambda entry: (entry["role"] != "master", entry["role"], entry["pid"]))
+
+# ==============================================================================
+# BÁO CÁO
+# ==============================================================================
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Trả về danh sách (kịch bản, mức đồng thời) có thông lượng thấp hơn baseline quá tolerance."""
+    baseline_index = {(entry["scenario"], entry["concurrency"]): entry for entry in baseline["results"]}
+    regressions = []
+    for entry in results:
+        reference = baseline_index.get((entry["scenario"], entry["concurrency"]))
+        if not reference or not reference["throughput_rps"]:
+            continue
+        if entry["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{entry['scenario']} x{entry['concurrency']}: {reference['throughput_rps']:.2f} -> {entry['throughput_rps']:.2f} req/s")
+    return regressions
+
+def print_report(results, rss):
+    print(f"{'kịch bản':<9} {'đồng thời':>9} {'ok':>5} {'503':>5} {'lỗi':>5} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for entry in results:
+        latencies = " ".join(f"{entry[name]:7.1f}ms" if entry[name] is not None else f"{'-':>9}" for name in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{entry['scenario']:<9} {entry['concurrency']:>9} {entry['ok']:>5} {entry['rejected']:>5} {entry['errors']:>5} "
+              f"{entry['throughput_rps']:>8.2f} {latencies}")
+        if entry["first_error"]:
+            print(f"{'':<9} lỗi đầu tiên: {entry['first_error']}")
+    if rss:
+        print(f"\n{'tiến trình':<12} {'pid':>8} {'RSS đỉnh':>10} {'RSS cuối':>10}")
+        for entry in rss:
+            print(f"{entry['role']:<12} {entry['pid']:>8} {entry['peak_rss_mb']:>8.1f}MB {entry['last_rss_mb']:>8.1f}MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--rows", type=int, default=2000, help="số dòng của mỗi bảng kê")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="các mức số request gửi đồng thời")
+    parser.add_argument("--requests", type=int, default=40, help="số lượt gửi ở mỗi (kịch bản, mức đồng thời)")
+    parser.add_argument("--server", default="gunicorn", choices=["gunicorn", "werkzeug"])
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 2)), help="số worker gunicorn")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("GUNICORN_THREADS", 4)), help="số luồng mỗi worker gunicorn")
+    parser.add_argument("--url", help="đo server đang chạy ở địa chỉ này thay vì tự chạy server")
+    parser.add_argument("--allow-cache-hits", action="store_true", help="gửi nguyên file (lần gửi lại sẽ trúng bộ đệm kết quả)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    parser.add_argument("--baseline", help="file JSON kết quả cũ để so sánh thông lượng")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="mức giảm thông lượng cho phép so với baseline")
+    args = parser.parse_args()
+
+    uploads = build_uploads(args.rows, args.seed)
+    work_dir = tempfile.mkdtemp(prefix="upsse_load_test_")
+    process = None
+    try:
+        if args.url:
+            base_url, sampler = args.url.rstrip("/"), None
+        else:
+            port = _free_port()
+            process = start_server(args.server, port, args.workers, args.threads, work_dir)
+            base_url, sampler = f"http://127.0.0.1:{port}", RssSampler(process.pid, args.server == "gunicorn")
+
+        # Lượt chạy khởi động (nạp cấu hình, import lười...) không được tính
+        for scenario in args.scenarios:
+            run_flow(base_url, scenario, *uploads[scenario])
+
+        results = []
+        with sampler or nullcontext():
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    entry = run_level(base_url, scenario, uploads[scenario], concurrency, args.requests, args.allow_cache_hits)
+                    results.append(entry)
+                    print(f"Đã đo {scenario} x{concurrency}", file=sys.stderr)
+        rss = sampler.report() if sampler else []
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "server": "external" if args.url else args.server,
+            "workers": None if args.url or args.server != "gunicorn" else args.workers,
+            "threads": None if args.url or args.server != "gunicorn" else args.threads,
+            "rows": args.rows,
+            "requests": args.requests,
+        },
+        "results": results,
+        "rss": rss,
+    }
+    print_report(results, rss)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nThông lượng thấp hơn baseline:")
+            print("\n".join(f"  {line}" for line in regressions))
+            sys.exit(1)
+        print("\nKhông có kịch bản nào chậm hơn baseline.")
+
+if __name__ == "__main__":
+    main()
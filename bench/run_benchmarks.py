@@ -0,0 +1,229 @@
+"""
+Đo thời gian và bộ nhớ của từng giai đoạn xử lý bảng kê với dữ liệu giả lập.
+
+Các giai đoạn: config_load, read (đọc và quét file một lần, bộ đọc chọn bằng --reader), date_analysis,
+validation, transformation, workbook_write, zip và end_to_end (process_uploaded_file).
+Thời gian đo ở lần chạy không bật tracemalloc; bộ nhớ đỉnh (peak) đo ở lần chạy riêng có tracemalloc.
+Khi đo cả hai engine (--engines row columnar), kết quả của hai bộ xử lý được đối chiếu trên dữ liệu sinh ra
+và trên bản có trộn kiểu dữ liệu (None/NaN, int/float/bool, date/datetime); lệch nhau thì thoát với mã lỗi.
+
+    python bench/run_benchmarks.py --sizes 100 1000 10000 --output bench_results.json
+    python bench/run_benchmarks.py --sizes 100 1000 --baseline bench_results.json --tolerance 0.25
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.chdir(REPO_DIR)
+
+import logic_handler  # noqa: E402
+from columnar_engine import find_engine_mismatch  # noqa: E402
+from bkhd_generator import generate_bkhd  # noqa: E402
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000, 200000]
+SELECTED_CHXD = "Cộng Hoà"
+INVOICE_DATE = datetime(2025, 3, 15)
+STAGES = ["config_load", "read", "date_analysis", "validation", "transformation", "workbook_write", "zip", "end_to_end"]
+CONFIG_PATHS = ("Data.xlsx", "MaHH.xlsx", "DSKH.xlsx")
+
+def _load_input(n_rows, cache_dir, seed):
+    """Sinh (hoặc lấy lại từ thư mục cache) file bảng kê n_rows dòng."""
+    path = os.path.join(cache_dir, f"bkhd_{n_rows}_{seed}.xlsx")
+    if not os.path.exists(path):
+        content = generate_bkhd(n_rows, SELECTED_CHXD, INVOICE_DATE, seed=seed)
+        with open(path, "wb") as f:
+            f.write(content)
+    with open(path, "rb") as f:
+        return f.read()
+
+def _run_pipeline(content, engine, measure):
+    """Chạy lần lượt từng giai đoạn; measure(tên giai đoạn, hàm) đo và trả về kết quả của hàm."""
+    static_data, error = measure("config_load", lambda: logic_handler.load_static_data(*CONFIG_PATHS))
+    if error:
+        raise RuntimeError(error)
+    bkhd_data = measure("read", lambda: logic_handler.read_bkhd_file(content))
+    _, final_date, _ = measure("date_analysis", lambda: logic_handler._analyze_date_ambiguity(bkhd_data))
+    measure("validation", lambda: logic_handler._validate_input(bkhd_data, SELECTED_CHXD, static_data["khhd_map"]))
+    original_invoice_rows, bvmt_rows = measure("transformation", lambda: logic_handler._build_upsse_rows(
+        bkhd_data["rows"], static_data, SELECTED_CHXD, final_date, logic_handler._summary_suffix_map(0), engine))
+    output = measure("workbook_write", lambda: logic_handler._write_upsse_workbook(itertools.chain(original_invoice_rows, bvmt_rows)))
+
+    def build_zip():
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
+            zipf.writestr("UpSSE.xlsx", output.getvalue())
+        return zip_buffer
+    zip_buffer = measure("zip", build_zip)
+    measure("end_to_end", lambda: logic_handler.process_uploaded_file(
+        content, static_data, SELECTED_CHXD, "1", "", INVOICE_DATE.strftime("%Y-%m-%d"), engine=engine))
+    return {
+        "rows_in": len(bkhd_data["rows"]),
+        "rows_out": len(original_invoice_rows) + len(bvmt_rows),
+        "input_bytes": len(content),
+        "output_bytes": len(output.getvalue()),
+        "zip_bytes": len(zip_buffer.getvalue()),
+    }
+
+def benchmark_size(content, engine, repeat):
+    timings = {stage: [] for stage in STAGES}
+
+    def timed(stage, func):
+        started = time.perf_counter()
+        result = func()
+        timings[stage].append(time.perf_counter() - started)
+        return result
+
+    for _ in range(repeat):
+        sizes = _run_pipeline(content, engine, timed)
+
+    peaks = {}
+
+    def traced(stage, func):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = func()
+        peaks[stage] = (tracemalloc.get_traced_memory()[1] - baseline) / (1024 * 1024)
+        return result
+
+    tracemalloc.start()
+    try:
+        _run_pipeline(content, engine, traced)
+    finally:
+        tracemalloc.stop()
+
+    stages = {
+        stage: {"seconds": statistics.median(timings[stage]), "peak_mb": round(peaks[stage], 3)}
+        for stage in STAGES
+    }
+    return dict(sizes, stages=stages)
+
+def _mix_cell_types(rows, seed):
+    """
+    Bản sao các dòng bảng kê với kiểu dữ liệu lẫn lộn như file Excel thật: số nguyên/thực/bool, ô trống (None/NaN),
+    MST dạng số, ngày dạng date thay cho datetime.
+    """
+    rng = random.Random(seed)
+    mixers = [
+        lambda row: row.__setitem__(8, int(row[8]) if float(row[8]).is_integer() else row[8]),
+        lambda row: row.__setitem__(9, float(row[9])),
+        lambda row: row.__setitem__(2, float("nan") if row[2] is None else None),
+        lambda row: row.__setitem__(4, float("nan")),
+        lambda row: row.__setitem__(5, int(row[5]) if row[5] and str(row[5]).isdigit() else row[5]),
+        lambda row: row.__setitem__(13, None),
+        lambda row: row.__setitem__(14, True if row[14] == 1 else row[14]),
+        lambda row: row.__setitem__(15, float(row[15])),
+        lambda row: row.__setitem__(20, row[20].date() if isinstance(row[20], datetime) else row[20]),
+    ]
+    mixed_rows = []
+    for row in rows:
+        row = list(row)
+        for mixer in rng.sample(mixers, 3):
+            mixer(row)
+        mixed_rows.append(tuple(row))
+    return mixed_rows
+
+def check_engine_parity(content, seed):
+    """Đối chiếu kết quả của engine row và columnar; trả về danh sách mô tả các chỗ lệch (rỗng nếu khớp)."""
+    static_data, error = logic_handler.load_static_data(*CONFIG_PATHS)
+    if error:
+        raise RuntimeError(error)
+    rows = logic_handler.read_bkhd_file(content)["rows"]
+    mismatches = []
+    for label, rows_to_check in (("dữ liệu sinh", rows), ("trộn kiểu dữ liệu", _mix_cell_types(rows, seed))):
+        mismatch = find_engine_mismatch(rows_to_check, static_data, SELECTED_CHXD, INVOICE_DATE, logic_handler._summary_suffix_map(0))
+        if mismatch:
+            line_index, row_line, columnar_line = mismatch
+            mismatches.append(f"{label}, dòng UpSSE {line_index}: row={row_line!r} columnar={columnar_line!r}")
+    return mismatches
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Trả về danh sách các giai đoạn chậm hơn baseline quá tolerance (ví dụ 0.2 = 20%)."""
+    baseline_index = {(entry["rows"], entry["engine"]): entry for entry in baseline["results"]}
+    regressions = []
+    for entry in results:
+        reference = baseline_index.get((entry["rows"], entry["engine"]))
+        if not reference:
+            continue
+        for stage, values in entry["stages"].items():
+            reference_seconds = reference["stages"].get(stage, {}).get("seconds")
+            # Bỏ qua các giai đoạn quá ngắn, sai số đo lớn hơn chênh lệch thật
+            if reference_seconds and reference_seconds >= 0.005 and values["seconds"] > reference_seconds * (1 + tolerance):
+                regressions.append(f"{entry['rows']} dòng [{entry['engine']}] {stage}: {reference_seconds:.4f}s -> {values['seconds']:.4f}s")
+    return regressions
+
+def print_table(results):
+    print(f"{'dòng':>8} {'engine':<9} " + " ".join(f"{stage:>14}" for stage in STAGES))
+    for entry in results:
+        cells = " ".join(f"{entry['stages'][s]['seconds'] * 1000:8.1f}ms/{entry['stages'][s]['peak_mb']:4.0f}M" for s in STAGES)
+        print(f"{entry['rows']:>8} {entry['engine']:<9} {cells}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="số dòng bảng kê cần đo")
+    parser.add_argument("--engines", nargs="+", default=["row"], choices=["row", "columnar"])
+    parser.add_argument("--reader", default=logic_handler.BKHD_READER, choices=["native", "openpyxl"], help="bộ đọc file bảng kê")
+    parser.add_argument("--repeat", type=int, default=3, help="số lần đo thời gian (lấy trung vị)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "upsse_bench_inputs"), help="thư mục lưu file bảng kê đã sinh")
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    parser.add_argument("--baseline", help="file JSON kết quả cũ để so sánh")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="mức chậm hơn cho phép so với baseline")
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    logic_handler.BKHD_READER = args.reader
+    results = []
+    engine_mismatches = []
+    for n_rows in args.sizes:
+        content = _load_input(n_rows, args.cache_dir, args.seed)
+        if {"row", "columnar"} <= set(args.engines):
+            engine_mismatches += [f"{n_rows} dòng, {line}" for line in check_engine_parity(content, args.seed)]
+        for engine in args.engines:
+            entry = benchmark_size(content, engine, args.repeat)
+            results.append(dict(rows=n_rows, engine=engine, **entry))
+            print(f"Đã đo {n_rows} dòng [{engine}]", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "reader": args.reader,
+        },
+        "results": results,
+    }
+    print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if engine_mismatches:
+        print("\nKết quả engine row và columnar khác nhau:")
+        print("\n".join(f"  {line}" for line in engine_mismatches))
+        sys.exit(1)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nChậm hơn baseline:")
+            print("\n".join(f"  {line}" for line in regressions))
+            sys.exit(1)
+        print("\nKhông có giai đoạn nào chậm hơn baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Báo cáo thời gian import và khởi động nguội (cold start) của ứng dụng.
+
+Mỗi phép đo chạy trong một tiến trình Python mới để đo đúng trạng thái "nguội":
+    python bench/startup_report.py                 # in báo cáo
+    python bench/startup_report.py --json out.json # ghi thêm kết quả dạng JSON
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["flask", "openpyxl", "numpy", "pandas", "logic_handler", "columnar_engine"]
+
+# Đoạn mã chạy trong tiến trình con, in ra một dòng JSON
+_COLD_START_PROBE = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app as app_module
+t_import = time.perf_counter()
+if {use_factory}:
+    flask_app = app_module.create_app()
+else:
+    flask_app = app_module.app
+t_ready = time.perf_counter()
+client = flask_app.test_client()
+client.get('/')
+t_first = time.perf_counter()
+client.get('/')
+t_second = time.perf_counter()
+print(json.dumps({{
+    "import_s": t_import - t0,
+    "ready_s": t_ready - t0,
+    "first_request_s": t_first - t_ready,
+    "second_request_s": t_second - t_first,
+    "cold_start_total_s": t_first - t0,
+    "loaded_modules": sorted(m for m in {heavy_modules!r} if m in sys.modules),
+}}))
+'''
+
+def measure_import_times():
+    """Chạy `python -X importtime -c 'import app'`, trả về thời gian import tích lũy (giây) của từng module."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative_us = int(parts[1])
+        except ValueError:
+            continue  # dòng tiêu đề
+        cumulative[parts[2].strip()] = cumulative_us / 1e6
+    return cumulative
+
+def measure_cold_start(use_factory):
+    code = _COLD_START_PROBE.format(use_factory=use_factory, heavy_modules=HEAVY_MODULES)
+    completed = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def _median_of(samples, key):
+    return statistics.median(sample[key] for sample in samples)
+
+def build_report(repeat):
+    import_samples = [measure_import_times() for _ in range(repeat)]
+    report = {
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "import_time_s": {
+            module: statistics.median(sample.get(module, 0.0) for sample in import_samples)
+            for module in ["app"] + HEAVY_MODULES
+        },
+        "cold_start": {},
+    }
+    for label, use_factory in (("app", False), ("create_app", True)):
+        samples = [measure_cold_start(use_factory) for _ in range(repeat)]
+        report["cold_start"][label] = {
+            key: _median_of(samples, key)
+            for key in ("import_s", "ready_s", "first_request_s", "second_request_s", "cold_start_total_s")
+        }
+        report["cold_start"][label]["loaded_modules"] = samples[-1]["loaded_modules"]
+    return report
+
+def print_report(report):
+    print(f"Python {report['python']} - trung vị của {report['repeat']} lần đo")
+    print("\nThời gian import (tích lũy):")
+    for module, seconds in report["import_time_s"].items():
+        print(f"  {module:<18} {seconds * 1000:8.1f} ms")
+    print("\nKhởi động nguội:")
+    for label, values in report["cold_start"].items():
+        print(f"  [{label}]")
+        print(f"    import app            {values['import_s'] * 1000:8.1f} ms")
+        print(f"    sẵn sàng nhận request {values['ready_s'] * 1000:8.1f} ms")
+        print(f"    request đầu tiên      {values['first_request_s'] * 1000:8.1f} ms")
+        print(f"    request thứ hai       {values['second_request_s'] * 1000:8.1f} ms")
+        print(f"    tổng tới response đầu {values['cold_start_total_s'] * 1000:8.1f} ms")
+        print(f"    module nặng đã nạp    {', '.join(values['loaded_modules'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="số lần đo mỗi chỉ số (lấy trung vị)")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    report = build_report(args.repeat)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+from logic_handler import (
+    BKHD_MAX_COLUMN, XANG_DAU_GROUP, clean_string, to_float, format_tax_code,
+    get_chxd_context, lookup_customer_codes, _append_summary_rows, _upsse_row_shared, UpsseRow, BvmtRow
+)
+
+# ==============================================================================
+# BỘ XỬ LÝ THEO CỘT (COLUMNAR ENGINE)
+# ==============================================================================
+# Nạp bảng kê thành các mảng theo cột và tính giá bán, tiền thuế, tiền hàng và số tổng hợp
+# của khách vãng lai bằng phép toán trên cả mảng (dòng thuế BVMT được tính lúc ghi file, xem BvmtRow).
+# Kết quả phải GIỐNG HỆT bộ xử lý từng dòng (_build_upsse_rows_by_row), nên:
+#   - Các hàm làm sạch chuỗi chỉ được gọi một lần cho mỗi giá trị khác nhau.
+#   - Phép làm tròn dùng np.rint (làm tròn về số chẵn gần nhất, giống round() của Python).
+#   - Tổng của khách vãng lai dùng np.cumsum (cộng lần lượt theo thứ tự dòng, giống vòng lặp +=),
+#     không dùng sum() vì numpy cộng theo cặp và có thể lệch ở chữ số cuối.
+
+ANONYMOUS_CUSTOMER = "Người mua không lấy hóa đơn"
+
+def _map_distinct(values, func):
+    """
+    Áp dụng func cho mỗi giá trị khác nhau của mảng (phân biệt cả kiểu dữ liệu, ví dụ 1 và 1.0),
+    trả về mảng object cùng độ dài.
+    """
+    if len(values) == 0:
+        return np.empty(0, dtype=object)
+    series = pd.Series(values, dtype=object)
+    value_codes, _ = pd.factorize(series, use_na_sentinel=False)
+    type_codes, type_uniques = pd.factorize(series.map(type), use_na_sentinel=False)
+    combined_codes = value_codes.astype(np.int64) * len(type_uniques) + type_codes
+    _, first_index, inverse = np.unique(combined_codes, return_index=True, return_inverse=True)
+    mapped = np.empty(len(first_index), dtype=object)
+    mapped[:] = [func(value) for value in values[first_index]]
+    return mapped[inverse]
+
+def _to_float_column(values):
+    """Giống to_float cho cả cột: số int/float được chuyển thẳng, các giá trị khác đi qua to_float."""
+    result = np.empty(len(values), dtype=np.float64)
+    value_types = pd.Series(values, dtype=object).map(type).to_numpy()
+    is_native = (value_types == float) | (value_types == int)
+    result[is_native] = values[is_native].astype(np.float64)
+    if not is_native.all():
+        result[~is_native] = _map_distinct(values[~is_native], to_float).astype(np.float64)
+    return result
+
+def _to_int_list(float_values):
+    """Làm tròn như round() của Python và trả về list số nguyên Python."""
+    return [int(value) for value in np.rint(float_values)]
+
+def _str_or_empty(value):
+    return str(value or '').strip()
+
+def build_upsse_rows_columnar(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map):
+    """Bộ xử lý theo cột: cùng đầu vào và kết quả (dòng hóa đơn, dòng thuế BVMT) như bộ xử lý từng dòng."""
+    chxd_context = get_chxd_context(static_data, selected_chxd)
+    ma_kho = chxd_context['ma_kho']
+    ma_hang_map = static_data['ma_hang_map']
+    phi_bvmt_map = static_data['phi_bvmt_map']
+    chxd_vu_viec_map = chxd_context['vu_viec_map']
+    default_vu_viec = chxd_vu_viec_map.get("Dầu mỡ nhờn", '')
+
+    # --- Nạp dữ liệu thành các cột ---
+    table = np.empty((len(rows_to_process), BKHD_MAX_COLUMN), dtype=object)
+    table.fill(None)
+    for row_index, bkhd_row in enumerate(rows_to_process):
+        row_width = min(len(bkhd_row), BKHD_MAX_COLUMN)
+        table[row_index, :row_width] = bkhd_row[:row_width]
+
+    so_luong_all = _to_float_column(table[:, 8])
+    # Giống điều kiện "<= 0 thì bỏ qua" của bộ xử lý từng dòng (NaN vẫn được giữ lại)
+    table = table[~(so_luong_all <= 0)]
+    so_luong = so_luong_all[~(so_luong_all <= 0)]
+
+    ten_kh = _map_distinct(table[:, 3], clean_string)
+    ten_mat_hang = _map_distinct(table[:, 6], clean_string)
+    is_anonymous = ten_kh == ANONYMOUS_CUSTOMER
+    is_petrol = np.isin(ten_mat_hang, XANG_DAU_GROUP)
+    is_summary = is_anonymous & is_petrol
+    is_detail = ~is_summary
+
+    # --- Các dòng hóa đơn riêng lẻ ---
+    detail = table[is_detail]
+    d_ten_kh = ten_kh[is_detail]
+    d_ten_mat_hang = ten_mat_hang[is_detail]
+    d_is_petrol = is_petrol[is_detail]
+    d_so_luong = so_luong[is_detail]
+
+    ky_hieu_shd = _map_distinct(detail[:, 18], _str_or_empty)
+    so_hd_goc = _map_distinct(detail[:, 19], _str_or_empty)
+    if selected_chxd == "Nguyễn Huệ":
+        so_hoa_don_moi = ["HN" + so_hd[-6:] for so_hd in so_hd_goc]
+    else:
+        so_hoa_don_moi = [ky_hieu[-2:] + so_hd[-6:] for ky_hieu, so_hd in zip(ky_hieu_shd, so_hd_goc)]
+    ky_hieu = _map_distinct(detail[:, 17], clean_string) + _map_distinct(detail[:, 18], clean_string)
+    ma_hang = _map_distinct(d_ten_mat_hang, lambda name: ma_hang_map.get(name, ''))
+    don_vi_tinh = _map_distinct(detail[:, 10], clean_string)
+    ma_vu_viec = _map_distinct(d_ten_mat_hang, lambda name: chxd_vu_viec_map.get(name, default_vu_viec))
+    dia_chi = _map_distinct(detail[:, 4], clean_string)
+    mst_khach_hang = _map_distinct(detail[:, 5], clean_string)
+    ma_kh_fast = _map_distinct(detail[:, 2], clean_string)
+    mst_to_makh_map = lookup_customer_codes(static_data, detail[:, 5])
+    ma_kh_from_mst = _map_distinct(mst_khach_hang, lambda mst: mst_to_makh_map.get(mst) if mst else None)
+    ma_khach_final = [
+        kh_fast if kh_fast and len(kh_fast) < 12 else (kh_mst if kh_mst else ma_kho)
+        for kh_fast, kh_mst in zip(ma_kh_fast, ma_kh_from_mst)
+    ]
+
+    phi_bvmt = np.where(d_is_petrol, _map_distinct(d_ten_mat_hang, lambda name: phi_bvmt_map.get(name, 0.0)).astype(np.float64), 0.0)
+    ma_thue = _map_distinct(detail[:, 14], format_tax_code)
+    thue_suat = _map_distinct(ma_thue, lambda code: to_float(code) / 100.0 if code else 0.0).astype(np.float64)
+    don_gia = _to_float_column(detail[:, 9])
+    gia_ban = don_gia - phi_bvmt
+    tien_thue_goc = _to_float_column(detail[:, 15])
+    tien_thue_moi = tien_thue_goc - np.rint(phi_bvmt * d_so_luong * thue_suat)
+    tien_hang = np.where(
+        d_is_petrol,
+        _to_float_column(detail[:, 16]) - tien_thue_goc - np.rint(phi_bvmt * d_so_luong),
+        _to_float_column(detail[:, 13])
+    )
+    # round(x, 3) của Python làm tròn theo biểu diễn thập phân, numpy không đảm bảo giống hệt
+    so_luong_3 = [round(value, 3) for value in d_so_luong.tolist()]
+
+    shared = _upsse_row_shared(chxd_context, final_date)
+    original_invoice_rows = [
+        UpsseRow(shared, ma_khach, ten, so_hd, kh, mh, tmh, dvt, sl, gb, th, mt, vv, dc, mst, tt)
+        for ma_khach, ten, so_hd, kh, mh, tmh, dvt, sl, gb, th, mt, vv, dc, mst, tt in zip(
+            ma_khach_final, d_ten_kh.tolist(), so_hoa_don_moi, ky_hieu.tolist(), ma_hang.tolist(), d_ten_mat_hang.tolist(),
+            don_vi_tinh.tolist(), so_luong_3, gia_ban.tolist(), _to_int_list(tien_hang), ma_thue.tolist(),
+            ma_vu_viec.tolist(), dia_chi.tolist(), mst_khach_hang.tolist(), _to_int_list(tien_thue_moi)
+        )
+    ]
+
+    # --- Dòng thuế BVMT cho các dòng xăng dầu (các cột được tính từ dòng gốc lúc ghi file) ---
+    bvmt_rows = [
+        BvmtRow(original_invoice_rows[position], phi_bvmt_map.get(original_invoice_rows[position].ten_mat_hang, 0.0))
+        for position in np.flatnonzero(d_is_petrol).tolist()
+    ]
+
+    # --- Gom khách vãng lai mua xăng dầu theo mặt hàng ---
+    summary = table[is_summary]
+    s_ten_mat_hang = ten_mat_hang[is_summary]
+    s_so_luong = so_luong[is_summary]
+    s_tien_thue_goc = _to_float_column(summary[:, 15])
+    s_phai_thu = _to_float_column(summary[:, 16])
+
+    prefix_sources = [value for value in _map_distinct(summary[:, 18], _str_or_empty) if value]
+    first_invoice_prefix_source = prefix_sources[0] if prefix_sources else ""
+
+    summary_data = {}
+    product_codes, product_names = pd.factorize(s_ten_mat_hang)
+    for product_code, product_name in enumerate(product_names):
+        product_mask = product_codes == product_code
+        first_row = summary[np.argmax(product_mask)]
+        summary_data[product_name] = {
+            'total_so_luong_bkhd': np.cumsum(s_so_luong[product_mask])[-1].item(),
+            'total_tien_thue_goc': np.cumsum(s_tien_thue_goc[product_mask])[-1].item(),
+            'total_phai_thu': np.cumsum(s_phai_thu[product_mask])[-1].item(),
+            'first_invoice_data': {'ky_hieu_mau_so': clean_string(first_row[17]), 'ky_hieu_ky_hieu': clean_string(first_row[18]), 'don_gia': to_float(first_row[9]), 'vat_raw': first_row[14]}
+        }
+
+    _append_summary_rows(original_invoice_rows, bvmt_rows, summary_data, first_invoice_prefix_source, static_data, chxd_context, final_date, summary_suffix_map)
+    return original_invoice_rows, bvmt_rows
+
+def find_engine_mismatch(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map):
+    """
+    Chạy cả hai bộ xử lý trên cùng dữ liệu để đối chiếu.
+    Trả về None nếu kết quả giống hệt (cả giá trị lẫn kiểu dữ liệu), ngược lại trả về
+    (vị trí dòng, dòng của bộ xử lý từng dòng, dòng của bộ xử lý theo cột) đầu tiên bị lệch.
+    """
+    from logic_handler import _build_upsse_rows_by_row
+    row_result = _build_upsse_rows_by_row(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map)
+    columnar_result = build_upsse_rows_columnar(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map)
+    row_lines = [row.to_list() for row in row_result[0] + row_result[1]]
+    columnar_lines = [row.to_list() for row in columnar_result[0] + columnar_result[1]]
+    for line_index in range(max(len(row_lines), len(columnar_lines))):
+        row_line = row_lines[line_index] if line_index < len(row_lines) else None
+        columnar_line = columnar_lines[line_index] if line_index < len(columnar_lines) else None
+        if row_line is None or columnar_line is None or row_line != columnar_line or any(type(a) is not type(b) for a, b in zip(row_line, columnar_line)):
+            return line_index, row_line, columnar_line
+    return None
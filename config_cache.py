@@ -0,0 +1,74 @@
+import hashlib
+import os
+import threading
+
+from config_snapshot import load_static_data_from_snapshot
+
+# ==============================================================================
+# BỘ ĐỆM DỮ LIỆU TĨNH (Data.xlsx, MaHH.xlsx, DSKH.xlsx)
+# ==============================================================================
+# static_data đã biên dịch được giữ trong bộ nhớ của tiến trình và chỉ nạp lại
+# khi mtime hoặc kích thước của một trong các file nguồn thay đổi. Khi nạp lại, dữ liệu được
+# lấy từ snapshot nhị phân nếu snapshot còn mới (xem config_snapshot.py).
+# Lưu ý: static_data được dùng chung giữa các luồng, chỉ được đọc, không được sửa.
+
+_cache_lock = threading.Lock()
+_cache_entries = {}
+_cache_stats = {"hits": 0, "misses": 0, "reloads": 0, "errors": 0}
+
+def _file_signature(path):
+    """Trả về (mtime_ns, size) của file, dùng để phát hiện file cấu hình đã thay đổi."""
+    stat_result = os.stat(path)
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+def _source_signature(paths):
+    try:
+        return tuple(_file_signature(path) for path in paths)
+    except OSError:
+        return None
+
+def get_static_data(data_file_path, mahh_file_path, dskh_file_path):
+    """
+    Giống load_static_data nhưng dùng bộ đệm: trả về (static_data, error_message).
+    Chỉ đọc lại file Excel khi file nguồn thay đổi. Kết quả lỗi không được lưu đệm.
+    """
+    paths = (data_file_path, mahh_file_path, dskh_file_path)
+    signature = _source_signature(paths)
+
+    with _cache_lock:
+        entry = _cache_entries.get(paths)
+        if entry is not None and signature is not None and entry["signature"] == signature:
+            _cache_stats["hits"] += 1
+            return entry["static_data"], None
+
+        _cache_stats["misses"] += 1
+        # Giữ khóa trong lúc nạp để nhiều luồng không cùng parse lại một lúc
+        static_data, error_message = load_static_data_from_snapshot(*paths)
+        if error_message or signature is None:
+            _cache_stats["errors"] += 1
+            return static_data, error_message
+
+        if entry is not None:
+            _cache_stats["reloads"] += 1
+        _cache_entries[paths] = {"signature": signature, "static_data": static_data}
+        return static_data, None
+
+def get_config_fingerprint(data_file_path, mahh_file_path, dskh_file_path):
+    """
+    Dấu vân tay (16 ký tự hex) của bộ file cấu hình, đổi khi một trong các file thay đổi (mtime hoặc kích thước).
+    Dùng làm một phần khóa của các kết quả được tính từ cấu hình này.
+    """
+    signature = _source_signature((data_file_path, mahh_file_path, dskh_file_path))
+    return hashlib.sha256(repr(signature).encode("utf-8")).hexdigest()[:16]
+
+def get_cache_stats():
+    """Trả về bản sao các bộ đếm hit/miss của bộ đệm cấu hình."""
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["entries"] = len(_cache_entries)
+    return stats
+
+def clear_cache():
+    """Xóa toàn bộ bộ đệm, lần gọi tiếp theo sẽ đọc lại file cấu hình."""
+    with _cache_lock:
+        _cache_entries.clear()
@@ -0,0 +1,134 @@
+"""
+Biên dịch Data.xlsx, MaHH.xlsx và DSKH.xlsx thành file snapshot nhị phân (đọc trong vài ms).
+
+    python config_snapshot.py                      # biên dịch lại snapshot cho các file cấu hình mặc định
+    python config_snapshot.py --output cfg.snapshot --data Data.xlsx --mahh MaHH.xlsx --dskh DSKH.xlsx
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+from metrics import timed_stage
+from logic_handler import load_static_data, attach_customer_store
+
+# ==============================================================================
+# SNAPSHOT NHỊ PHÂN CỦA DỮ LIỆU TĨNH
+# ==============================================================================
+# Đọc 3 file Excel bằng openpyxl chậm (DSKH ngày càng lớn) trong khi kết quả chỉ là vài bảng tra cứu.
+# static_data do load_static_data tạo ra được lưu nguyên vào một file snapshot, kèm phiên bản định dạng
+# và (đường dẫn, mtime, kích thước) của các file nguồn. Khi nạp, snapshot chỉ được dùng nếu khớp
+# với các file nguồn hiện tại; ngược lại đọc lại file Excel và ghi snapshot mới.
+# Snapshot do chính ứng dụng ghi ra (pickle), không nhận file snapshot từ nguồn không tin cậy.
+
+SNAPSHOT_MAGIC = b"UPSSECFG"
+# Tăng khi cấu trúc static_data thay đổi để snapshot cũ tự bị bỏ qua
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_FILE_NAME = os.environ.get("UPSSE_CONFIG_SNAPSHOT", "config.snapshot")
+
+def default_snapshot_path(data_file_path):
+    """Snapshot nằm cạnh Data.xlsx (đường dẫn tuyệt đối trong UPSSE_CONFIG_SNAPSHOT cũng được chấp nhận)."""
+    return os.path.join(os.path.dirname(os.path.abspath(data_file_path)), SNAPSHOT_FILE_NAME)
+
+def _source_info(paths):
+    """[(đường dẫn tuyệt đối, mtime_ns, kích thước)] của các file nguồn, None nếu thiếu file."""
+    try:
+        stats = [os.stat(path) for path in paths]
+    except OSError:
+        return None
+    return [(os.path.abspath(path), stat_result.st_mtime_ns, stat_result.st_size) for path, stat_result in zip(paths, stats)]
+
+def write_snapshot(snapshot_path, static_data, sources):
+    """Ghi snapshot (ghi ra file tạm rồi đổi tên để tiến trình khác không đọc phải file dở dang)."""
+    payload = {"version": SNAPSHOT_FORMAT_VERSION, "sources": sources, "static_data": static_data}
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def read_snapshot(snapshot_path, sources):
+    """Trả về static_data trong snapshot nếu đúng phiên bản và khớp với các file nguồn, ngược lại None."""
+    try:
+        with open(snapshot_path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None
+            payload = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError, ImportError):
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != SNAPSHOT_FORMAT_VERSION:
+        return None
+    if payload.get("sources") != sources:
+        return None
+    return payload.get("static_data")
+
+@timed_stage("load_config_snapshot")
+def load_static_data_from_snapshot(data_file_path, mahh_file_path, dskh_file_path, snapshot_path=None):
+    """
+    Giống load_static_data (trả về (static_data, error_message)) nhưng đọc từ snapshot khi còn mới.
+    Snapshot cũ hơn file nguồn (hoặc hỏng, khác phiên bản) được biên dịch lại; nếu không ghi được
+    snapshot thì vẫn trả về kết quả đọc từ file Excel.
+    """
+    paths = (data_file_path, mahh_file_path, dskh_file_path)
+    snapshot_path = snapshot_path or default_snapshot_path(data_file_path)
+    sources = _source_info(paths)
+    if sources is not None:
+        static_data = read_snapshot(snapshot_path, sources)
+        if static_data is not None:
+            # Kho khách hàng nằm ngoài snapshot (UPSSE_CUSTOMER_DB) nên vẫn được đồng bộ khi nạp cấu hình
+            attach_customer_store(static_data, dskh_file_path)
+            return static_data, None
+
+    static_data, error_message = load_static_data(*paths)
+    # Chỉ ghi snapshot khi file nguồn không đổi trong lúc đọc
+    if not error_message and sources is not None and _source_info(paths) == sources:
+        try:
+            write_snapshot(snapshot_path, static_data, sources)
+        except OSError:
+            pass
+    return static_data, error_message
+
+def rebuild_snapshot(data_file_path, mahh_file_path, dskh_file_path, snapshot_path=None):
+    """Đọc lại các file Excel và ghi đè snapshot. Lỗi đọc cấu hình được báo bằng ValueError."""
+    paths = (data_file_path, mahh_file_path, dskh_file_path)
+    snapshot_path = snapshot_path or default_snapshot_path(data_file_path)
+    sources = _source_info(paths)
+    static_data, error_message = load_static_data(*paths)
+    if error_message:
+        raise ValueError(error_message)
+    write_snapshot(snapshot_path, static_data, sources)
+    return snapshot_path, static_data
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="Data.xlsx")
+    parser.add_argument("--mahh", default="MaHH.xlsx")
+    parser.add_argument("--dskh", default="DSKH.xlsx")
+    parser.add_argument("--output", help="đường dẫn file snapshot (mặc định: cạnh Data.xlsx)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        snapshot_path, static_data = rebuild_snapshot(args.data, args.mahh, args.dskh, args.output)
+    except (ValueError, OSError) as e:
+        print(f"Không tạo được snapshot: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+    print(f"Đã ghi {snapshot_path} ({os.path.getsize(snapshot_path)} byte, {elapsed * 1000:.0f}ms): "
+          f"{len(static_data['DS_CHXD'])} CHXD, {len(static_data['ma_hang_map'])} mã hàng")
+
+    started = time.perf_counter()
+    read_snapshot(snapshot_path, _source_info((args.data, args.mahh, args.dskh)))
+    print(f"Thời gian nạp snapshot: {(time.perf_counter() - started) * 1000:.1f}ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
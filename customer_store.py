@@ -0,0 +1,152 @@
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+
+from openpyxl import load_workbook
+
+from logic_handler import clean_string
+from xlsx_reader import iter_sheet_values
+
+# ==============================================================================
+# KHO KHÁCH HÀNG (DSKH) CÓ CHỈ MỤC TRÊN Ổ ĐĨA
+# ==============================================================================
+# DSKH.xlsx ngày càng lớn nhưng mỗi bảng kê chỉ có vài chục MST khác nhau. Thay vì nạp cả danh sách
+# vào bộ nhớ (của mọi worker), DSKH được đồng bộ vào bảng SQLite (MST là khóa chính) và khi xử lý
+# chỉ tra theo lô các MST khác nhau có trong file tải lên.
+# Kho ghi nhớ (đường dẫn, mtime, kích thước) của DSKH.xlsx; khi file đổi, kho chỉ ghi các MST được
+# thêm/sửa/xóa so với lần đồng bộ trước (không dựng lại toàn bộ). Các worker dùng chung một file kho.
+# Kho chỉ được đồng bộ khi nạp (lại) cấu hình; mỗi lần xử lý chỉ mở kho ở chế độ chỉ đọc để tra MST.
+
+CUSTOMER_DB_PATH = os.environ.get("UPSSE_CUSTOMER_DB", "customers.sqlite3")
+# Tăng khi cách đọc DSKH thay đổi để kho cũ được đồng bộ lại
+CUSTOMER_STORE_VERSION = 1
+# Số MST tối đa trong một câu SELECT ... IN (...) (SQLite giới hạn số tham số)
+LOOKUP_BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    mst TEXT PRIMARY KEY,
+    ma_kh TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+_stats_lock = threading.Lock()
+_customer_stats = {"syncs": 0, "inserted": 0, "updated": 0, "deleted": 0, "lookups": 0, "lookup_msts": 0, "lookup_hits": 0, "lookup_errors": 0}
+
+def configure(db_path=None):
+    """Thay đổi đường dẫn kho khách hàng (gọi khi khởi động ứng dụng)."""
+    global CUSTOMER_DB_PATH
+    if db_path is not None: CUSTOMER_DB_PATH = db_path
+
+def _connect():
+    # isolation_level=None: tự quản lý giao dịch bằng BEGIN IMMEDIATE / COMMIT
+    conn = sqlite3.connect(CUSTOMER_DB_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+def _source_signature(dskh_file_path):
+    """Chuỗi mô tả phiên bản DSKH.xlsx; FileNotFoundError nếu thiếu file."""
+    stat_result = os.stat(dskh_file_path)
+    return json.dumps([CUSTOMER_STORE_VERSION, os.path.abspath(dskh_file_path), stat_result.st_mtime_ns, stat_result.st_size])
+
+def _stored_signature(conn):
+    row = conn.execute("SELECT value FROM store_meta WHERE key = 'source'").fetchone()
+    return row[0] if row else None
+
+def read_customer_map(dskh_file_path):
+    """Đọc DSKH.xlsx thành {MST: mã khách} (cột C, D từ dòng 2; MST trùng thì dòng sau thắng)."""
+    try:
+        rows = list(iter_sheet_values(dskh_file_path, min_row=2, max_col=4))
+    except Exception:
+        # File có cấu trúc lạ: đọc lại bằng openpyxl như trước
+        rows = load_workbook(dskh_file_path, data_only=True).active.iter_rows(min_row=2, max_col=4, values_only=True)
+    customer_map = {}
+    for row in rows:
+        mst = clean_string(row[2])
+        if mst:
+            customer_map[mst] = clean_string(row[3])
+    return customer_map
+
+def sync_customer_store(dskh_file_path):
+    """
+    Đồng bộ kho với DSKH.xlsx nếu file đã thay đổi kể từ lần đồng bộ trước.
+    Trả về số MST được thêm/sửa/xóa (0 nếu kho đã mới).
+    """
+    signature = _source_signature(dskh_file_path)
+    conn = _connect()
+    try:
+        if _stored_signature(conn) == signature:
+            return 0
+        # Đọc file Excel ngoài giao dịch để không giữ khóa ghi quá lâu
+        customer_map = read_customer_map(dskh_file_path)
+        conn.execute("BEGIN IMMEDIATE")
+        if _stored_signature(conn) == signature:
+            # Worker khác vừa đồng bộ xong
+            conn.execute("ROLLBACK")
+            return 0
+        stored_map = dict(conn.execute("SELECT mst, ma_kh FROM customers"))
+        upserts = [(mst, ma_kh) for mst, ma_kh in customer_map.items() if stored_map.get(mst) != ma_kh]
+        deletes = [(mst,) for mst in stored_map if mst not in customer_map]
+        conn.executemany("INSERT OR REPLACE INTO customers (mst, ma_kh) VALUES (?, ?)", upserts)
+        conn.executemany("DELETE FROM customers WHERE mst = ?", deletes)
+        conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('source', ?)", (signature,))
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    inserted = sum(1 for mst, _ in upserts if mst not in stored_map)
+    with _stats_lock:
+        _customer_stats["syncs"] += 1
+        _customer_stats["inserted"] += inserted
+        _customer_stats["updated"] += len(upserts) - inserted
+        _customer_stats["deleted"] += len(deletes)
+    return len(upserts) + len(deletes)
+
+def _connect_readonly():
+    """Kết nối chỉ đọc: không tạo file kho, không đổi journal_mode, không tạo bảng."""
+    uri = pathlib.Path(os.path.abspath(CUSTOMER_DB_PATH)).as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True, timeout=30)
+
+def lookup_customers(msts):
+    """
+    Trả về {MST: mã khách} cho các MST (đã làm sạch) có trong kho (đã đồng bộ bằng sync_customer_store).
+    Kho thiếu hoặc hỏng thì ném sqlite3.Error để nơi gọi tra bằng read_customer_map.
+    """
+    msts = sorted(set(msts))
+    customer_map = {}
+    if msts:
+        try:
+            conn = _connect_readonly()
+            try:
+                for start in range(0, len(msts), LOOKUP_BATCH_SIZE):
+                    batch = msts[start:start + LOOKUP_BATCH_SIZE]
+                    placeholders = ",".join("?" * len(batch))
+                    customer_map.update(conn.execute(f"SELECT mst, ma_kh FROM customers WHERE mst IN ({placeholders})", batch))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            with _stats_lock:
+                _customer_stats["lookup_errors"] += 1
+            raise
+
+    with _stats_lock:
+        _customer_stats["lookups"] += 1
+        _customer_stats["lookup_msts"] += len(msts)
+        _customer_stats["lookup_hits"] += len(customer_map)
+    return customer_map
+
+def get_customer_store_stats():
+    """Trả về bản sao các bộ đếm của kho khách hàng."""
+    with _stats_lock:
+        return dict(_customer_stats)
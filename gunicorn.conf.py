@@ -0,0 +1,10 @@
+import os
+
+# Cấu hình gunicorn: nạp ứng dụng một lần ở master (preload) để các worker dùng chung
+# cấu hình đã biên dịch và các module đã import (copy-on-write sau fork).
+wsgi_app = "app:create_app()"
+preload_app = True
+# Ngân sách xử lý file lớn (UPSSE_ADMISSION_BUDGET_MB, xem admission.py) tính riêng cho từng worker
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
@@ -0,0 +1,237 @@
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import timed_stage
+from logic_handler import (
+    UpsseRow, BvmtRow, to_float, get_chxd_context, _upsse_row_shared, _convert_bkhd_rows,
+    _append_summary_rows, _summary_suffix_map, _write_upsse_workbook, _report_progress
+)
+
+# ==============================================================================
+# XỬ LÝ NỐI TIẾP TRONG NGÀY (BẢNG KÊ LŨY KẾ)
+# ==============================================================================
+# Cửa hàng kết xuất bảng kê lũy kế nhiều lần trong ngày; mỗi lần file chứa lại toàn bộ hóa đơn từ đầu ngày.
+# Với mỗi (CHXD, ngày), SQLite lưu: số hóa đơn đã xử lý (ký hiệu cột S + số cột T, kèm mã băm nội dung),
+# các dòng UpSSE đã tạo và số cộng dồn của khách vãng lai (summary_data). Lần tải lên sau chỉ chuyển đổi
+# các hóa đơn mới, cộng tiếp vào summary_data rồi tạo lại các dòng tổng hợp BK.
+# Kết quả trả về là cả ngày ('full', dòng cũ lấy từ SQLite, không chuyển đổi lại) hoặc chỉ phần mới
+# ('delta': hóa đơn mới + các dòng BK với số tổng mới, cùng số BK nên thay thế BK của lần trước).
+# Nếu file cấu hình đổi, hoặc file mới thiếu/sửa hóa đơn đã xử lý (mã băm các dòng của hóa đơn khác đi),
+# cả ngày được xử lý lại từ đầu.
+
+INCREMENTAL_DB_PATH = os.environ.get("UPSSE_INCREMENTAL_DB", "incremental.sqlite3")
+# Trạng thái không được cập nhật trong chừng này ngày thì bị xóa
+INCREMENTAL_RETENTION_DAYS = 7
+INCREMENTAL_OUTPUTS = ('full', 'delta')
+
+# Các trường của UpsseRow được lưu (trường shared được tính lại từ cấu hình và ngày)
+_ROW_FIELDS = UpsseRow.__slots__[1:]
+
+# Tăng khi cấu trúc bảng thay đổi: trạng thái cũ bị xóa (các ngày được xử lý lại từ đầu)
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS day_state (
+    chxd TEXT NOT NULL,
+    day TEXT NOT NULL,
+    config_fingerprint TEXT NOT NULL,
+    summary_data TEXT NOT NULL,
+    first_invoice_prefix_source TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (chxd, day)
+);
+CREATE TABLE IF NOT EXISTS day_invoices (
+    chxd TEXT NOT NULL,
+    day TEXT NOT NULL,
+    invoice_key TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (chxd, day, invoice_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS day_rows (
+    chxd TEXT NOT NULL,
+    day TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    row_data TEXT NOT NULL,
+    PRIMARY KEY (chxd, day, seq)
+) WITHOUT ROWID;
+"""
+
+_stats_lock = threading.Lock()
+_incremental_stats = {"runs": 0, "new_invoices": 0, "new_rows": 0, "reused_rows": 0, "resets": 0}
+
+def configure(db_path=None, retention_days=None):
+    """Thay đổi cấu hình xử lý nối tiếp (gọi khi khởi động ứng dụng)."""
+    global INCREMENTAL_DB_PATH, INCREMENTAL_RETENTION_DAYS
+    if db_path is not None: INCREMENTAL_DB_PATH = db_path
+    if retention_days is not None: INCREMENTAL_RETENTION_DAYS = retention_days
+
+def _connect():
+    # isolation_level=None: tự quản lý giao dịch bằng BEGIN IMMEDIATE / COMMIT
+    conn = sqlite3.connect(INCREMENTAL_DB_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # File mới hoặc cấu trúc cũ: tạo lại các bảng (kiểm tra lại sau khi có khóa ghi vì worker khác có thể vừa làm xong)
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in ("day_state", "day_invoices", "day_rows"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            for statement in _SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    return conn
+
+def _invoice_key(bkhd_row):
+    return f"{str(bkhd_row[18] or '').strip()}|{str(bkhd_row[19] or '').strip()}"
+
+def _invoice_hashes(bkhd_rows):
+    """{khóa hóa đơn: sha256 các dòng của hóa đơn theo thứ tự trong file}; bỏ cột STT (cột A) vì đánh số lại không đổi hóa đơn."""
+    digests = {}
+    for row in bkhd_rows:
+        digest = digests.get(_invoice_key(row))
+        if digest is None:
+            digest = digests[_invoice_key(row)] = hashlib.sha256()
+        digest.update(json.dumps(row[1:], ensure_ascii=False, default=str).encode("utf-8"))
+        digest.update(b"\n")
+    return {key: digest.hexdigest() for key, digest in digests.items()}
+
+def _row_to_json(upsse_row, phi_bvmt):
+    """Lưu các trường của dòng hóa đơn, kèm phí BVMT (None nếu dòng không có dòng thuế BVMT)."""
+    return json.dumps([getattr(upsse_row, name) for name in _ROW_FIELDS] + [phi_bvmt], ensure_ascii=False)
+
+def _read_state(conn, chxd, day):
+    state = conn.execute(
+        "SELECT config_fingerprint, summary_data, first_invoice_prefix_source, row_count FROM day_state WHERE chxd = ? AND day = ?",
+        (chxd, day)
+    ).fetchone()
+    if state is None:
+        return None
+    config_fingerprint, summary_data, first_invoice_prefix_source, row_count = state
+    invoice_hashes = dict(conn.execute("SELECT invoice_key, content_hash FROM day_invoices WHERE chxd = ? AND day = ?", (chxd, day)))
+    return {
+        "config_fingerprint": config_fingerprint, "summary_data": json.loads(summary_data),
+        "first_invoice_prefix_source": first_invoice_prefix_source, "row_count": row_count, "invoice_hashes": invoice_hashes,
+    }
+
+def _delete_state(conn, chxd, day):
+    for table in ("day_state", "day_invoices", "day_rows"):
+        conn.execute(f"DELETE FROM {table} WHERE chxd = ? AND day = ?", (chxd, day))
+
+def _purge_stale_days(conn, now):
+    """Xóa trạng thái của các (CHXD, ngày) không được cập nhật trong INCREMENTAL_RETENTION_DAYS ngày."""
+    cutoff = now - INCREMENTAL_RETENTION_DAYS * 24 * 60 * 60
+    stale_days = "SELECT chxd, day FROM day_state WHERE updated_at < ?"
+    for table in ("day_invoices", "day_rows"):
+        conn.execute(f"DELETE FROM {table} WHERE (chxd, day) IN ({stale_days})", (cutoff,))
+    conn.execute("DELETE FROM day_state WHERE updated_at < ?", (cutoff,))
+
+def _load_rows(conn, chxd, day, shared):
+    """Dựng lại các dòng hóa đơn và dòng thuế BVMT đã lưu (theo đúng thứ tự)."""
+    original_invoice_rows, bvmt_rows = [], []
+    for (row_data,) in conn.execute("SELECT row_data FROM day_rows WHERE chxd = ? AND day = ? ORDER BY seq", (chxd, day)):
+        values = json.loads(row_data)
+        upsse_row = UpsseRow(shared, *values[:-1])
+        original_invoice_rows.append(upsse_row)
+        if values[-1] is not None:
+            bvmt_rows.append(BvmtRow(upsse_row, values[-1]))
+    return original_invoice_rows, bvmt_rows
+
+@timed_stage("incremental")
+def process_incremental(rows_to_process, static_data, selected_chxd, final_date, output='full', config_fingerprint=""):
+    """
+    Xử lý nối tiếp bảng kê lũy kế của một ngày (1 giai đoạn giá), trả về file UpSSE (BytesIO).
+    output: 'full' (cả ngày) hoặc 'delta' (chỉ hóa đơn mới và các dòng BK đã cập nhật).
+    config_fingerprint: dấu vân tay của file cấu hình, đổi thì trạng thái cũ bị bỏ.
+    """
+    if output not in INCREMENTAL_OUTPUTS:
+        raise ValueError(f"Kiểu kết quả xử lý nối tiếp không hợp lệ: '{output}'.")
+
+    # Các dòng có số lượng <= 0 không tạo ra dòng UpSSE nào (giống _convert_bkhd_rows)
+    rows_to_process = [row for row in rows_to_process if not to_float(row[8] if len(row) > 8 else None) <= 0]
+    upload_hashes = _invoice_hashes(rows_to_process)
+    day = final_date.strftime('%Y-%m-%d')
+    chxd_context = get_chxd_context(static_data, selected_chxd)
+    shared = _upsse_row_shared(chxd_context, final_date)
+
+    conn = _connect()
+    try:
+        # Khóa ghi ngay từ đầu để hai lần tải lên cùng lúc của một CHXD không cộng trùng
+        conn.execute("BEGIN IMMEDIATE")
+        state = _read_state(conn, selected_chxd, day)
+        is_reset = state is not None and (
+            state["config_fingerprint"] != config_fingerprint
+            or any(upload_hashes.get(key) != content_hash for key, content_hash in state["invoice_hashes"].items())
+        )
+        if is_reset:
+            _delete_state(conn, selected_chxd, day)
+            state = None
+
+        if state is None:
+            processed_hashes, summary_data, first_invoice_prefix_source, row_count = {}, {}, "", 0
+        else:
+            processed_hashes, summary_data = state["invoice_hashes"], state["summary_data"]
+            first_invoice_prefix_source, row_count = state["first_invoice_prefix_source"], state["row_count"]
+
+        new_rows = [row for row in rows_to_process if _invoice_key(row) not in processed_hashes]
+        if output == 'delta' and state is not None and not new_rows:
+            raise ValueError("Không có hóa đơn mới so với lần xử lý trước của ngày này.")
+
+        old_invoice_rows, old_bvmt_rows = _load_rows(conn, selected_chxd, day, shared) if output == 'full' else ([], [])
+        original_invoice_rows, bvmt_rows, summary_data, first_invoice_prefix_source = _convert_bkhd_rows(
+            new_rows, static_data, selected_chxd, final_date, summary_data, first_invoice_prefix_source
+        )
+        _report_progress("convert", len(new_rows))
+
+        # --- Lưu trạng thái mới ---
+        bvmt_by_row = {id(bvmt_row.original_row): bvmt_row.phi_bvmt for bvmt_row in bvmt_rows}
+        conn.executemany(
+            "INSERT INTO day_rows (chxd, day, seq, row_data) VALUES (?, ?, ?, ?)",
+            ((selected_chxd, day, seq, _row_to_json(upsse_row, bvmt_by_row.get(id(upsse_row))))
+             for seq, upsse_row in enumerate(original_invoice_rows, start=row_count))
+        )
+        new_keys = {_invoice_key(row) for row in new_rows}
+        conn.executemany(
+            "INSERT INTO day_invoices (chxd, day, invoice_key, content_hash) VALUES (?, ?, ?, ?)",
+            ((selected_chxd, day, key, upload_hashes[key]) for key in new_keys)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO day_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (selected_chxd, day, config_fingerprint, json.dumps(summary_data, ensure_ascii=False, default=str),
+             first_invoice_prefix_source, row_count + len(original_invoice_rows), time.time())
+        )
+        _purge_stale_days(conn, time.time())
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    with _stats_lock:
+        _incremental_stats["runs"] += 1
+        _incremental_stats["new_invoices"] += len(new_keys)
+        _incremental_stats["new_rows"] += len(original_invoice_rows)
+        _incremental_stats["reused_rows"] += len(old_invoice_rows)
+        _incremental_stats["resets"] += int(is_reset)
+
+    # --- Các dòng tổng hợp BK tính từ số cộng dồn ---
+    summary_rows, summary_bvmt_rows = [], []
+    _append_summary_rows(summary_rows, summary_bvmt_rows, summary_data, first_invoice_prefix_source, static_data, chxd_context, final_date, _summary_suffix_map(0))
+    if not old_invoice_rows and not original_invoice_rows and not summary_rows:
+        raise ValueError("Không tìm thấy dữ liệu hóa đơn hợp lệ nào trong file Bảng kê.")
+    return _write_upsse_workbook(itertools.chain(
+        old_invoice_rows, original_invoice_rows, summary_rows, old_bvmt_rows, bvmt_rows, summary_bvmt_rows
+    ))
+
+def get_incremental_stats():
+    """Trả về bản sao các bộ đếm của chế độ xử lý nối tiếp."""
+    with _stats_lock:
+        return dict(_incremental_stats)
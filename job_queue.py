@@ -0,0 +1,221 @@
+import json
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from logic_handler import set_progress_callback
+
+# ==============================================================================
+# CHẠY NỀN (ASYNC JOB) CHO CÁC FILE BẢNG KÊ LỚN
+# ==============================================================================
+# Request chỉ nhận file và trả về mã công việc (job id); việc xử lý chạy trên thread pool
+# của tiến trình (không cần broker bên ngoài), nên worker gunicorn không bị giữ tới timeout.
+# Trạng thái và file kết quả được ghi ra ổ đĩa, vì vậy worker gunicorn khác vẫn trả lời được
+# khi trình duyệt hỏi trạng thái hoặc tải kết quả. Kết quả tự hết hạn sau JOB_RETENTION_SECONDS
+# (dọn khi nhận công việc mới và khi hỏi trạng thái, tối đa mỗi PURGE_INTERVAL_SECONDS một lần).
+# Trong lúc công việc chờ/chạy, worker ghi lại trạng thái mỗi JOB_HEARTBEAT_SECONDS; công việc không được
+# cập nhật quá JOB_STALE_SECONDS (worker bị dừng/khởi động lại) được đánh dấu lỗi khi có người hỏi trạng thái.
+
+JOB_DIR = os.path.join(tempfile.gettempdir(), "upsse_jobs")
+JOB_RETENTION_SECONDS = 60 * 60
+JOB_MAX_WORKERS = int(os.environ.get("UPSSE_JOB_WORKERS", 2))
+# Khoảng cách tối thiểu giữa hai lần ghi tiến độ ra ổ đĩa
+PROGRESS_WRITE_INTERVAL_SECONDS = 0.5
+JOB_HEARTBEAT_SECONDS = 30
+JOB_STALE_SECONDS = int(os.environ.get("UPSSE_JOB_STALE_SECONDS", 300))
+PURGE_INTERVAL_SECONDS = 60
+
+_JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{20,64}$')
+
+_executor_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+# Trạng thái các công việc đang chờ/chạy trong tiến trình này (để ghi nhịp heartbeat)
+_active_jobs = {}
+_status_lock = threading.Lock()
+_last_purge = 0.0
+
+def configure(job_dir=None, retention_seconds=None, max_workers=None, stale_seconds=None):
+    """Thay đổi cấu hình chạy nền (gọi khi khởi động ứng dụng)."""
+    global JOB_DIR, JOB_RETENTION_SECONDS, JOB_MAX_WORKERS, JOB_STALE_SECONDS
+    if job_dir is not None: JOB_DIR = job_dir
+    if retention_seconds is not None: JOB_RETENTION_SECONDS = retention_seconds
+    if max_workers is not None: JOB_MAX_WORKERS = max_workers
+    if stale_seconds is not None: JOB_STALE_SECONDS = stale_seconds
+
+def _get_executor():
+    """
+    Thread pool dùng chung và luồng heartbeat (tạo lại sau khi fork vì luồng không được sao chép sang tiến trình con).
+    Gọi khi đang giữ _executor_lock.
+    """
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="upsse-job")
+        _executor_pid = os.getpid()
+        _active_jobs.clear()
+        threading.Thread(target=_heartbeat_loop, name="upsse-job-heartbeat", daemon=True).start()
+    return _executor
+
+def _heartbeat_loop():
+    """Ghi lại trạng thái các công việc đang chờ/chạy để worker khác biết tiến trình này còn sống."""
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        with _executor_lock:
+            statuses = list(_active_jobs.values())
+        for status in statuses:
+            try:
+                _write_status(status)
+            except OSError:
+                pass
+
+def _status_path(job_id):
+    return os.path.join(JOB_DIR, f"{job_id}.json")
+
+def _result_path(job_id):
+    return os.path.join(JOB_DIR, f"{job_id}.result")
+
+def _write_status(status):
+    with _status_lock:
+        status["updated_at"] = time.time()
+        tmp_path = f"{_status_path(status['job_id'])}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(status, f, ensure_ascii=False)
+        os.replace(tmp_path, _status_path(status["job_id"]))
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def purge_expired_jobs(now=None):
+    """
+    Xóa trạng thái và kết quả của các công việc đã quá thời hạn lưu giữ, cùng các file tạm (.tmp) cũ
+    mà worker bị dừng giữa chừng để lại.
+    """
+    now = now or time.time()
+    try:
+        names = os.listdir(JOB_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith((".json", ".tmp")):
+            continue
+        path = os.path.join(JOB_DIR, name)
+        try:
+            expired = os.stat(path).st_mtime + JOB_RETENTION_SECONDS <= now
+        except FileNotFoundError:
+            continue
+        if expired:
+            if name.endswith(".json"):
+                _remove_quietly(_result_path(name[:-len(".json")]))
+            _remove_quietly(path)
+
+def _purge_if_due():
+    """Dọn công việc hết hạn, tối đa mỗi PURGE_INTERVAL_SECONDS một lần trong mỗi tiến trình."""
+    global _last_purge
+    now = time.time()
+    with _status_lock:
+        if now - _last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        _last_purge = now
+    purge_expired_jobs(now)
+
+def submit_job(work):
+    """
+    Đưa work() vào hàng đợi chạy nền, trả về job id. work() trả về một trong hai dạng:
+      - {"chunks": các khối bytes của file kết quả, "download_name": ..., "mimetype": ...};
+      - {"choice_needed": True, "options": [...]} khi cần người dùng xác nhận ngày.
+    ValueError từ work() được coi là lỗi dữ liệu và trả nguyên thông báo cho người dùng.
+    """
+    os.makedirs(JOB_DIR, exist_ok=True)
+    _purge_if_due()
+    job_id = secrets.token_urlsafe(24)
+    status = {
+        "job_id": job_id, "state": "queued", "stage": None,
+        "rows_read": 0, "rows_converted": 0, "created_at": time.time(), "finished_at": None,
+        "error": None, "options": None, "download_name": None, "mimetype": None,
+    }
+    _write_status(status)
+    with _executor_lock:
+        executor = _get_executor()
+        _active_jobs[job_id] = status
+        executor.submit(_run_job, status, work)
+    return job_id
+
+def _run_job(status, work):
+    last_write = [0.0]
+
+    def on_progress(stage, rows):
+        status["stage"] = stage
+        status["rows_read" if stage == "read" else "rows_converted"] += rows
+        now = time.monotonic()
+        if now - last_write[0] >= PROGRESS_WRITE_INTERVAL_SECONDS:
+            last_write[0] = now
+            _write_status(status)
+
+    status["state"] = "running"
+    _write_status(status)
+    metrics.start_request("job")
+    set_progress_callback(on_progress)
+    try:
+        result = work()
+        if result.get("choice_needed"):
+            status.update(state="choice_needed", options=result["options"])
+        else:
+            tmp_path = _result_path(status["job_id"]) + ".tmp"
+            output_bytes = 0
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in result["chunks"]:
+                        output_bytes += f.write(chunk)
+                os.replace(tmp_path, _result_path(status["job_id"]))
+            except BaseException:
+                # Lỗi khi tạo ZIP, đầy ổ đĩa...: không để lại file kết quả dở dang
+                _remove_quietly(tmp_path)
+                raise
+            metrics.record_bytes("output", output_bytes)
+            status.update(state="done", download_name=result["download_name"], mimetype=result["mimetype"])
+    except ValueError as ve:
+        status.update(state="error", error=str(ve))
+    except Exception as e:
+        status.update(state="error", error=f"Đã xảy ra lỗi không mong muốn: {e}")
+    finally:
+        set_progress_callback(None)
+        metrics.finish_request(status["state"])
+    status["finished_at"] = time.time()
+    with _executor_lock:
+        _active_jobs.pop(status["job_id"], None)
+    _write_status(status)
+
+def get_job_status(job_id):
+    """Trả về trạng thái công việc (dict) hoặc None nếu job id không tồn tại hoặc đã hết hạn."""
+    if not job_id or not _JOB_ID_PATTERN.match(job_id):
+        return None
+    _purge_if_due()
+    try:
+        with open(_status_path(job_id), encoding="utf-8") as f:
+            status = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    now = time.time()
+    if status["finished_at"] and status["finished_at"] + JOB_RETENTION_SECONDS <= now:
+        return None
+    if status["state"] in ("queued", "running") and status["updated_at"] + JOB_STALE_SECONDS <= now:
+        # Worker chạy công việc đã bị dừng (không còn heartbeat): báo lỗi để người dùng gửi lại
+        status.update(state="error", finished_at=now, error="Công việc bị dừng giữa chừng do máy chủ khởi động lại. Vui lòng gửi lại file.")
+        _write_status(status)
+    return status
+
+def get_job_result_path(job_id):
+    """Trả về (đường dẫn file kết quả, trạng thái) nếu công việc đã xong, ngược lại (None, trạng thái)."""
+    status = get_job_status(job_id)
+    if status is None or status["state"] != "done":
+        return None, status
+    path = _result_path(job_id)
+    return (path if os.path.exists(path) else None), status
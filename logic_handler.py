@@ -1,10 +1,52 @@
 import openpyxl
 import re
 import io
-import pandas as pd
-from datetime import datetime
+import os
+import sqlite3
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 from openpyxl import load_workbook, Workbook
+from openpyxl.cell import WriteOnlyCell
+
+from metrics import timed_stage, record_rows
+from xlsx_reader import iter_sheet_values, open_source
+
+# Bảng kê chỉ dùng các cột A-U (cột U là ngày hóa đơn)
+BKHD_MAX_COLUMN = 21
+
+# Mốc ngày của số serial Excel (hệ 1900, đã tính lỗi năm nhuận 1900 của Excel)
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# Bộ xử lý dữ liệu mặc định: 'row' (từng dòng) hoặc 'columnar' (theo cột, pandas/numpy)
+TRANSFORM_ENGINE = os.environ.get("UPSSE_ENGINE", "row")
+
+# Bộ đọc file bảng kê: 'native' (đọc trực tiếp XML, xem xlsx_reader.py) hoặc 'openpyxl'
+BKHD_READER = os.environ.get("UPSSE_READER", "native")
+
+# Nhóm xăng dầu: khách vãng lai được gom thành dòng BK; thứ tự dùng để đánh số hậu tố BK
+XANG_DAU_GROUP = ["Xăng E5 RON 92-II", "Xăng RON 95-III", "Dầu DO 0,05S-II", "Dầu DO 0,001S-V"]
+
+# Khi đọc file, cứ sau chừng này dòng thì báo tiến độ một lần (xem set_progress_callback)
+PROGRESS_REPORT_EVERY_ROWS = 1000
+_progress_state = threading.local()
+
+def set_progress_callback(callback):
+    """
+    Đăng ký hàm callback(stage, rows) nhận tiến độ xử lý của luồng hiện tại (None để tắt):
+    rows là số dòng bảng kê vừa xử lý xong thêm ở giai đoạn stage ('read' hoặc 'convert').
+    """
+    _progress_state.callback = callback
+
+def _report_progress(stage, rows):
+    callback = getattr(_progress_state, "callback", None)
+    if callback is not None and rows:
+        callback(stage, rows)
 
 # ==============================================================================
 # CÁC HÀM TIỆN ÍCH (KHÔNG THAY ĐỔI)
@@ -42,9 +84,36 @@ def format_tax_code(raw_vat_value):
         return ""
 
 # ==============================================================================
-# CÁC HÀM NẠP DỮ LIỆU TĨNH (KHÔNG THAY ĐỔI)
+# CHUẨN HÓA CÓ BỘ NHỚ ĐỆM
+# ==============================================================================
+# Bảng kê lặp lại rất nhiều lần cùng vài tên hàng, "Người mua không lấy hóa đơn", vài mức VAT, ký hiệu...
+# Vòng lặp chuyển đổi dùng các bản có bộ nhớ đệm (LRU, giới hạn số phần tử) của clean_string và
+# format_tax_code, nên mỗi giá trị khác nhau chỉ được làm sạch một lần. Khóa phân biệt kiểu dữ liệu
+# (typed=True) vì clean_string(1) và clean_string(1.0) khác nhau.
+
+NORMALIZE_CACHE_SIZE = int(os.environ.get("UPSSE_NORMALIZE_CACHE_SIZE", 8192))
+
+clean_string_cached = lru_cache(maxsize=NORMALIZE_CACHE_SIZE, typed=True)(clean_string)
+
+@lru_cache(maxsize=256, typed=True)
+def tax_code_and_rate(raw_vat_value):
+    """(mã thuế, thuế suất) của một giá trị VAT, ví dụ 0.1 -> ("10", 0.1)."""
+    ma_thue = format_tax_code(raw_vat_value)
+    return ma_thue, (to_float(ma_thue) / 100.0 if ma_thue else 0.0)
+
+def get_normalization_stats():
+    """Số lần trúng/trượt và số phần tử của các bộ nhớ đệm chuẩn hóa."""
+    stats = {}
+    for name, func in (("clean_string", clean_string_cached), ("tax_code", tax_code_and_rate)):
+        info = func.cache_info()
+        stats.update({f"{name}_hits": info.hits, f"{name}_misses": info.misses, f"{name}_size": info.currsize})
+    return stats
+
+# ==============================================================================
+# CÁC HÀM NẠP DỮ LIỆU TĨNH
 # ==============================================================================
 
+@timed_stage("load_static_data")
 def load_static_data(data_file_path, mahh_file_path, dskh_file_path):
     """
     Hàm này đọc file Data.xlsx, MaHH.xlsx, và DSKH.xlsx, trả về một dictionary chứa tất cả dữ liệu cấu hình.
@@ -106,17 +175,12 @@ def load_static_data(data_file_path, mahh_file_path, dskh_file_path):
                 ma_hang_map[ten_hang] = ma_hang
         static_data["ma_hang_map"] = ma_hang_map
 
-        # --- ĐỌC FILE DSKH.xlsx ---
-        mst_to_makh_map = {}
-        wb_dskh = load_workbook(dskh_file_path, data_only=True)
-        ws_dskh = wb_dskh.active
-        for row in ws_dskh.iter_rows(min_row=2, max_col=4, values_only=True):
-            mst = clean_string(row[2])
-            ma_kh = clean_string(row[3])
-            if mst:
-                mst_to_makh_map[mst] = ma_kh
-        static_data["mst_to_makh_map"] = mst_to_makh_map
-        
+        # --- DSKH.xlsx: đồng bộ vào kho khách hàng, khi xử lý chỉ tra các MST có trong bảng kê ---
+        attach_customer_store(static_data, dskh_file_path)
+
+        # --- Tính sẵn ngữ cảnh cho từng CHXD ---
+        static_data["chxd_context"] = {chxd: _build_chxd_context(static_data, chxd) for chxd in chxd_list}
+
         return static_data, None
 
     except FileNotFoundError as e:
@@ -124,135 +188,341 @@ def load_static_data(data_file_path, mahh_file_path, dskh_file_path):
     except Exception as e:
         return None, f"Lỗi khi đọc file cấu hình: {e}"
 
+def _build_chxd_context(static_data, selected_chxd):
+    """Gom các giá trị cấu hình phụ thuộc vào CHXD (khu vực, mã kho, tài khoản, vụ việc)."""
+    khu_vuc = static_data['chxd_to_khuvuc_map'].get(selected_chxd)
+    return {
+        "khu_vuc": khu_vuc,
+        "ma_kho": static_data['tk_mk'].get(selected_chxd),
+        "tk_no": static_data['tk_no_map'].get(khu_vuc),
+        "tk_doanh_thu": static_data['tk_doanh_thu_map'].get(khu_vuc),
+        "tk_gia_von": static_data['tk_gia_von_value'],
+        "tk_thue_co": static_data['tk_thue_co_map'].get(khu_vuc),
+        "tk_no_bvmt": static_data.get('tk_no_bvmt_map', {}).get(khu_vuc),
+        "tk_dt_thue_bvmt": static_data.get('tk_dt_thue_bvmt_map', {}).get(khu_vuc),
+        "tk_gia_von_bvmt": static_data.get('tk_gia_von_bvmt_value'),
+        "tk_thue_co_bvmt": static_data.get('tk_thue_co_bvmt_map', {}).get(khu_vuc),
+        "vu_viec_map": static_data['vu_viec_map'].get(selected_chxd, {}),
+    }
+
+def attach_customer_store(static_data, dskh_file_path):
+    """
+    Đồng bộ kho khách hàng với DSKH.xlsx; gọi mỗi lần nạp (lại) cấu hình, kể cả khi đọc từ snapshot.
+    Không dùng được kho SQLite (thư mục chỉ đọc...) thì nạp cả DSKH vào bộ nhớ như trước.
+    """
+    from customer_store import sync_customer_store, read_customer_map
+    static_data["dskh_file_path"] = os.path.abspath(dskh_file_path)
+    static_data.pop("mst_to_makh_map", None)
+    try:
+        sync_customer_store(dskh_file_path)
+    except sqlite3.Error:
+        static_data["mst_to_makh_map"] = read_customer_map(dskh_file_path)
+
+def lookup_customer_codes(static_data, mst_values):
+    """{MST: mã khách} cho các MST (cột F bảng kê, chưa làm sạch) có trong DSKH, tra theo lô trong kho khách hàng."""
+    msts = {clean_string_cached(value) for value in mst_values}
+    msts.discard("")
+    mst_to_makh_map = static_data.get("mst_to_makh_map")
+    if mst_to_makh_map is None:
+        from customer_store import lookup_customers, read_customer_map
+        try:
+            return lookup_customers(msts)
+        except sqlite3.Error:
+            # Kho bị xóa/hỏng sau khi nạp cấu hình: tra trong DSKH đọc vào bộ nhớ (giữ lại đến lần nạp lại cấu hình)
+            mst_to_makh_map = static_data["mst_to_makh_map"] = read_customer_map(static_data["dskh_file_path"])
+    return {mst: mst_to_makh_map[mst] for mst in msts if mst in mst_to_makh_map}
+
+def get_chxd_context(static_data, selected_chxd):
+    """Lấy ngữ cảnh CHXD đã tính sẵn, hoặc tính mới nếu static_data chưa có."""
+    context = static_data.get('chxd_context', {}).get(selected_chxd)
+    if context is None:
+        context = _build_chxd_context(static_data, selected_chxd)
+    return context
+
+# ==============================================================================
+# DÒNG UPSSE DẠNG GỌN
+# ==============================================================================
+# Dòng UpSSE có 37 cột nhưng đa số là ô trống hoặc giá trị chung của cả file (ngày, mã kho,
+# các tài khoản). UpsseRow chỉ giữ các trường riêng của từng dòng, phần chung nằm trong dict
+# shared (xem _upsse_row_shared) dùng chung cho mọi dòng. Dòng thuế BVMT (BvmtRow) chỉ tham chiếu
+# tới dòng gốc; danh sách 37 cột đầy đủ chỉ được dựng ra lúc ghi file (to_list).
+
+def _upsse_row_shared(chxd_context, final_date):
+    """Các giá trị dùng chung cho mọi dòng UpSSE của một file."""
+    return {
+        'final_date': final_date,
+        'ma_kho': chxd_context['ma_kho'],
+        'tai_khoan': (chxd_context['tk_no'], chxd_context['tk_doanh_thu'], chxd_context['tk_gia_von'], chxd_context['tk_thue_co']),
+        'tai_khoan_bvmt': (chxd_context['tk_no_bvmt'], chxd_context['tk_dt_thue_bvmt'], chxd_context['tk_gia_von_bvmt'], chxd_context['tk_thue_co_bvmt']),
+    }
+
+class UpsseRow:
+    """Một dòng hóa đơn (hoặc dòng tổng hợp BK) của UpSSE."""
+    __slots__ = ('shared', 'ma_khach', 'ten_khach', 'so_hoa_don', 'ky_hieu', 'ma_hang', 'ten_mat_hang', 'dvt',
+                 'so_luong', 'gia_ban', 'tien_hang', 'ma_thue', 'vu_viec', 'dia_chi', 'mst', 'tien_thue')
+
+    def __init__(self, shared, ma_khach, ten_khach, so_hoa_don, ky_hieu, ma_hang, ten_mat_hang, dvt,
+                 so_luong, gia_ban, tien_hang, ma_thue, vu_viec, dia_chi, mst, tien_thue):
+        self.shared = shared
+        self.ma_khach = ma_khach
+        self.ten_khach = ten_khach
+        self.so_hoa_don = so_hoa_don
+        self.ky_hieu = ky_hieu
+        self.ma_hang = ma_hang
+        self.ten_mat_hang = ten_mat_hang
+        self.dvt = dvt
+        self.so_luong = so_luong
+        self.gia_ban = gia_ban
+        self.tien_hang = tien_hang
+        self.ma_thue = ma_thue
+        self.vu_viec = vu_viec
+        self.dia_chi = dia_chi
+        self.mst = mst
+        self.tien_thue = tien_thue
+
+    def to_list(self):
+        """37 cột của dòng theo thứ tự tiêu đề UpSSE."""
+        shared = self.shared
+        tk_no, tk_doanh_thu, tk_gia_von, tk_thue_co = shared['tai_khoan']
+        return [
+            self.ma_khach, self.ten_khach, shared['final_date'], self.so_hoa_don, self.ky_hieu,
+            "Xuất bán hàng theo hóa đơn số " + self.so_hoa_don, self.ma_hang, self.ten_mat_hang, self.dvt,
+            shared['ma_kho'], '', '', self.so_luong, self.gia_ban, self.tien_hang, '', '', self.ma_thue,
+            tk_no, tk_doanh_thu, tk_gia_von, tk_thue_co, '', self.vu_viec, '', '', '', '', '', '', '',
+            self.ten_khach, self.dia_chi, self.mst, '', '', self.tien_thue,
+        ]
+
+class BvmtRow:
+    """Dòng thuế BVMT của một dòng xăng dầu: các cột được tính từ dòng gốc lúc ghi file."""
+    __slots__ = ('original_row', 'phi_bvmt')
+
+    def __init__(self, original_row, phi_bvmt):
+        self.original_row = original_row
+        self.phi_bvmt = phi_bvmt
+
+    def to_list(self):
+        original_row, phi_bvmt = self.original_row, self.phi_bvmt
+        so_luong = to_float(original_row.so_luong)
+        ma_thue = original_row.ma_thue
+        thue_suat = to_float(ma_thue) / 100.0 if ma_thue else 0.0
+        bvmt_row = original_row.to_list()
+        bvmt_row[6] = "TMT"
+        bvmt_row[7] = "Thuế bảo vệ môi trường"
+        bvmt_row[13] = phi_bvmt
+        bvmt_row[14] = round(phi_bvmt * so_luong)
+        bvmt_row[18:22] = original_row.shared['tai_khoan_bvmt']
+        bvmt_row[36] = round(phi_bvmt * so_luong * thue_suat)
+        for i in [5, 31, 32, 33]: bvmt_row[i] = ''
+        return bvmt_row
+
 # ==============================================================================
-# CÁC HÀM LOGIC CỐT LÕI (KHÔNG THAY ĐỔI)
+# CÁC HÀM LOGIC CỐT LÕI
 # ==============================================================================
 
 def _create_upsse_workbook():
-    """Tạo một file Excel mới với cấu trúc tiêu đề cho UpSSE."""
+    """Tạo một file Excel mới (chế độ write-only, ghi dạng luồng) với cấu trúc tiêu đề cho UpSSE."""
     headers = ["Mã khách", "Tên khách hàng", "Ngày", "Số hóa đơn", "Ký hiệu", "Diễn giải", "Mã hàng", "Tên mặt hàng", "Đvt", "Mã kho", "Mã vị trí", "Mã lô", "Số lượng", "Giá bán", "Tiền hàng", "Mã nt", "Tỷ giá", "Mã thuế", "Tk nợ", "Tk doanh thu", "Tk giá vốn", "Tk thuế có", "Cục thuế", "Vụ việc", "Bộ phận", "Lsx", "Sản phẩm", "Hợp đồng", "Phí", "Khế ước", "Nhân viên bán", "Tên KH(thuế)", "Địa chỉ (thuế)", "Mã số Thuế", "Nhóm Hàng", "Ghi chú", "Tiền thuế"]
-    wb = Workbook()
-    ws = wb.active
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
     for _ in range(4): ws.append([''] * len(headers))
     ws.append(headers)
     return wb
 
-def _create_bvmt_row(original_row, phi_bvmt, static_data, khu_vuc):
-    """Tạo dòng thuế BVMT dựa trên dòng hóa đơn gốc."""
-    bvmt_row = list(original_row)
-    tk_no_bvmt = static_data.get('tk_no_bvmt_map', {}).get(khu_vuc)
-    tk_dt_thue_bvmt = static_data.get('tk_dt_thue_bvmt_map', {}).get(khu_vuc)
-    tk_gia_von_bvmt = static_data.get('tk_gia_von_bvmt_value')
-    tk_thue_co_bvmt = static_data.get('tk_thue_co_bvmt_map', {}).get(khu_vuc)
-    so_luong = to_float(original_row[12])
-    ma_thue = original_row[17]
-    thue_suat = to_float(ma_thue) / 100.0 if ma_thue else 0.0
-    bvmt_row[6] = "TMT"
-    bvmt_row[7] = "Thuế bảo vệ môi trường"
-    bvmt_row[13] = phi_bvmt
-    bvmt_row[14] = round(phi_bvmt * so_luong)
-    bvmt_row[18] = tk_no_bvmt
-    bvmt_row[19] = tk_dt_thue_bvmt
-    bvmt_row[20] = tk_gia_von_bvmt
-    bvmt_row[21] = tk_thue_co_bvmt
-    bvmt_row[36] = round(phi_bvmt * so_luong * thue_suat)
-    for i in [5, 31, 32, 33]: bvmt_row[i] = ''
-    return bvmt_row
-
-def _generate_upsse_from_rows(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map):
+def _write_upsse_workbook(final_rows):
+    """
+    Ghi các dòng UpSSE (UpsseRow/BvmtRow) ra file Excel trong bộ nhớ.
+    Các dòng được ghi thẳng xuống luồng; cột Ngày (C) dùng chung một ô mẫu đã định dạng 'dd/mm/yyyy'.
+    """
+    upsse_wb = _create_upsse_workbook()
+    upsse_ws = upsse_wb.worksheets[0]
+    # Ô mẫu được ghi ngay khi append nên có thể dùng lại cho mọi dòng
+    date_cell = WriteOnlyCell(upsse_ws)
+    date_cell.number_format = 'dd/mm/yyyy'
+    for row in final_rows:
+        row_data = row.to_list()
+        date_cell.value = row_data[2]
+        row_data[2] = date_cell
+        upsse_ws.append(row_data)
+    output_buffer = io.BytesIO()
+    upsse_wb.save(output_buffer)
+    output_buffer.seek(0)
+    return output_buffer
+
+def _append_summary_rows(original_invoice_rows, bvmt_rows, summary_data, first_invoice_prefix_source, static_data, chxd_context, final_date, summary_suffix_map):
+    """Tạo các dòng tổng hợp (BK) cho khách vãng lai mua xăng dầu từ summary_data, kèm dòng thuế BVMT."""
+    ma_kho = chxd_context['ma_kho']
+    ma_hang_map = static_data['ma_hang_map']
+    phi_bvmt_map = static_data['phi_bvmt_map']
+    chxd_vu_viec_map = chxd_context['vu_viec_map']
+    shared = _upsse_row_shared(chxd_context, final_date)
+
+    prefix = first_invoice_prefix_source[-2:] if len(first_invoice_prefix_source) >= 2 else first_invoice_prefix_source
+    for product_name, data in summary_data.items():
+        first_data = data['first_invoice_data']
+        date_part = f"{final_date.day:02d}.{final_date.month:02d}"
+        suffix = summary_suffix_map.get(product_name, "")
+        summary_invoice_number = f"{prefix}BK.{date_part}.{suffix}"
+        total_so_luong = data['total_so_luong_bkhd']
+        phi_bvmt_unit = phi_bvmt_map.get(product_name, 0.0)
+        ma_thue = format_tax_code(first_data['vat_raw'])
+        thue_suat = to_float(ma_thue) / 100.0 if ma_thue else 0.0
+        TDT, TTT = data['total_phai_thu'], data['total_tien_thue_goc']
+        TH_TMT = round(phi_bvmt_unit * total_so_luong)
+        TT_TMT = round(TH_TMT * thue_suat)
+        TT_goc = TTT - TT_TMT
+        TH_goc = TDT - TH_TMT - TT_goc - TT_TMT
+        summary_row = UpsseRow(
+            shared,
+            ma_khach=ma_kho,
+            ten_khach=f"Khách hàng mua {product_name} không lấy hóa đơn",
+            so_hoa_don=summary_invoice_number,
+            ky_hieu=first_data['ky_hieu_mau_so'] + first_data['ky_hieu_ky_hieu'],
+            ma_hang=ma_hang_map.get(product_name, ''),
+            ten_mat_hang=product_name,
+            dvt="Lít",
+            so_luong=round(total_so_luong, 3),
+            gia_ban=first_data['don_gia'] - phi_bvmt_unit,
+            tien_hang=round(TH_goc),
+            ma_thue=ma_thue,
+            vu_viec=chxd_vu_viec_map.get(product_name, ''),
+            dia_chi='',
+            mst='',
+            tien_thue=round(TT_goc),
+        )
+        original_invoice_rows.append(summary_row)
+        bvmt_rows.append(BvmtRow(summary_row, phi_bvmt_unit))
+
+@timed_stage("generate_upsse")
+def _generate_upsse_from_rows(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map, engine=None):
     """
     Hàm lõi: Xử lý một danh sách các dòng từ bảng kê và tạo ra file UpSSE.
-    Hàm này được gọi cho mỗi giai đoạn giá.
+    Hàm này được gọi cho mỗi giai đoạn giá (hoặc mỗi ngày).
     """
     if not rows_to_process:
         return None # Trả về None nếu không có dòng nào để xử lý
 
+    original_invoice_rows, bvmt_rows = _build_upsse_rows(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map, engine)
+
+    # --- Ghi ra file Excel trong bộ nhớ ---
+    return _write_upsse_workbook(itertools.chain(original_invoice_rows, bvmt_rows))
+
+def _build_upsse_rows(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map, engine=None):
+    """
+    Chuyển các dòng bảng kê thành các dòng UpSSE, trả về (dòng hóa đơn, dòng thuế BVMT).
+    engine: 'row' (xử lý từng dòng) hoặc 'columnar' (xử lý theo cột bằng pandas/numpy);
+    mặc định lấy theo TRANSFORM_ENGINE.
+    """
+    engine = engine or TRANSFORM_ENGINE
+    if engine == 'columnar':
+        from columnar_engine import build_upsse_rows_columnar
+        result = build_upsse_rows_columnar(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map)
+    elif engine == 'row':
+        result = _build_upsse_rows_by_row(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map)
+    else:
+        raise ValueError(f"Bộ xử lý dữ liệu không hợp lệ: '{engine}'.")
+    _report_progress("convert", len(rows_to_process))
+    return result
+
+def _build_upsse_rows_by_row(rows_to_process, static_data, selected_chxd, final_date, summary_suffix_map):
+    """Bộ xử lý theo từng dòng: chuyển các dòng bảng kê thành các dòng UpSSE."""
+    chxd_context = get_chxd_context(static_data, selected_chxd)
+    original_invoice_rows, bvmt_rows, summary_data, first_invoice_prefix_source = _convert_bkhd_rows(rows_to_process, static_data, selected_chxd, final_date)
+
+    # --- Tạo các dòng tổng hợp cho khách vãng lai ---
+    _append_summary_rows(original_invoice_rows, bvmt_rows, summary_data, first_invoice_prefix_source, static_data, chxd_context, final_date, summary_suffix_map)
+
+    return original_invoice_rows, bvmt_rows
+
+def _convert_bkhd_rows(rows_to_process, static_data, selected_chxd, final_date, summary_data=None, first_invoice_prefix_source=""):
+    """
+    Chuyển các dòng bảng kê thành dòng hóa đơn UpSSE (kèm dòng thuế BVMT) và cộng dồn số liệu của
+    khách vãng lai mua xăng dầu vào summary_data (chưa tạo dòng tổng hợp BK).
+    summary_data/first_invoice_prefix_source của lần xử lý trước có thể được truyền vào để cộng tiếp.
+    Trả về (dòng hóa đơn, dòng thuế BVMT, summary_data, first_invoice_prefix_source).
+    """
     # --- Lấy các dữ liệu cấu hình cần thiết ---
-    khu_vuc = static_data['chxd_to_khuvuc_map'].get(selected_chxd)
-    ma_kho = static_data['tk_mk'].get(selected_chxd)
+    chxd_context = get_chxd_context(static_data, selected_chxd)
+    ma_kho = chxd_context['ma_kho']
     ma_hang_map = static_data['ma_hang_map']
     phi_bvmt_map = static_data['phi_bvmt_map']
-    vu_viec_map = static_data['vu_viec_map']
-    mst_to_makh_map = static_data['mst_to_makh_map']
-    xang_dau_group = ["Xăng E5 RON 92-II", "Xăng RON 95-III", "Dầu DO 0,05S-II", "Dầu DO 0,001S-V"]
-    
-    tk_no = static_data['tk_no_map'].get(khu_vuc)
-    tk_doanh_thu = static_data['tk_doanh_thu_map'].get(khu_vuc)
-    tk_gia_von = static_data['tk_gia_von_value']
-    tk_thue_co = static_data['tk_thue_co_map'].get(khu_vuc)
+    chxd_vu_viec_map = chxd_context['vu_viec_map']
+    mst_to_makh_map = lookup_customer_codes(static_data, (bkhd_row[5] for bkhd_row in rows_to_process))
+    default_vu_viec = chxd_vu_viec_map.get("Dầu mỡ nhờn", '')
+    xang_dau_group = XANG_DAU_GROUP
+    clean = clean_string_cached
+    shared = _upsse_row_shared(chxd_context, final_date)
 
     # --- Bắt đầu xử lý ---
     original_invoice_rows = []
     bvmt_rows = []
-    summary_data = {}
-    first_invoice_prefix_source = ""
+    summary_data = {} if summary_data is None else summary_data
+    # Tra cứu theo tên hàng (nhóm xăng dầu, mã hàng, vụ việc, phí BVMT) một lần cho mỗi tên hàng
+    product_info = {}
 
     for bkhd_row in rows_to_process:
         if to_float(bkhd_row[8] if len(bkhd_row) > 8 else None) <= 0: continue
 
-        ten_kh = clean_string(bkhd_row[3])
-        ten_mat_hang = clean_string(bkhd_row[6])
+        ten_kh = clean(bkhd_row[3])
+        ten_mat_hang = clean(bkhd_row[6])
         is_anonymous = (ten_kh == "Người mua không lấy hóa đơn")
-        is_petrol_product = (ten_mat_hang in xang_dau_group)
+        product = product_info.get(ten_mat_hang)
+        if product is None:
+            is_petrol_product = (ten_mat_hang in xang_dau_group)
+            product = product_info[ten_mat_hang] = (
+                is_petrol_product,
+                ma_hang_map.get(ten_mat_hang, ''),
+                chxd_vu_viec_map.get(ten_mat_hang, default_vu_viec),
+                phi_bvmt_map.get(ten_mat_hang, 0.0) if is_petrol_product else 0.0,
+            )
+        is_petrol_product, ma_hang, ma_vu_viec, phi_bvmt = product
         
         # Xử lý hóa đơn riêng lẻ (không phải khách vãng lai mua xăng dầu)
         if not is_anonymous or not is_petrol_product:
-            new_upsse_row = [''] * 37
-            new_upsse_row[9] = ma_kho
-            new_upsse_row[1] = ten_kh
-            new_upsse_row[31] = ten_kh
-            new_upsse_row[2] = final_date
             ky_hieu_shd = str(bkhd_row[18] or '').strip()
             so_hd_goc = str(bkhd_row[19] or '').strip()
             so_hoa_don_moi = f"HN{so_hd_goc[-6:]}" if selected_chxd == "Nguyễn Huệ" else f"{ky_hieu_shd[-2:]}{so_hd_goc[-6:]}"
-            new_upsse_row[3] = so_hoa_don_moi
-            new_upsse_row[4] = clean_string(bkhd_row[17]) + clean_string(bkhd_row[18])
-            new_upsse_row[5] = "Xuất bán hàng theo hóa đơn số " + so_hoa_don_moi
-            new_upsse_row[7] = ten_mat_hang
-            new_upsse_row[6] = ma_hang_map.get(ten_mat_hang, '')
-            new_upsse_row[8] = clean_string(bkhd_row[10])
             so_luong = to_float(bkhd_row[8])
-            new_upsse_row[12] = round(so_luong, 3)
             don_gia = to_float(bkhd_row[9])
-            phi_bvmt = phi_bvmt_map.get(ten_mat_hang, 0.0) if is_petrol_product else 0.0
             gia_ban = don_gia - phi_bvmt
-            new_upsse_row[13] = gia_ban
-            vat_raw = bkhd_row[14]
-            ma_thue = format_tax_code(vat_raw)
-            new_upsse_row[17] = ma_thue
-            thue_suat = to_float(ma_thue) / 100.0 if ma_thue else 0.0
+            ma_thue, thue_suat = tax_code_and_rate(bkhd_row[14])
             tien_thue_goc = to_float(bkhd_row[15])
             tien_thue_phi_bvmt = round(phi_bvmt * so_luong * thue_suat)
             tien_thue_moi = tien_thue_goc - tien_thue_phi_bvmt
-            new_upsse_row[36] = round(tien_thue_moi)
             if is_petrol_product:
                 phai_thu = to_float(bkhd_row[16])
                 tien_hang_phi_bvmt = round(phi_bvmt * so_luong)
                 tien_hang = phai_thu - tien_thue_goc - tien_hang_phi_bvmt
             else:
                 tien_hang = to_float(bkhd_row[13])
-            new_upsse_row[14] = round(tien_hang)
-            new_upsse_row[18] = tk_no
-            new_upsse_row[19] = tk_doanh_thu
-            new_upsse_row[20] = tk_gia_von
-            new_upsse_row[21] = tk_thue_co
-            chxd_vu_viec_map = vu_viec_map.get(selected_chxd, {})
-            ma_vu_viec = chxd_vu_viec_map.get(ten_mat_hang, chxd_vu_viec_map.get("Dầu mỡ nhờn", ''))
-            new_upsse_row[23] = ma_vu_viec
-            new_upsse_row[32] = clean_string(bkhd_row[4])
-            mst_khach_hang = clean_string(bkhd_row[5])
-            new_upsse_row[33] = mst_khach_hang
-            ma_kh_fast = clean_string(bkhd_row[2])
+            mst_khach_hang = clean(bkhd_row[5])
+            ma_kh_fast = clean(bkhd_row[2])
             ma_khach_final = ma_kho
             if ma_kh_fast and len(ma_kh_fast) < 12:
                 ma_khach_final = ma_kh_fast
             elif mst_khach_hang and mst_to_makh_map.get(mst_khach_hang):
                 ma_khach_final = mst_to_makh_map.get(mst_khach_hang)
-            new_upsse_row[0] = ma_khach_final
-            
+
+            new_upsse_row = UpsseRow(
+                shared,
+                ma_khach=ma_khach_final,
+                ten_khach=ten_kh,
+                so_hoa_don=so_hoa_don_moi,
+                ky_hieu=clean(bkhd_row[17]) + clean(bkhd_row[18]),
+                ma_hang=ma_hang,
+                ten_mat_hang=ten_mat_hang,
+                dvt=clean(bkhd_row[10]),
+                so_luong=round(so_luong, 3),
+                gia_ban=gia_ban,
+                tien_hang=round(tien_hang),
+                ma_thue=ma_thue,
+                vu_viec=ma_vu_viec,
+                dia_chi=clean(bkhd_row[4]),
+                mst=mst_khach_hang,
+                tien_thue=round(tien_thue_moi),
+            )
             original_invoice_rows.append(new_upsse_row)
             if is_petrol_product:
-                bvmt_rows.append(_create_bvmt_row(new_upsse_row, phi_bvmt, static_data, khu_vuc))
+                bvmt_rows.append(BvmtRow(new_upsse_row, phi_bvmt))
         
         # Gom dữ liệu khách vãng lai mua xăng dầu
         else:
@@ -261,91 +531,153 @@ def _generate_upsse_from_rows(rows_to_process, static_data, selected_chxd, final
             if ten_mat_hang not in summary_data:
                 summary_data[ten_mat_hang] = {
                     'total_so_luong_bkhd': 0, 'total_tien_thue_goc': 0, 'total_phai_thu': 0,
-                    'first_invoice_data': {'ky_hieu_mau_so': clean_string(bkhd_row[17]),'ky_hieu_ky_hieu': clean_string(bkhd_row[18]),'don_gia': to_float(bkhd_row[9]),'vat_raw': bkhd_row[14]}
+                    'first_invoice_data': {'ky_hieu_mau_so': clean(bkhd_row[17]),'ky_hieu_ky_hieu': clean(bkhd_row[18]),'don_gia': to_float(bkhd_row[9]),'vat_raw': bkhd_row[14]}
                 }
             summary_data[ten_mat_hang]['total_so_luong_bkhd'] += to_float(bkhd_row[8])
             summary_data[ten_mat_hang]['total_tien_thue_goc'] += to_float(bkhd_row[15])
             summary_data[ten_mat_hang]['total_phai_thu'] += to_float(bkhd_row[16])
 
-    # --- Tạo các dòng tổng hợp cho khách vãng lai ---
-    prefix = first_invoice_prefix_source[-2:] if len(first_invoice_prefix_source) >= 2 else first_invoice_prefix_source
-    for product_name, data in summary_data.items():
-        summary_row = [''] * 37
-        first_data = data['first_invoice_data']
-        date_part = f"{final_date.day:02d}.{final_date.month:02d}"
-        suffix = summary_suffix_map.get(product_name, "")
-        summary_invoice_number = f"{prefix}BK.{date_part}.{suffix}"
-        total_so_luong = data['total_so_luong_bkhd']
-        phi_bvmt_unit = phi_bvmt_map.get(product_name, 0.0)
-        ma_thue = format_tax_code(first_data['vat_raw'])
-        thue_suat = to_float(ma_thue) / 100.0 if ma_thue else 0.0
-        TDT, TTT = data['total_phai_thu'], data['total_tien_thue_goc']
-        TH_TMT = round(phi_bvmt_unit * total_so_luong)
-        TT_TMT = round(TH_TMT * thue_suat)
-        TT_goc = TTT - TT_TMT
-        TH_goc = TDT - TH_TMT - TT_goc - TT_TMT
-        summary_row[0] = ma_kho
-        summary_row[1] = f"Khách hàng mua {product_name} không lấy hóa đơn"
-        summary_row[31] = summary_row[1]
-        summary_row[2] = final_date
-        summary_row[3] = summary_invoice_number
-        summary_row[4] = first_data['ky_hieu_mau_so'] + first_data['ky_hieu_ky_hieu']
-        summary_row[5] = "Xuất bán hàng theo hóa đơn số " + summary_invoice_number
-        summary_row[7] = product_name
-        summary_row[6] = ma_hang_map.get(product_name, '')
-        summary_row[8] = "Lít"
-        summary_row[9] = ma_kho
-        summary_row[12] = round(total_so_luong, 3)
-        summary_row[13] = first_data['don_gia'] - phi_bvmt_unit
-        summary_row[14] = round(TH_goc)
-        summary_row[17] = ma_thue
-        summary_row[18] = tk_no
-        summary_row[19] = tk_doanh_thu
-        summary_row[20] = tk_gia_von
-        summary_row[21] = tk_thue_co
-        chxd_vu_viec_map = vu_viec_map.get(selected_chxd, {})
-        summary_row[23] = chxd_vu_viec_map.get(product_name, '')
-        summary_row[36] = round(TT_goc)
-        original_invoice_rows.append(summary_row)
-        bvmt_rows.append(_create_bvmt_row(summary_row, phi_bvmt_unit, static_data, khu_vuc))
+    return original_invoice_rows, bvmt_rows, summary_data, first_invoice_prefix_source
 
-    # --- Ghi ra file Excel trong bộ nhớ ---
-    upsse_wb = _create_upsse_workbook()
-    upsse_ws = upsse_wb.active
-    all_final_rows = original_invoice_rows + bvmt_rows
-    for row_data in all_final_rows:
-        upsse_ws.append(row_data)
-    for row_index in range(6, upsse_ws.max_row + 1):
-        upsse_ws[f'C{row_index}'].number_format = 'dd/mm/yyyy'
-    output_buffer = io.BytesIO()
-    upsse_wb.save(output_buffer)
-    output_buffer.seek(0)
-    return output_buffer
+# ==============================================================================
+# XỬ LÝ SONG SONG (PROCESS POOL DÙNG CHUNG)
+# ==============================================================================
+
+PROCESS_POOL_MAX_WORKERS = os.cpu_count() or 1
+# Dưới ngưỡng số dòng này, chi phí chuyển dữ liệu sang tiến trình con lớn hơn lợi ích
+PARALLEL_MIN_ROWS = 5000
+
+_process_pool_lock = threading.Lock()
+_process_pool = None
+_process_pool_pid = None
+
+def get_process_pool():
+    """Trả về process pool dùng chung (tạo lại sau khi fork, ví dụ với gunicorn --preload)."""
+    global _process_pool, _process_pool_pid
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_pid != os.getpid():
+            # Dùng 'spawn' vì tiến trình cha (gunicorn/Flask) có nhiều luồng
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            _process_pool_pid = os.getpid()
+        return _process_pool
+
+def reset_process_pool():
+    """Bỏ process pool hiện tại (ví dụ khi một tiến trình con bị dừng bất thường)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+def _run_in_parallel(func, jobs):
+    """
+    Chạy func(*job) cho từng job (phần tử đầu của job là danh sách dòng bảng kê).
+    Chạy song song trên process pool khi dữ liệu đủ lớn, ngược lại chạy tuần tự.
+    Kết quả giữ đúng thứ tự các job.
+    """
+    total_rows = sum(len(job[0]) for job in jobs)
+    # Không tạo pool lồng nhau khi đang chạy trong tiến trình con
+    if len(jobs) < 2 or total_rows < PARALLEL_MIN_ROWS or multiprocessing.parent_process() is not None:
+        return [func(*job) for job in jobs]
+    process_pool = get_process_pool()
+    try:
+        futures = [process_pool.submit(func, *job) for job in jobs]
+        results = []
+        for job, future in zip(jobs, futures):
+            results.append(future.result())
+            # Tiến trình con không báo được tiến độ về luồng này, báo thay khi từng job xong
+            _report_progress("convert", len(job[0]))
+        return results
+    except BrokenProcessPool:
+        reset_process_pool()
+        return [func(*job) for job in jobs]
 
 # ==============================================================================
 # HÀM CHÍNH ĐIỀU PHỐI (MAIN DISPATCHER)
 # ==============================================================================
 
-def _load_uploaded_workbook(file_content_bytes):
-    """Đọc file người dùng tải lên trực tiếp như một file Excel."""
+@timed_stage("load_workbook")
+def _load_uploaded_workbook(uploaded_file_content):
+    """Đọc file người dùng tải lên trực tiếp như một file Excel (chế độ chỉ đọc, đọc dạng luồng)."""
     try:
-        return load_workbook(io.BytesIO(file_content_bytes), data_only=True)
+        return load_workbook(open_source(uploaded_file_content), read_only=True, data_only=True)
     except Exception as e:
         raise ValueError(f"Lỗi khi đọc file Bảng kê hóa đơn. Hãy chắc chắn file tải lên là file Excel. Lỗi: {e}")
 
-def _analyze_date_ambiguity(worksheet):
-    """Phân tích ngày tháng trong BKHD."""
+def _excel_serial_to_date(date_val):
+    """Chuyển ngày dạng số serial của Excel sang date, trả về None nếu không hợp lệ."""
+    try:
+        return (EXCEL_EPOCH + timedelta(days=date_val)).date()
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+def _iter_bkhd_values_openpyxl(uploaded_file_content):
+    """Đọc các dòng bảng kê (từ dòng 11, cột A-U) bằng openpyxl."""
+    bkhd_wb = _load_uploaded_workbook(uploaded_file_content)
+    try:
+        worksheet = bkhd_wb.active
+        # File kết xuất từ HĐĐT có thể khai báo sai kích thước sheet, nên đọc tới dòng cuối thực tế
+        worksheet.reset_dimensions()
+        yield from worksheet.iter_rows(min_row=11, max_col=BKHD_MAX_COLUMN, values_only=True)
+    finally:
+        bkhd_wb.close()
+
+@timed_stage("ingest_rows")
+def _ingest_bkhd_rows(row_values_iter):
+    """
+    Quét bảng kê đúng MỘT lần từ dòng 11 (row_values_iter trả về tuple giá trị cột A-U của từng dòng), đồng thời:
+    lấy các dòng dữ liệu (cột A-U), thu thập ngày hóa đơn (cột U) của từng dòng,
+    lấy ký hiệu ở ô S11 và ghi nhận các lỗi địa chỉ quá dài (cột E).
+    """
+    rows = []
+    row_dates = []
     unique_dates = set()
-    for row in worksheet.iter_rows(min_row=11, values_only=True):
-        if to_float(row[8] if len(row) > 8 else None) > 0:
-            date_val = row[20] if len(row) > 20 else None
-            if isinstance(date_val, datetime):
-                unique_dates.add(date_val.date())
-            elif isinstance(date_val, (int, float)):
-                try:
-                    converted_date_obj = pd.to_datetime(date_val, unit='D', origin='1899-12-30').to_pydatetime()
-                    unique_dates.add(converted_date_obj.date())
-                except (ValueError, TypeError): pass
+    serial_date_cache = {}
+    long_address_errors = []
+    s11_value = None
+
+    for row_index, row_values in enumerate(row_values_iter, start=11):
+        if row_index == 11:
+            s11_value = row_values[18]
+        rows.append(row_values)
+        if len(rows) % PROGRESS_REPORT_EVERY_ROWS == 0:
+            _report_progress("read", PROGRESS_REPORT_EVERY_ROWS)
+
+        # Chỉ xét những dòng có số lượng > 0 (cột I)
+        if to_float(row_values[8]) <= 0:
+            row_dates.append(None)
+            continue
+
+        date_val = row_values[20]
+        row_date = None
+        if isinstance(date_val, datetime):
+            row_date = date_val.date()
+        elif isinstance(date_val, (int, float)):
+            # Ngày dạng số serial của Excel: mỗi giá trị khác nhau chỉ chuyển đổi một lần
+            if date_val not in serial_date_cache:
+                serial_date_cache[date_val] = _excel_serial_to_date(date_val)
+            row_date = serial_date_cache[date_val]
+        row_dates.append(row_date)
+        if row_date is not None:
+            unique_dates.add(row_date)
+
+        address = str(row_values[4]) if row_values[4] is not None else ""
+        if len(address) > 128:
+            long_address_errors.append(f" - Dòng {row_index} (ô E{row_index}): địa chỉ dài {len(address)} ký tự.")
+
+    _report_progress("read", len(rows) % PROGRESS_REPORT_EVERY_ROWS)
+    return {
+        "rows": rows,
+        "row_dates": row_dates,
+        "unique_dates": unique_dates,
+        "s11_value": s11_value,
+        "long_address_errors": long_address_errors,
+    }
+
+@timed_stage("analyze_dates")
+def _analyze_date_ambiguity(bkhd_data):
+    """Phân tích ngày tháng trong BKHD (dựa trên các ngày đã thu thập khi quét file)."""
+    unique_dates = set(bkhd_data["unique_dates"])
     if len(unique_dates) > 1: raise ValueError("Công cụ chỉ chạy được khi bạn kết xuất hóa đơn trong 1 ngày duy nhất.")
     if not unique_dates: raise ValueError("Không tìm thấy dữ liệu hóa đơn hợp lệ nào trong file Bảng kê.")
     the_date = unique_dates.pop()
@@ -357,7 +689,26 @@ def _analyze_date_ambiguity(worksheet):
     except ValueError:
         return False, datetime(the_date.year, the_date.month, the_date.day), None
 
-def _validate_input(worksheet, selected_chxd, khhd_map):
+def _analyze_multi_day_dates(bkhd_data):
+    """
+    Phân tích ngày tháng cho bảng kê nhiều ngày. Lỗi đảo ngày/tháng của HĐĐT xảy ra
+    cho cả file, nên việc xác nhận được áp dụng một lần cho toàn bộ file, không theo từng ngày.
+    Trả về (cần xác nhận, {ngày đọc được: ngày giữ nguyên}, {ngày đọc được: ngày đảo} hoặc None).
+    """
+    unique_dates = sorted(bkhd_data["unique_dates"])
+    if not unique_dates: raise ValueError("Không tìm thấy dữ liệu hóa đơn hợp lệ nào trong file Bảng kê.")
+    dates_as_is = {d: datetime(d.year, d.month, d.day) for d in unique_dates}
+    try:
+        dates_swapped = {d: datetime(d.year, d.day, d.month) for d in unique_dates}
+    except ValueError:
+        # Có ngày > 12 nên cách đọc đảo ngày/tháng không hợp lệ
+        return False, dates_as_is, None
+    if dates_swapped == dates_as_is:
+        return False, dates_as_is, None
+    return True, dates_as_is, dates_swapped
+
+@timed_stage("validate_input")
+def _validate_input(bkhd_data, selected_chxd, khhd_map):
     """
     Kiểm tra các điều kiện đầu vào.
     [CẢI TIẾN] Quét hết file và báo cáo tất cả các lỗi địa chỉ quá dài cùng một lúc.
@@ -365,85 +716,184 @@ def _validate_input(worksheet, selected_chxd, khhd_map):
     khhd_from_data = khhd_map.get(selected_chxd)
     if not khhd_from_data: raise ValueError(f"Lỗi cấu hình: Không tìm thấy 'Ký hiệu hóa đơn' cho '{selected_chxd}'.")
     khhd_suffix_expected = khhd_from_data[-6:]
-    validation_value_raw = worksheet['S11'].value
+    validation_value_raw = bkhd_data["s11_value"]
     if khhd_suffix_expected not in clean_string(validation_value_raw):
         raise ValueError(f"Bảng kê hóa đơn không khớp. Ký hiệu trên file: '{clean_string(validation_value_raw)}', mong đợi chứa: '{khhd_suffix_expected}'.")
     
-    # Danh sách để lưu trữ tất cả các lỗi về độ dài địa chỉ
-    long_address_errors = []
-    
-    # Bắt đầu lặp qua các dòng từ dòng 11
-    for row_index, row_values in enumerate(worksheet.iter_rows(min_row=11, values_only=True), start=11):
-        # Chỉ xử lý những dòng có số lượng > 0 (cột I)
-        if to_float(row_values[8] if len(row_values) > 8 else None) > 0:
-            # Lấy địa chỉ từ cột E (index 4)
-            address = str(row_values[4]) if len(row_values) > 4 and row_values[4] is not None else ""
-            
-            # Kiểm tra nếu độ dài địa chỉ vượt quá 128 ký tự
-            if len(address) > 128:
-                # Thêm thông báo lỗi vào danh sách thay vì dừng lại ngay
-                long_address_errors.append(f" - Dòng {row_index} (ô E{row_index}): địa chỉ dài {len(address)} ký tự.")
-
-    # Sau khi quét hết file, nếu có lỗi, tạo một thông báo tổng hợp và dừng chương trình
+    # Các lỗi độ dài địa chỉ đã được thu thập trong lần quét file duy nhất
+    long_address_errors = bkhd_data["long_address_errors"]
+
+    # Nếu có lỗi, tạo một thông báo tổng hợp và dừng chương trình
     if long_address_errors:
         error_message = f"Phát hiện {len(long_address_errors)} lỗi địa chỉ quá dài (> 128 ký tự). Vui lòng sửa trong file Excel:\n"
         error_message += "\n".join(long_address_errors)
         raise ValueError(error_message)
 
-def process_uploaded_file(uploaded_file_content, static_data, selected_chxd, price_periods, new_price_invoice_number, confirmed_date_str=None):
+def read_bkhd_file(uploaded_file_content, reader=None):
+    """
+    Đọc file bảng kê tải lên và quét một lần, trả về dữ liệu đã phân tích (bkhd_data).
+    uploaded_file_content: bytes, đường dẫn hoặc file nhị phân (file tạm của upload), không cần đọc hết vào bộ nhớ.
+    reader: 'native' hoặc 'openpyxl', mặc định theo BKHD_READER.
+    """
+    if (reader or BKHD_READER) == 'native':
+        try:
+            return _ingest_bkhd_rows(iter_sheet_values(uploaded_file_content, min_row=11, max_col=BKHD_MAX_COLUMN))
+        except Exception:
+            # Bộ đọc nhanh không đọc được (file hỏng, cấu trúc lạ...): đọc lại bằng openpyxl,
+            # openpyxl cũng đưa ra thông báo lỗi quen thuộc nếu file thực sự không hợp lệ
+            pass
+    return _ingest_bkhd_rows(_iter_bkhd_values_openpyxl(uploaded_file_content))
+
+def _summary_suffix_map(period_index):
+    """Hậu tố số BK cho giai đoạn giá thứ period_index (tính từ 0): giai đoạn 1 dùng 1-4, giai đoạn 2 dùng 5-8, ..."""
+    first_suffix = period_index * len(XANG_DAU_GROUP) + 1
+    return {product_name: str(first_suffix + i) for i, product_name in enumerate(XANG_DAU_GROUP)}
+
+def _parse_invoice_numbers(raw_value):
+    """Tách danh sách số hóa đơn người dùng nhập (cách nhau bởi dấu phẩy, chấm phẩy hoặc khoảng trắng)."""
+    return [number for number in re.split(r'[,;\s]+', raw_value or '') if number]
+
+def _split_rows_by_invoice_numbers(all_rows, boundary_invoice_numbers):
+    """
+    Chia các dòng bảng kê thành len(boundary_invoice_numbers) + 1 giai đoạn giá trong một lần quét.
+    Mỗi số hóa đơn mốc (theo đúng thứ tự) là hóa đơn đầu tiên của giai đoạn giá tiếp theo.
+    """
+    periods = [[]]
+    next_boundary = 0
+    for row in all_rows:
+        if next_boundary < len(boundary_invoice_numbers):
+            invoice_num_in_row = str(row[19] or '').strip() # Cột T là số hóa đơn
+            if invoice_num_in_row == boundary_invoice_numbers[next_boundary]:
+                periods.append([])
+                next_boundary += 1
+        periods[-1].append(row)
+
+    if next_boundary < len(boundary_invoice_numbers):
+        missing_number = boundary_invoice_numbers[next_boundary]
+        message = f"Không tìm thấy hóa đơn có số '{missing_number}' trong file Bảng kê. Vui lòng kiểm tra lại."
+        if len(boundary_invoice_numbers) > 1:
+            message += " Lưu ý: các số hóa đơn phải được nhập theo đúng thứ tự xuất hiện trong bảng kê."
+        raise ValueError(message)
+    if not periods[0]:
+        raise ValueError("Không có dữ liệu cho giai đoạn giá cũ (trước hóa đơn đã nhập). Vui lòng kiểm tra lại số hóa đơn.")
+    return periods
+
+def _generate_price_periods(all_rows, boundary_invoice_numbers, static_data, selected_chxd, final_date, engine=None):
+    """Tạo file UpSSE cho từng giai đoạn giá (chạy song song), trả về danh sách kết quả theo thứ tự giai đoạn."""
+    periods = _split_rows_by_invoice_numbers(all_rows, boundary_invoice_numbers)
+    jobs = [(period_rows, static_data, selected_chxd, final_date, _summary_suffix_map(period_index), engine) for period_index, period_rows in enumerate(periods)]
+    return _run_in_parallel(_generate_upsse_from_rows, jobs)
+
+def _format_date_range_option(date_map, value):
+    days = sorted(set(date_map.values()))
+    text = days[0].strftime('%d/%m/%Y')
+    if len(days) > 1:
+        text += f" - {days[-1].strftime('%d/%m/%Y')} ({len(days)} ngày)"
+    return {'text': text, 'value': value}
+
+def _partition_rows_by_day(bkhd_data, date_map):
+    """Chia các dòng bảng kê theo ngày hóa đơn; dòng không có ngày được xếp vào ngày của dòng liền trước."""
+    rows_by_day = {}
+    leading_rows = []
+    current_day = None
+    for row, row_date in zip(bkhd_data["rows"], bkhd_data["row_dates"]):
+        if row_date is not None:
+            current_day = date_map[row_date]
+        if current_day is None:
+            leading_rows.append(row)
+        else:
+            rows_by_day.setdefault(current_day, []).append(row)
+    if leading_rows and rows_by_day:
+        first_day = min(rows_by_day)
+        rows_by_day[first_day] = leading_rows + rows_by_day[first_day]
+    return dict(sorted(rows_by_day.items()))
+
+def _process_multi_day(bkhd_data, static_data, selected_chxd, price_periods, date_order, multi_day_output, engine=None):
+    """
+    Xử lý bảng kê gồm nhiều ngày: mỗi ngày được tạo UpSSE riêng (ngày và số BK riêng), chạy song song.
+    date_order là 'as_is' hoặc 'swapped' khi người dùng đã xác nhận cách đọc ngày của file.
+    """
+    if price_periods != '1':
+        raise ValueError("Chế độ bảng kê nhiều ngày chỉ hỗ trợ 1 giai đoạn giá.")
+
+    is_ambiguous, dates_as_is, dates_swapped = _analyze_multi_day_dates(bkhd_data)
+    if date_order == 'swapped' and dates_swapped:
+        date_map = dates_swapped
+    elif date_order == 'as_is' or not is_ambiguous:
+        date_map = dates_as_is
+    else:
+        return {'choice_needed': True, 'options': [_format_date_range_option(dates_as_is, 'as_is'), _format_date_range_option(dates_swapped, 'swapped')], 'bkhd_data': bkhd_data}
+
+    _validate_input(bkhd_data, selected_chxd, static_data.get('khhd_map', {}))
+    record_rows(len(bkhd_data["rows"]))
+
+    rows_by_day = _partition_rows_by_day(bkhd_data, date_map)
+    suffix_map = _summary_suffix_map(0)
+    jobs = [(day_rows, static_data, selected_chxd, day, suffix_map, engine) for day, day_rows in rows_by_day.items()]
+
+    # --- Gộp tất cả các ngày vào một file UpSSE ---
+    if multi_day_output == 'combined':
+        day_results = _run_in_parallel(_build_upsse_rows, jobs)
+        return _write_upsse_workbook(itertools.chain.from_iterable(
+            itertools.chain(original_invoice_rows, bvmt_rows) for original_invoice_rows, bvmt_rows in day_results
+        ))
+
+    # --- Mỗi ngày một file UpSSE ---
+    day_outputs = [(day, output) for day, output in zip(rows_by_day, _run_in_parallel(_generate_upsse_from_rows, jobs)) if output]
+    if not day_outputs:
+        raise ValueError("Không tìm thấy dữ liệu hóa đơn hợp lệ nào trong file Bảng kê.")
+    if len(day_outputs) == 1:
+        return day_outputs[0][1]
+    return {'days': day_outputs}
+
+def process_uploaded_file(uploaded_file_content, static_data, selected_chxd, price_periods, new_price_invoice_number, confirmed_date_str=None, bkhd_data=None, multi_day=False, multi_day_output='per_day', engine=None, incremental_output=None, config_fingerprint=""):
     """
     Hàm chính để xử lý file bảng kê.
-    Điều phối việc xử lý cho 1 hoặc 2 giai đoạn giá.
+    Điều phối việc xử lý cho 1 hoặc 2 giai đoạn giá, hoặc bảng kê nhiều ngày (multi_day).
+    Nếu đã có bkhd_data (file đã được đọc ở lần gửi trước) thì không đọc lại file.
+    engine chọn bộ xử lý dữ liệu ('row' hoặc 'columnar'), mặc định theo TRANSFORM_ENGINE.
+    incremental_output ('full' hoặc 'delta') bật chế độ xử lý nối tiếp bảng kê lũy kế trong ngày
+    (xem incremental_processor.py); config_fingerprint là dấu vân tay của file cấu hình.
     """
-    bkhd_wb = _load_uploaded_workbook(uploaded_file_content)
-    bkhd_ws = bkhd_wb.active
-    
+    if incremental_output and (multi_day or price_periods != '1'):
+        raise ValueError("Chế độ xử lý nối tiếp trong ngày chỉ hỗ trợ bảng kê 1 ngày, 1 giai đoạn giá.")
+    if bkhd_data is None:
+        bkhd_data = read_bkhd_file(uploaded_file_content)
+    all_rows = bkhd_data["rows"]
+
+    # --- Bảng kê nhiều ngày: confirmed_date_str là cách đọc ngày ('as_is' / 'swapped') ---
+    if multi_day:
+        return _process_multi_day(bkhd_data, static_data, selected_chxd, price_periods, confirmed_date_str, multi_day_output, engine)
+
     # --- Giai đoạn 1: Xác định ngày tháng ---
     final_date = None
     if confirmed_date_str:
         final_date = datetime.strptime(confirmed_date_str, '%Y-%m-%d')
     else:
-        is_ambiguous, date1, date2 = _analyze_date_ambiguity(bkhd_ws)
+        is_ambiguous, date1, date2 = _analyze_date_ambiguity(bkhd_data)
         if is_ambiguous:
-            return {'choice_needed': True, 'options': [{'text': date1.strftime('%d/%m/%Y'), 'value': date1.strftime('%Y-%m-%d')}, {'text': date2.strftime('%d/%m/%Y'), 'value': date2.strftime('%Y-%m-%d')}]}
+            return {'choice_needed': True, 'options': [{'text': date1.strftime('%d/%m/%Y'), 'value': date1.strftime('%Y-%m-%d')}, {'text': date2.strftime('%d/%m/%Y'), 'value': date2.strftime('%Y-%m-%d')}], 'bkhd_data': bkhd_data}
         final_date = date1
 
     # --- Giai đoạn 2: Kiểm tra dữ liệu và điều phối ---
-    _validate_input(bkhd_ws, selected_chxd, static_data.get('khhd_map', {}))
+    _validate_input(bkhd_data, selected_chxd, static_data.get('khhd_map', {}))
+    record_rows(len(bkhd_data["rows"]))
+
+    # --- Xử lý nối tiếp: chỉ chuyển đổi các hóa đơn mới so với lần tải lên trước trong ngày ---
+    if incremental_output:
+        from incremental_processor import process_incremental
+        return process_incremental(all_rows, static_data, selected_chxd, final_date, incremental_output, config_fingerprint)
 
     # --- Xử lý cho 1 giai đoạn giá ---
     if price_periods == '1':
-        all_rows = list(bkhd_ws.iter_rows(min_row=11, values_only=True))
-        suffix_map = {"Xăng E5 RON 92-II": "1", "Xăng RON 95-III": "2", "Dầu DO 0,05S-II": "3", "Dầu DO 0,001S-V": "4"}
-        return _generate_upsse_from_rows(all_rows, static_data, selected_chxd, final_date, suffix_map)
+        return _generate_upsse_from_rows(all_rows, static_data, selected_chxd, final_date, _summary_suffix_map(0), engine)
     
     # --- Xử lý cho 2 giai đoạn giá ---
     elif price_periods == '2':
         if not new_price_invoice_number:
             raise ValueError("Vui lòng nhập 'Số hóa đơn đầu tiên của giá mới' khi chọn 2 giai đoạn giá.")
 
-        all_rows = list(bkhd_ws.iter_rows(min_row=11, values_only=True))
-        split_index = -1
-        for i, row in enumerate(all_rows):
-            invoice_num_in_row = str(row[19] or '').strip() # Cột T là số hóa đơn
-            if invoice_num_in_row == new_price_invoice_number:
-                split_index = i
-                break
-        
-        if split_index == -1:
-            raise ValueError(f"Không tìm thấy hóa đơn có số '{new_price_invoice_number}' trong file Bảng kê. Vui lòng kiểm tra lại.")
-
-        old_price_rows = all_rows[:split_index]
-        new_price_rows = all_rows[split_index:]
-
-        if not old_price_rows:
-            raise ValueError("Không có dữ liệu cho giai đoạn giá cũ (trước hóa đơn đã nhập). Vui lòng kiểm tra lại số hóa đơn.")
-        
-        suffix_map_old = {"Xăng E5 RON 92-II": "1", "Xăng RON 95-III": "2", "Dầu DO 0,05S-II": "3", "Dầu DO 0,001S-V": "4"}
-        suffix_map_new = {"Xăng E5 RON 92-II": "5", "Xăng RON 95-III": "6", "Dầu DO 0,05S-II": "7", "Dầu DO 0,001S-V": "8"}
-
-        result_old = _generate_upsse_from_rows(old_price_rows, static_data, selected_chxd, final_date, suffix_map_old)
-        result_new = _generate_upsse_from_rows(new_price_rows, static_data, selected_chxd, final_date, suffix_map_new)
+        result_old, result_new = _generate_price_periods(all_rows, [new_price_invoice_number], static_data, selected_chxd, final_date, engine)
 
         # Nếu một trong hai giai đoạn không có dữ liệu để xử lý (ví dụ, toàn bộ là hóa đơn có giá trị 0)
         if not result_old and not result_new:
@@ -454,6 +904,20 @@ def process_uploaded_file(uploaded_file_content, static_data, selected_chxd, pri
              return result_old # Chỉ trả về file giá cũ nếu giá mới không có gì
 
         return {'old': result_old, 'new': result_new}
+
+    # --- Xử lý cho N giai đoạn giá ---
+    elif price_periods == 'N':
+        boundary_invoice_numbers = _parse_invoice_numbers(new_price_invoice_number)
+        if not boundary_invoice_numbers:
+            raise ValueError("Vui lòng nhập số hóa đơn đầu tiên của mỗi giai đoạn giá mới khi chọn nhiều giai đoạn giá.")
+
+        period_results = _generate_price_periods(all_rows, boundary_invoice_numbers, static_data, selected_chxd, final_date, engine)
+        period_outputs = [(period_index, output) for period_index, output in enumerate(period_results, start=1) if output]
+        if not period_outputs:
+            raise ValueError("Không có dữ liệu hóa đơn hợp lệ trong các giai đoạn giá.")
+        if len(period_outputs) == 1:
+            return period_outputs[0][1]
+        return {'periods': period_outputs}
     
     else:
         raise ValueError("Lựa chọn giai đoạn giá không hợp lệ.")
@@ -0,0 +1,195 @@
+import logging
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# ==============================================================================
+# ĐO THỜI GIAN TỪNG GIAI ĐOẠN VÀ XUẤT METRICS (ĐỊNH DẠNG PROMETHEUS)
+# ==============================================================================
+# Mỗi giai đoạn xử lý (đọc cấu hình, đọc file, phân tích ngày, kiểm tra, tạo UpSSE, nén ZIP)
+# được bọc bằng stage(); thời gian được ghi vào histogram của tiến trình và vào bảng tổng hợp
+# của request hiện tại (theo luồng), bảng này được ghi log khi request kết thúc.
+# Lưu ý: mỗi worker gunicorn có bộ đếm riêng; các giai đoạn chạy trong tiến trình con
+# của process pool (nhiều giai đoạn giá/nhiều ngày với file lớn) không được ghi nhận.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024)
+ROWS_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 200000)
+
+# ru_maxrss tính bằng KB trên Linux, bằng byte trên macOS
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+logger = logging.getLogger("upsse.metrics")
+
+_metrics_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_request_state = threading.local()
+
+_METRIC_HELP = {
+    "upsse_stage_duration_seconds": ("histogram", "Thời gian từng giai đoạn xử lý"),
+    "upsse_request_duration_seconds": ("histogram", "Tổng thời gian xử lý request"),
+    "upsse_request_rows": ("histogram", "Số dòng bảng kê được xử lý trong một request"),
+    "upsse_request_input_bytes": ("histogram", "Dung lượng file tải lên"),
+    "upsse_request_output_bytes": ("histogram", "Dung lượng file trả về"),
+    "upsse_rows_processed_total": ("counter", "Tổng số dòng bảng kê đã xử lý"),
+    "upsse_requests_total": ("counter", "Số request theo endpoint và mã trạng thái"),
+}
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def observe(name, value, buckets, **labels):
+    """Ghi một giá trị vào histogram name (các ngưỡng buckets cố định cho mỗi metric)."""
+    key = (name, _label_key(labels))
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, upper_bound in enumerate(buckets):
+            if value <= upper_bound:
+                histogram["counts"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+def inc(name, amount=1, **labels):
+    key = (name, _label_key(labels))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def _current_request():
+    return getattr(_request_state, "summary", None)
+
+def record_stage(name, seconds):
+    """Ghi thời gian một giai đoạn vào histogram và cộng dồn vào bảng tổng hợp của request hiện tại (nếu có)."""
+    observe("upsse_stage_duration_seconds", seconds, LATENCY_BUCKETS, stage=name)
+    summary = _current_request()
+    if summary is not None:
+        summary["stages"][name] = summary["stages"].get(name, 0.0) + seconds
+
+@contextmanager
+def stage(name):
+    """Đo thời gian một giai đoạn (xem record_stage)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+def timed_stage(name):
+    """Decorator: đo thời gian mỗi lần gọi hàm như một giai đoạn name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_rows(row_count):
+    inc("upsse_rows_processed_total", row_count)
+    summary = _current_request()
+    if summary is not None:
+        summary["rows"] += row_count
+
+def record_bytes(direction, byte_count):
+    """direction: 'input' (file tải lên) hoặc 'output' (file trả về)."""
+    summary = _current_request()
+    if summary is not None:
+        summary[f"{direction}_bytes"] += byte_count
+
+def _peak_rss_bytes():
+    """RSS đỉnh của cả tiến trình từ khi khởi động (không tách được theo request khi worker chạy nhiều luồng)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+def start_request(endpoint):
+    _request_state.summary = {
+        "endpoint": endpoint, "started": time.perf_counter(),
+        "stages": {}, "rows": 0, "input_bytes": 0, "output_bytes": 0,
+    }
+
+def finish_request(status_code):
+    """Kết thúc request hiện tại: ghi histogram tổng và ghi log bảng tổng hợp thời gian."""
+    summary = _current_request()
+    if summary is None:
+        return None
+    _request_state.summary = None
+    elapsed = time.perf_counter() - summary["started"]
+    endpoint = summary["endpoint"]
+    observe("upsse_request_duration_seconds", elapsed, LATENCY_BUCKETS, endpoint=endpoint)
+    inc("upsse_requests_total", endpoint=endpoint, status=str(status_code))
+    if summary["rows"]:
+        observe("upsse_request_rows", summary["rows"], ROWS_BUCKETS, endpoint=endpoint)
+    if summary["input_bytes"]:
+        observe("upsse_request_input_bytes", summary["input_bytes"], BYTES_BUCKETS, endpoint=endpoint)
+    if summary["output_bytes"]:
+        observe("upsse_request_output_bytes", summary["output_bytes"], BYTES_BUCKETS, endpoint=endpoint)
+
+    stage_text = "".join(f" {name}={seconds * 1000:.1f}ms" for name, seconds in summary["stages"].items())
+    # RSS đỉnh của tiến trình (worker) tại thời điểm kết thúc request, không phải bộ nhớ riêng của request
+    logger.info(
+        "%s status=%s total=%.1fms%s rows=%d in=%dB out=%dB process_peak_rss=%.1fMB",
+        endpoint, status_code, elapsed * 1000, stage_text, summary["rows"],
+        summary["input_bytes"], summary["output_bytes"], _peak_rss_bytes() / (1024 * 1024),
+    )
+    return summary
+
+def _format_labels(label_key, extra=()):
+    labels = list(label_key) + list(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus(extra_gauges=None, extra_counters=None):
+    """
+    Xuất toàn bộ metrics theo định dạng text của Prometheus.
+    extra_gauges: dict {tên metric: giá trị} tức thời, có thể giảm (ví dụ số mục đang có trong bộ đệm).
+    extra_counters: dict {tên metric: giá trị} chỉ tăng (ví dụ số lần hit/miss); xuất dạng counter, tên thêm hậu tố _total.
+    """
+    with _metrics_lock:
+        histograms = {key: dict(value, counts=list(value["counts"])) for key, value in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    described = set()
+
+    def describe(name, default_type):
+        if name in described:
+            return
+        described.add(name)
+        metric_type, help_text = _METRIC_HELP.get(name, (default_type, name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+    for (name, label_key), histogram in sorted(histograms.items()):
+        describe(name, "histogram")
+        cumulative = 0
+        for upper_bound, count in zip(histogram["buckets"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(label_key, [('le', upper_bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(label_key, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(label_key)} {_format_number(histogram['sum'])}")
+        lines.append(f"{name}_count{_format_labels(label_key)} {histogram['count']}")
+
+    for (name, label_key), value in sorted(counters.items()):
+        describe(name, "counter")
+        lines.append(f"{name}{_format_labels(label_key)} {_format_number(value)}")
+
+    for name, value in (extra_counters or {}).items():
+        name = name if name.endswith("_total") else f"{name}_total"
+        describe(name, "counter")
+        lines.append(f"{name} {_format_number(value)}")
+
+    gauges = {"upsse_process_peak_rss_bytes": _peak_rss_bytes()}
+    gauges.update(extra_gauges or {})
+    for name, value in gauges.items():
+        describe(name, "gauge")
+        lines.append(f"{name} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
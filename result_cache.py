@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+# ==============================================================================
+# BỘ ĐỆM KẾT QUẢ (TẢI LẠI CÙNG MỘT BẢNG KÊ)
+# ==============================================================================
+# Cửa hàng thường tải lại đúng file bảng kê cũ (chọn nhầm CHXD, mất file tải về...).
+# Kết quả UpSSE được lưu theo khóa là mã băm nội dung file + các lựa chọn trên form + dấu vân tay
+# (fingerprint) của các file cấu hình Data/MaHH/DSKH, nên lần gửi giống hệt được trả về ngay.
+# Nội dung lưu là đúng file trả về (file Excel hoặc file ZIP), được ghi ra ổ đĩa từ chính các khối
+# đang gửi cho trình duyệt (không giữ thêm bản sao trong bộ nhớ); khi trúng, file được gửi thẳng từ ổ đĩa.
+# Ổ đĩa xóa file dùng lâu nhất khi vượt dung lượng. Tầng bộ nhớ (LRU) tắt theo mặc định vì mỗi worker
+# gunicorn giữ một bản riêng; bật bằng UPSSE_RESULT_CACHE_MEMORY_MB.
+# Khi file cấu hình thay đổi, fingerprint đổi theo và các kết quả cũ bị xóa.
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "upsse_result_cache")
+CACHE_MAX_MEMORY_BYTES = int(os.environ.get("UPSSE_RESULT_CACHE_MEMORY_MB", 0)) * 1024 * 1024
+CACHE_MAX_DISK_BYTES = 1024 * 1024 * 1024
+HASH_CHUNK_BYTES = 1024 * 1024
+
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{16}-[0-9a-f]{64}$')
+
+_cache_lock = threading.Lock()
+_memory_entries = OrderedDict()
+_memory_bytes = 0
+_current_fingerprint = None
+_cache_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stored": 0, "evictions": 0, "invalidations": 0}
+
+def configure(cache_dir=None, max_memory_bytes=None, max_disk_bytes=None):
+    """Thay đổi cấu hình bộ đệm kết quả (gọi khi khởi động ứng dụng)."""
+    global CACHE_DIR, CACHE_MAX_MEMORY_BYTES, CACHE_MAX_DISK_BYTES
+    if cache_dir is not None: CACHE_DIR = cache_dir
+    if max_memory_bytes is not None: CACHE_MAX_MEMORY_BYTES = max_memory_bytes
+    if max_disk_bytes is not None: CACHE_MAX_DISK_BYTES = max_disk_bytes
+
+def make_result_key(config_fingerprint, file_content, **options):
+    """
+    Khóa của một lần xử lý: '<fingerprint cấu hình>-<sha256 của nội dung file và các lựa chọn>'.
+    file_content: bytes hoặc file nhị phân (được đọc từng khối rồi đưa về đầu file).
+    """
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        digest = hashlib.sha256(file_content)
+    else:
+        digest = hashlib.sha256()
+        file_content.seek(0)
+        for chunk in iter(lambda: file_content.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+        file_content.seek(0)
+    digest.update(json.dumps(options, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return f"{config_fingerprint}-{digest.hexdigest()}"
+
+# Mỗi kết quả gồm 2 file: '<khóa>.bin' (nội dung trả về) và '<khóa>.json' (tên file tải về, mimetype),
+# file .json được ghi sau cùng nên có .json nghĩa là .bin đã đầy đủ.
+def _body_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.bin")
+
+def _meta_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _invalidate_if_config_changed(fingerprint):
+    """Gọi khi đang giữ _cache_lock: cấu hình đổi thì xóa toàn bộ kết quả tính theo cấu hình cũ."""
+    global _current_fingerprint, _memory_bytes
+    if fingerprint == _current_fingerprint:
+        return
+    _current_fingerprint = fingerprint
+    for key in [key for key in _memory_entries if not key.startswith(fingerprint)]:
+        _memory_bytes -= _memory_entries.pop(key)["size"]
+        _cache_stats["invalidations"] += 1
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.startswith(fingerprint):
+            _remove_quietly(os.path.join(CACHE_DIR, name))
+            _cache_stats["invalidations"] += 1
+
+def _evict_memory():
+    global _memory_bytes
+    while _memory_entries and _memory_bytes > CACHE_MAX_MEMORY_BYTES:
+        _, entry = _memory_entries.popitem(last=False)
+        _memory_bytes -= entry["size"]
+        _cache_stats["evictions"] += 1
+
+def _evict_disk():
+    """Xóa các kết quả dùng lâu nhất (theo mtime của file .bin, được cập nhật mỗi lần đọc) cho đến khi nằm trong giới hạn."""
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return
+    files = []
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((stat_result.st_mtime, stat_result.st_size, path))
+    files.sort()
+    total_bytes = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total_bytes <= CACHE_MAX_DISK_BYTES:
+            break
+        _remove_quietly(path)
+        total_bytes -= size
+        if path.endswith(".bin"):
+            # Bỏ luôn file mô tả để kết quả không còn được coi là có trong bộ đệm
+            _remove_quietly(path[:-len(".bin")] + ".json")
+
+def _remember(key, entry):
+    """Gọi khi đang giữ _cache_lock: đưa kết quả (có 'content') vào tầng bộ nhớ."""
+    global _memory_bytes
+    size = len(entry["content"])
+    if size > CACHE_MAX_MEMORY_BYTES:
+        return
+    previous = _memory_entries.pop(key, None)
+    if previous is not None:
+        _memory_bytes -= previous["size"]
+    _memory_entries[key] = dict(entry, size=size)
+    _memory_bytes += size
+    _evict_memory()
+
+def get_result(key):
+    """
+    Trả về kết quả đã lưu hoặc None: {"download_name", "mimetype"} kèm "content" (bytes, từ tầng bộ nhớ)
+    hoặc "path" (file trên ổ đĩa, gửi thẳng cho trình duyệt).
+    """
+    if not key or not _KEY_PATTERN.match(key):
+        return None
+    with _cache_lock:
+        _invalidate_if_config_changed(key.split("-", 1)[0])
+        entry = _memory_entries.get(key)
+        if entry is not None:
+            _memory_entries.move_to_end(key)
+            _cache_stats["memory_hits"] += 1
+            return entry
+
+    try:
+        with open(_meta_path(key), encoding="utf-8") as f:
+            meta = json.load(f)
+        os.utime(_body_path(key))
+        entry = {"download_name": meta["download_name"], "mimetype": meta["mimetype"], "path": _body_path(key)}
+    except OSError:
+        entry = None
+    except (ValueError, KeyError, TypeError):
+        _remove_quietly(_meta_path(key))
+        entry = None
+
+    with _cache_lock:
+        if entry is None:
+            _cache_stats["misses"] += 1
+            return None
+        _cache_stats["disk_hits"] += 1
+    return entry
+
+def iter_result_file(path, chunk_bytes=HASH_CHUNK_BYTES):
+    """Đọc lần lượt các khối của một file kết quả trên ổ đĩa."""
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(chunk_bytes), b"")
+
+def _commit(key, download_name, mimetype, tmp_path, memory_chunks):
+    """Đưa file tạm đã ghi đủ vào bộ đệm (và tầng bộ nhớ nếu bật)."""
+    meta_tmp_path = f"{_meta_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.replace(tmp_path, _body_path(key))
+        with open(meta_tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"download_name": download_name, "mimetype": mimetype}, f, ensure_ascii=False)
+        os.replace(meta_tmp_path, _meta_path(key))
+    except OSError:
+        _remove_quietly(tmp_path)
+        _remove_quietly(meta_tmp_path)
+        return
+    with _cache_lock:
+        _invalidate_if_config_changed(key.split("-", 1)[0])
+        if memory_chunks is not None:
+            _remember(key, {"download_name": download_name, "mimetype": mimetype, "content": b"".join(memory_chunks)})
+        _cache_stats["stored"] += 1
+    _evict_disk()
+
+def cache_chunks(key, download_name, mimetype, chunks):
+    """
+    Trả lại nguyên các khối chunks (bytes/memoryview của file trả về), đồng thời ghi chúng ra ổ đĩa.
+    Kết quả chỉ được lưu khi chunks được đọc hết (trình duyệt ngắt giữa chừng thì bỏ file dở dang).
+    Lỗi ghi ổ đĩa (hết dung lượng...) chỉ làm mất bộ đệm, không ảnh hưởng kết quả trả về.
+    """
+    tmp_path = f"{_body_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        f = open(tmp_path, "wb")
+    except OSError:
+        yield from chunks
+        return
+    # Tầng bộ nhớ (nếu bật) cần bản sao các khối; khối từ BytesIO/ZIP có thể bị dùng lại sau khi gửi
+    memory_chunks = [] if CACHE_MAX_MEMORY_BYTES else None
+    memory_bytes = 0
+    completed = False
+    try:
+        for chunk in chunks:
+            if f is not None:
+                try:
+                    f.write(chunk)
+                except OSError:
+                    f.close()
+                    f = None
+            if memory_chunks is not None:
+                memory_bytes += len(chunk)
+                if memory_bytes <= CACHE_MAX_MEMORY_BYTES:
+                    memory_chunks.append(bytes(chunk))
+                else:
+                    memory_chunks = None
+            yield chunk
+        completed = f is not None
+    finally:
+        if f is not None:
+            f.close()
+        if completed:
+            _commit(key, download_name, mimetype, tmp_path, memory_chunks)
+        else:
+            _remove_quietly(tmp_path)
+
+def put_result(key, download_name, mimetype, chunks):
+    """Lưu kết quả gồm các khối chunks (ví dụ [output.getbuffer()]) mà không gửi đi đâu."""
+    for _ in cache_chunks(key, download_name, mimetype, chunks):
+        pass
+
+def get_result_cache_stats():
+    """Trả về bản sao các bộ đếm của bộ đệm kết quả."""
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["memory_entries"] = len(_memory_entries)
+        stats["memory_bytes"] = _memory_bytes
+    return stats
+
+def clear_results():
+    """Xóa toàn bộ kết quả đã lưu ở cả hai tầng."""
+    global _memory_bytes
+    with _cache_lock:
+        _memory_entries.clear()
+        _memory_bytes = 0
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        _remove_quietly(os.path.join(CACHE_DIR, name))
@@ -0,0 +1,84 @@
+import io
+import os
+import re
+import sys
+from datetime import datetime
+
+import pytest
+from openpyxl import load_workbook
+
+import customer_store
+import result_cache
+import upload_stash
+
+from conftest import REPO_DIR
+
+sys.path.insert(0, os.path.join(REPO_DIR, "bench"))
+from bkhd_generator import generate_bkhd  # noqa: E402
+
+import app as app_module  # noqa: E402
+
+# 04/03 hay 03/04: ngày và tháng đều <= 12 nên phải hỏi người dùng
+AMBIGUOUS_DATE = datetime(2025, 3, 4)
+FORM = {"chxd": "Cộng Hoà", "price_periods": "1"}
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Test client chạy ở thư mục gốc (đường dẫn file cấu hình là tương đối); kho tạm, bộ đệm kết quả và kho khách hàng ở thư mục tạm."""
+    monkeypatch.chdir(REPO_DIR)
+    for module, name in ((upload_stash, "STASH_DIR"), (result_cache, "CACHE_DIR"), (customer_store, "CUSTOMER_DB_PATH")):
+        monkeypatch.setattr(module, name, getattr(module, name))
+    upload_stash.configure(stash_dir=str(tmp_path / "stash"))
+    result_cache.configure(cache_dir=str(tmp_path / "results"))
+    customer_store.configure(db_path=str(tmp_path / "customers.sqlite3"))
+    app_module.app.config["TESTING"] = True
+    return app_module.app.test_client()
+
+def _upload_ambiguous(client):
+    """Gửi bảng kê có ngày không rõ, trả về (token, các ngày được đề nghị chọn)."""
+    content = generate_bkhd(50, invoice_date=AMBIGUOUS_DATE, seed=3)
+    response = client.post("/process", data=dict(FORM, file=(io.BytesIO(content), "bk.xlsx")), content_type="multipart/form-data")
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    token = re.search(r'name="upload_token" value="([^"]+)"', html).group(1)
+    options = re.findall(r'name="confirmed_date" value="([^"]+)"', html)
+    return token, options
+
+def _confirm(client, token, confirmed_date):
+    return client.post("/process", data=dict(FORM, upload_token=token, confirmed_date=confirmed_date))
+
+def _assert_dated(response, expected_date):
+    assert response.status_code == 200
+    assert response.mimetype == app_module.XLSX_MIMETYPE
+    rows = list(load_workbook(io.BytesIO(response.data)).active.iter_rows(min_row=6, values_only=True))
+    assert rows and {row[2] for row in rows} == {expected_date}
+
+def _assert_rejected(response):
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/")
+
+def test_confirm_uses_stashed_upload_once(client):
+    token, options = _upload_ambiguous(client)
+    assert len(options) == 2
+    before = upload_stash.get_stash_stats()
+
+    _assert_dated(_confirm(client, token, "2025-04-03"), datetime(2025, 4, 3))
+    assert upload_stash.get_stash_stats()["memory_hits"] == before["memory_hits"] + 1
+
+    # Token chỉ dùng được một lần
+    _assert_rejected(_confirm(client, token, "2025-04-03"))
+    assert upload_stash.get_stash_stats()["misses"] == before["misses"] + 1
+
+def test_confirm_reads_upload_from_disk_without_memory_tier(client):
+    token, _ = _upload_ambiguous(client)
+    # Như khi bước xác nhận đến worker khác: dữ liệu đã đọc không còn trong bộ nhớ, chỉ còn file trên ổ đĩa
+    with upload_stash._stash_lock:
+        upload_stash._memory_entries.clear()
+        upload_stash._memory_bytes = 0
+    before = upload_stash.get_stash_stats()
+
+    _assert_dated(_confirm(client, token, "2025-03-04"), datetime(2025, 3, 4))
+    assert upload_stash.get_stash_stats()["disk_hits"] == before["disk_hits"] + 1
+    assert not os.listdir(upload_stash.STASH_DIR)
+
+    _assert_rejected(_confirm(client, token, "2025-03-04"))
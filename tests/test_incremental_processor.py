@@ -0,0 +1,115 @@
+import io
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from openpyxl import load_workbook
+
+import customer_store
+import incremental_processor
+import logic_handler
+
+from conftest import REPO_DIR
+
+sys.path.insert(0, os.path.join(REPO_DIR, "bench"))
+from bkhd_generator import ANONYMOUS_CUSTOMER, _load_reference_data, iter_bkhd_rows, write_bkhd_workbook  # noqa: E402
+
+CHXD = "Cộng Hoà"
+INVOICE_DATE = datetime(2025, 3, 15)
+
+@pytest.fixture(scope="module")
+def static_data(tmp_path_factory):
+    """Nạp file cấu hình thật của ứng dụng; kho khách hàng được đồng bộ vào file tạm."""
+    original_path = customer_store.CUSTOMER_DB_PATH
+    customer_store.configure(db_path=str(tmp_path_factory.mktemp("customers") / "customers.sqlite3"))
+    try:
+        data, _ = logic_handler.load_static_data(
+            os.path.join(REPO_DIR, "Data.xlsx"), os.path.join(REPO_DIR, "MaHH.xlsx"), os.path.join(REPO_DIR, "DSKH.xlsx"))
+        yield data
+    finally:
+        customer_store.configure(db_path=original_path)
+
+@pytest.fixture(autouse=True)
+def incremental_db(tmp_path, monkeypatch):
+    """Mỗi test dùng một file SQLite riêng."""
+    monkeypatch.setattr(incremental_processor, "INCREMENTAL_DB_PATH", incremental_processor.INCREMENTAL_DB_PATH)
+    incremental_processor.configure(db_path=str(tmp_path / "incremental.sqlite3"))
+
+def _bkhd_rows(n_rows):
+    """n_rows dòng đầu của bảng kê trong ngày (cùng seed nên file sau chứa lại toàn bộ dòng của file trước)."""
+    khhd, lubricants, customers = _load_reference_data(CHXD)
+    return [list(row) for row in iter_bkhd_rows(n_rows, khhd, lubricants, customers, INVOICE_DATE, seed=7)]
+
+def _bkhd_file(rows):
+    buffer = io.BytesIO()
+    write_bkhd_workbook(rows, buffer)
+    return buffer.getvalue()
+
+def _values(output):
+    return [list(row) for row in load_workbook(output).active.iter_rows(values_only=True)]
+
+def _bk_rows(values):
+    return [row for row in values if row[3] and "BK" in str(row[3])]
+
+def _invoice_numbers(values):
+    """Số hóa đơn (cột D) của các dòng hóa đơn, bỏ dòng tiêu đề và dòng BK."""
+    return {row[3] for row in values[5:] if row[3] and "BK" not in str(row[3])}
+
+def _stats_since(before):
+    """Mức tăng của các bộ đếm (cộng dồn suốt tiến trình) kể từ bản chụp before."""
+    return {key: value - before[key] for key, value in incremental_processor.get_incremental_stats().items()}
+
+def _process(content, static_data, output=None, fingerprint="a"):
+    return logic_handler.process_uploaded_file(
+        content, static_data, CHXD, "1", "", incremental_output=output, config_fingerprint=fingerprint)
+
+def test_first_upload_matches_normal_processing(static_data):
+    content = _bkhd_file(_bkhd_rows(200))
+    before = incremental_processor.get_incremental_stats()
+
+    assert _values(_process(content, static_data, "full")) == _values(_process(content, static_data))
+    stats = _stats_since(before)
+    assert stats["runs"] == 1 and stats["reused_rows"] == 0 and stats["new_invoices"] == 200
+
+def test_cumulative_reupload_converts_only_new_invoices(static_data):
+    rows = _bkhd_rows(400)
+    _process(_bkhd_file(rows[:200]), static_data, "full")
+    before = incremental_processor.get_incremental_stats()
+
+    content = _bkhd_file(rows)
+    delta = _values(_process(content, static_data, "delta"))
+    expected = _values(_process(content, static_data))
+
+    stats = _stats_since(before)
+    assert stats["new_invoices"] == 200 and stats["resets"] == 0
+    # Chỉ có hóa đơn mới nhưng các dòng BK là số cộng dồn cả ngày
+    first_upload = _invoice_numbers(_values(_process(_bkhd_file(rows[:200]), static_data)))
+    assert _invoice_numbers(delta) and _invoice_numbers(delta) == _invoice_numbers(expected) - first_upload
+    assert _bk_rows(delta) == _bk_rows(expected)
+
+    assert _values(_process(content, static_data, "full")) == expected
+    with pytest.raises(ValueError):
+        _process(content, static_data, "delta")
+
+def test_edited_invoice_regenerates_whole_day(static_data):
+    rows = _bkhd_rows(300)
+    _process(_bkhd_file(rows[:200]), static_data, "full")
+    before = incremental_processor.get_incremental_stats()
+
+    edited = next(row for row in rows[:200] if row[3] != ANONYMOUS_CUSTOMER)
+    edited[8] = 7.5
+    content = _bkhd_file(rows)
+
+    assert _values(_process(content, static_data, "full")) == _values(_process(content, static_data))
+    assert _stats_since(before)["resets"] == 1
+
+def test_config_fingerprint_change_regenerates_whole_day(static_data):
+    rows = _bkhd_rows(300)
+    _process(_bkhd_file(rows[:200]), static_data, "full", fingerprint="a")
+    before = incremental_processor.get_incremental_stats()
+
+    content = _bkhd_file(rows)
+    assert _values(_process(content, static_data, "full", fingerprint="b")) == _values(_process(content, static_data))
+    stats = _stats_since(before)
+    assert stats["resets"] == 1 and stats["reused_rows"] == 0
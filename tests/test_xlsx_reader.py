@@ -0,0 +1,189 @@
+import io
+import zipfile
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+import logic_handler
+from xlsx_reader import UnsupportedWorkbookError, iter_sheet_values
+
+# styles.xml tối thiểu không có font/fill mặc định, openpyxl chỉ cảnh báo rồi dùng style mặc định của nó
+pytestmark = pytest.mark.filterwarnings("ignore:Workbook contains no default style")
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+CONTENT_TYPES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+
+ROOT_RELS = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+WORKBOOK_RELS = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="{REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="{REL_NS}/sharedStrings" Target="sharedStrings.xml"/>
+<Relationship Id="rId3" Type="{REL_NS}/styles" Target="styles.xml"/>
+</Relationships>"""
+
+# Style 0: chung; 1: ngày (numFmtId 14); 2: khoảng thời gian tự định nghĩa [h]:mm
+STYLES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="{MAIN_NS}">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="[h]:mm"/></numFmts>
+<cellXfs count="3"><xf numFmtId="0"/><xf numFmtId="14" applyNumberFormat="1"/><xf numFmtId="164" applyNumberFormat="1"/></cellXfs>
+</styleSheet>"""
+
+SHARED_STRINGS = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<sst xmlns="{MAIN_NS}" count="3" uniqueCount="3">
+<si><t>Cộng Hoà</t></si>
+<si><r><t>Xăng </t></r><r><rPr><b/></rPr><t>E5</t></r></si>
+<si><t>Phiên âm</t><rPh sb="0" eb="1"><t>bỏ qua</t></rPh></si>
+</sst>"""
+
+def _build_xlsx(sheet_data, date1904=False, worksheet_open=None):
+    """File .xlsx tối thiểu với sheet1 có nội dung <sheetData> là sheet_data (chuỗi XML)."""
+    workbook_pr = '<workbookPr date1904="1"/>' if date1904 else "<workbookPr/>"
+    workbook = (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">{workbook_pr}'
+        f'<sheets><sheet name="BKHD" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    )
+    if worksheet_open is None:
+        sheet = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><worksheet xmlns="{MAIN_NS}"><sheetData>{sheet_data}</sheetData></worksheet>'
+    else:
+        sheet = worksheet_open + sheet_data
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES)
+        archive.writestr("_rels/.rels", ROOT_RELS)
+        archive.writestr("xl/workbook.xml", workbook)
+        archive.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS)
+        archive.writestr("xl/styles.xml", STYLES)
+        archive.writestr("xl/sharedStrings.xml", SHARED_STRINGS)
+        archive.writestr("xl/worksheets/sheet1.xml", sheet)
+    return buffer.getvalue()
+
+def _openpyxl_values(content, min_row, max_col):
+    """Kết quả đối chiếu: cách logic_handler đọc bảng kê bằng openpyxl."""
+    workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        worksheet = workbook.active
+        worksheet.reset_dimensions()
+        return list(worksheet.iter_rows(min_row=min_row, max_col=max_col, values_only=True))
+    finally:
+        workbook.close()
+
+def _assert_same_as_openpyxl(content, min_row=1, max_col=6):
+    native = list(iter_sheet_values(content, min_row=min_row, max_col=max_col))
+    expected = _openpyxl_values(content, min_row, max_col)
+    assert native == expected
+    assert [[type(value) for value in row] for row in native] == [[type(value) for value in row] for row in expected]
+    return native
+
+def test_shared_strings_numbers_and_sparse_columns():
+    rows = _assert_same_as_openpyxl(_build_xlsx(
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="D1"><v>19850</v></c><c r="F1"><v>1.5</v></c></row>'
+        '<row r="2"><c r="B2" t="s"><v>1</v></c><c r="C2" t="s"><v>2</v></c><c r="E2"><v>1E3</v></c></row>'
+    ))
+    assert rows[0] == ("Cộng Hoà", None, None, 19850, None, 1.5)
+    assert rows[1][1:3] == ("Xăng E5", "Phiên âm")
+
+def test_missing_and_self_closing_rows():
+    _assert_same_as_openpyxl(_build_xlsx(
+        '<row r="1"><c r="A1"><v>1</v></c></row>'
+        '<row r="2"/>'
+        '<row r="5" spans="1:3"><c r="C5"><v>5</v></c></row>'
+    ))
+
+def test_rows_and_cells_without_reference():
+    _assert_same_as_openpyxl(_build_xlsx(
+        '<row><c><v>1</v></c><c><v>2</v></c></row>'
+        '<row><c t="s"><v>0</v></c><c r="D2"><v>4</v></c><c><v>5</v></c></row>'
+    ))
+
+def test_prefixed_namespace():
+    opening = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><x:worksheet xmlns:x="{MAIN_NS}"><x:sheetData>'
+    content = _build_xlsx(
+        '<x:row r="1"><x:c r="A1" t="s"><x:v>0</x:v></x:c><x:c r="B1"><x:v>2</x:v></x:c></x:row>'
+        '<x:row r="2"/><x:row r="3"><x:c r="C3"><x:v>3</x:v></x:c></x:row>'
+        '</x:sheetData></x:worksheet>',
+        worksheet_open=opening,
+    )
+    rows = _assert_same_as_openpyxl(content)
+    assert rows[0][:2] == ("Cộng Hoà", 2)
+
+def test_cell_types():
+    rows = _assert_same_as_openpyxl(_build_xlsx(
+        '<row r="1">'
+        '<c r="A1" t="inlineStr"><is><t>Nội dung</t></is></c>'
+        '<c r="B1" t="inlineStr"><is><r><t>Hai </t></r><r><t>đoạn</t></r></is></c>'
+        '<c r="C1" t="b"><v>1</v></c>'
+        '<c r="D1" t="b"><v>0</v></c>'
+        '<c r="E1" t="d"><v>2025-03-15T08:30:00</v></c>'
+        '<c r="F1" t="str"><f>A1&amp;""</f><v>Công thức</v></c>'
+        '</row>'
+        '<row r="2"><c r="A2" t="e"><v>#DIV/0!</v></c><c r="B2"><f>1+1</f></c><c r="C2" t="s"/><c r="D2"><v></v></c></row>'
+    ))
+    assert rows[0][2:5] == (True, False, datetime(2025, 3, 15, 8, 30))
+
+@pytest.mark.parametrize("date1904", [False, True])
+def test_date_and_timedelta_styles(date1904):
+    rows = _assert_same_as_openpyxl(_build_xlsx(
+        '<row r="1"><c r="A1" s="1"><v>45731</v></c><c r="B1" s="1"><v>45731.5</v></c>'
+        '<c r="C1" s="2"><v>1.25</v></c><c r="D1" s="0"><v>45731</v></c></row>',
+        date1904=date1904,
+    ))
+    assert isinstance(rows[0][0], datetime)
+    assert rows[0][3] == 45731
+
+def test_min_row_and_max_col():
+    content = _build_xlsx(''.join(
+        f'<row r="{row}"><c r="A{row}"><v>{row}</v></c><c r="H{row}"><v>{row * 10}</v></c></row>' for row in range(1, 15)
+    ))
+    rows = _assert_same_as_openpyxl(content, min_row=11, max_col=3)
+    assert rows[0] == (11, None, None)
+    _assert_same_as_openpyxl(content, min_row=1, max_col=8)
+
+def test_empty_sheet_data():
+    content = _build_xlsx("", worksheet_open=f'<worksheet xmlns="{MAIN_NS}"><sheetData/></worksheet>')
+    assert _assert_same_as_openpyxl(content) == []
+
+def test_truncated_sheet_is_rejected():
+    opening = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><worksheet xmlns="{MAIN_NS}"><sheetData>'
+    content = _build_xlsx('<row r="1"><c r="A1"><v>1</v></c></row><row r="2"><c r="A2"><v>2', worksheet_open=opening)
+    with pytest.raises(UnsupportedWorkbookError):
+        list(iter_sheet_values(content, max_col=3))
+
+def test_openpyxl_written_workbook():
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.append(["Tiêu đề"])
+    worksheet.append([1, 2.5, None, "chữ", datetime(2025, 3, 15), True])
+    worksheet["J5"] = "ngoài max_col"
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    _assert_same_as_openpyxl(buffer.getvalue())
+
+def test_read_bkhd_file_falls_back_to_openpyxl(monkeypatch):
+    rows = ''.join(
+        f'<row r="{row}"><c r="A{row}"><v>{row}</v></c><c r="D{row}" t="inlineStr"><is><t>Khách {row}</t></is></c></row>'
+        for row in range(11, 14)
+    )
+    content = _build_xlsx(rows)
+    expected = logic_handler.read_bkhd_file(content, reader='openpyxl')
+
+    def unsupported(*args, **kwargs):
+        raise UnsupportedWorkbookError("không hỗ trợ")
+    monkeypatch.setattr(logic_handler, "iter_sheet_values", unsupported)
+    assert logic_handler.read_bkhd_file(content, reader='native') == expected
+    assert [row[3] for row in expected["rows"]] == ["Khách 11", "Khách 12", "Khách 13"]
@@ -0,0 +1,50 @@
+import io
+import os
+import tempfile
+
+from flask import Request, current_app
+
+# ==============================================================================
+# FILE TẢI LÊN: GIỚI HẠN DUNG LƯỢNG VÀ GHI TẠM RA Ổ ĐĨA
+# ==============================================================================
+# File tải lên nhỏ hơn UPLOAD_SPOOL_THRESHOLD_BYTES được giữ trong bộ nhớ, lớn hơn thì được ghi
+# ra file tạm; file tạm này được đưa thẳng cho bộ đọc bảng kê (không đọc hết vào bytes).
+# Request lớn hơn UPLOAD_MAX_BYTES bị từ chối ngay từ header Content-Length, trước khi nhận nội dung.
+
+UPLOAD_MAX_BYTES = int(os.environ.get("UPSSE_MAX_UPLOAD_MB", 64)) * 1024 * 1024
+UPLOAD_SPOOL_THRESHOLD_BYTES = int(os.environ.get("UPSSE_UPLOAD_SPOOL_KB", 1024)) * 1024
+
+def configure(max_bytes=None, spool_threshold_bytes=None):
+    """Thay đổi giới hạn upload (gọi khi khởi động ứng dụng, trước khi gán MAX_CONTENT_LENGTH)."""
+    global UPLOAD_MAX_BYTES, UPLOAD_SPOOL_THRESHOLD_BYTES
+    if max_bytes is not None: UPLOAD_MAX_BYTES = max_bytes
+    if spool_threshold_bytes is not None: UPLOAD_SPOOL_THRESHOLD_BYTES = spool_threshold_bytes
+
+class SpoolingRequest(Request):
+    """Request của Flask dùng ngưỡng UPLOAD_SPOOL_THRESHOLD_BYTES để chuyển file tải lên ra file tạm."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD_BYTES, mode="w+b")
+
+def upload_too_large_message():
+    """Thông báo khi request vượt MAX_CONTENT_LENGTH của ứng dụng hiện tại (gọi trong request)."""
+    max_bytes = current_app.config.get('MAX_CONTENT_LENGTH') or UPLOAD_MAX_BYTES
+    return f"File tải lên quá lớn (tối đa {round(max_bytes / (1024 * 1024), 2):g} MB). Vui lòng tách bảng kê thành nhiều file nhỏ hơn."
+
+def upload_size(source):
+    """Dung lượng (byte) của bytes hoặc file nhị phân; file được đưa về đầu file."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    size = source.seek(0, io.SEEK_END)
+    source.seek(0)
+    return size
+
+def detach_upload(file_storage):
+    """
+    Lấy file tạm của một file tải lên ra khỏi request (không sao chép) để dùng sau khi request kết thúc
+    (Flask đóng các file tải lên khi request kết thúc). Người gọi phải tự đóng file trả về.
+    """
+    stream = file_storage.stream
+    file_storage.stream = io.BytesIO()
+    stream.seek(0)
+    return stream
@@ -0,0 +1,162 @@
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# ==============================================================================
+# KHO TẠM FILE TẢI LÊN (DÙNG CHO BƯỚC XÁC NHẬN NGÀY)
+# ==============================================================================
+# Khi cần người dùng xác nhận ngày, file bảng kê được giữ lại trên server và trình
+# duyệt chỉ gửi lại một mã (token) thay vì toàn bộ file mã hóa base64.
+# Có hai tầng lưu trữ:
+#   - Bộ nhớ: giữ dữ liệu đã phân tích (bkhd_data) để bước xác nhận không phải đọc lại file.
+#   - Ổ đĩa: giữ nội dung file gốc, để worker gunicorn khác vẫn xử lý được bước xác nhận.
+# Cả hai tầng đều có thời hạn (TTL) và giới hạn dung lượng; mục cũ nhất bị loại trước.
+# Tầng bộ nhớ là riêng của từng worker gunicorn nên giới hạn nhỏ (UPSSE_UPLOAD_STASH_MEMORY_MB);
+# mục bị loại khỏi bộ nhớ vẫn được đọc lại từ ổ đĩa.
+
+STASH_DIR = os.path.join(tempfile.gettempdir(), "upsse_upload_stash")
+STASH_TTL_SECONDS = 30 * 60
+STASH_MAX_MEMORY_BYTES = int(os.environ.get("UPSSE_UPLOAD_STASH_MEMORY_MB", 32)) * 1024 * 1024
+STASH_MAX_DISK_BYTES = 512 * 1024 * 1024
+# Ước lượng bộ nhớ cho một dòng bảng kê đã đọc (tuple 21 giá trị và các chuỗi bên trong)
+APPROX_BYTES_PER_ROW = 1500
+
+_TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_-]{20,64}$')
+
+_stash_lock = threading.Lock()
+_memory_entries = OrderedDict()
+_memory_bytes = 0
+_stash_stats = {"stored": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+def configure(stash_dir=None, ttl_seconds=None, max_memory_bytes=None, max_disk_bytes=None):
+    """Thay đổi cấu hình kho tạm (gọi khi khởi động ứng dụng)."""
+    global STASH_DIR, STASH_TTL_SECONDS, STASH_MAX_MEMORY_BYTES, STASH_MAX_DISK_BYTES
+    if stash_dir is not None: STASH_DIR = stash_dir
+    if ttl_seconds is not None: STASH_TTL_SECONDS = ttl_seconds
+    if max_memory_bytes is not None: STASH_MAX_MEMORY_BYTES = max_memory_bytes
+    if max_disk_bytes is not None: STASH_MAX_DISK_BYTES = max_disk_bytes
+
+def _estimate_size(bkhd_data):
+    return len(bkhd_data["rows"]) * APPROX_BYTES_PER_ROW
+
+def _stash_path(token):
+    return os.path.join(STASH_DIR, f"{token}.xlsx")
+
+def _evict_memory(now):
+    """Loại các mục hết hạn, sau đó loại mục cũ nhất cho đến khi nằm trong giới hạn bộ nhớ."""
+    global _memory_bytes
+    for token in list(_memory_entries):
+        entry = _memory_entries[token]
+        if entry["expires_at"] > now and _memory_bytes <= STASH_MAX_MEMORY_BYTES:
+            break
+        del _memory_entries[token]
+        _memory_bytes -= entry["size"]
+        _stash_stats["evictions"] += 1
+
+def _evict_disk(now):
+    """Xóa các file hết hạn, sau đó xóa file cũ nhất cho đến khi nằm trong giới hạn ổ đĩa."""
+    try:
+        names = os.listdir(STASH_DIR)
+    except FileNotFoundError:
+        return
+    files = []
+    for name in names:
+        path = os.path.join(STASH_DIR, name)
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((stat_result.st_mtime, stat_result.st_size, path))
+    files.sort()
+    total_bytes = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if mtime + STASH_TTL_SECONDS > now and total_bytes <= STASH_MAX_DISK_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+def stash_upload(file_content, bkhd_data=None):
+    """Lưu file tải lên (bytes hoặc file nhị phân) và dữ liệu đã phân tích nếu có vào kho tạm, trả về token."""
+    global _memory_bytes
+    token = secrets.token_urlsafe(24)
+    now = time.time()
+
+    if file_content is not None:
+        os.makedirs(STASH_DIR, exist_ok=True)
+        _evict_disk(now)
+        tmp_path = _stash_path(token) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            if isinstance(file_content, (bytes, bytearray, memoryview)):
+                f.write(file_content)
+            else:
+                # File tạm của upload: chép từng khối, không đọc hết vào bộ nhớ
+                file_content.seek(0)
+                shutil.copyfileobj(file_content, f)
+        os.replace(tmp_path, _stash_path(token))
+
+    with _stash_lock:
+        _stash_stats["stored"] += 1
+        if bkhd_data is not None:
+            size = _estimate_size(bkhd_data)
+            _memory_entries[token] = {"bkhd_data": bkhd_data, "size": size, "expires_at": now + STASH_TTL_SECONDS}
+            _memory_bytes += size
+            _evict_memory(now)
+    return token
+
+def take_upload(token):
+    """
+    Lấy ra (và xóa khỏi kho) dữ liệu ứng với token. Trả về (file_content, bkhd_data):
+    bkhd_data khác None nếu worker này còn giữ dữ liệu đã phân tích, ngược lại file_content
+    là nội dung file gốc đọc từ ổ đĩa. Trả về (None, None) nếu token không hợp lệ hoặc đã hết hạn.
+    """
+    global _memory_bytes
+    if not token or not _TOKEN_PATTERN.match(token):
+        return None, None
+    now = time.time()
+    path = _stash_path(token)
+
+    with _stash_lock:
+        entry = _memory_entries.pop(token, None)
+        if entry is not None:
+            _memory_bytes -= entry["size"]
+        if entry is not None and entry["expires_at"] > now:
+            _stash_stats["memory_hits"] += 1
+            _remove_quietly(path)
+            return None, entry["bkhd_data"]
+
+    try:
+        expired = os.stat(path).st_mtime + STASH_TTL_SECONDS <= now
+        file_content = None if expired else _read_file(path)
+    except FileNotFoundError:
+        file_content = None
+    _remove_quietly(path)
+
+    with _stash_lock:
+        _stash_stats["disk_hits" if file_content is not None else "misses"] += 1
+    return file_content, None
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def get_stash_stats():
+    """Trả về bản sao các bộ đếm của kho tạm."""
+    with _stash_lock:
+        stats = dict(_stash_stats)
+        stats["memory_entries"] = len(_memory_entries)
+        stats["memory_bytes"] = _memory_bytes
+    return stats
@@ -0,0 +1,289 @@
+import io
+import os
+import posixpath
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse, fromstring
+
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+from openpyxl.utils.cell import column_index_from_string
+
+# ==============================================================================
+# BỘ ĐỌC XLSX NHANH (ĐỌC TRỰC TIẾP XML TRONG FILE ZIP)
+# ==============================================================================
+# Thay cho openpyxl khi chỉ cần giá trị các ô: đọc sheet đang chọn (active) theo luồng,
+# từng khối nhiều dòng, không tạo đối tượng cell. Kết quả từng dòng là tuple giá trị giống hệt
+# ReadOnlyWorksheet.iter_rows(values_only=True) của openpyxl (data_only=True), kể cả ô ngày tháng
+# (chuyển bằng chính các hàm của openpyxl). Gặp cấu trúc file không hỗ trợ thì ném lỗi để
+# bên gọi quay về dùng openpyxl.
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+ROW_TAG = f"{{{MAIN_NS}}}row"
+CELL_TAG = f"{{{MAIN_NS}}}c"
+VALUE_TAG = f"{{{MAIN_NS}}}v"
+TEXT_TAG = f"{{{MAIN_NS}}}t"
+RUN_TAG = f"{{{MAIN_NS}}}r"
+INLINE_STRING_TAG = f"{{{MAIN_NS}}}is"
+SHARED_STRING_TAG = f"{{{MAIN_NS}}}si"
+
+# Dữ liệu sheet được giải nén và parse theo từng khối khoảng 64KB (khối nhỏ ít tốn bộ nhớ hơn mà không chậm hơn)
+READ_CHUNK_BYTES = 64 * 1024
+# Thẻ mở <worksheet ...> (có thể có tiền tố namespace, ví dụ <x:worksheet>)
+_WORKSHEET_TAG_PATTERN = re.compile(rb"<(?:([A-Za-z_][\w.-]*:))?worksheet\b[^>]*>")
+
+class UnsupportedWorkbookError(Exception):
+    """File không đọc được bằng bộ đọc nhanh (bên gọi nên dùng openpyxl)."""
+
+def _read_relationships(archive, part_path):
+    """Đọc file .rels của part_path, trả về {rId: (loại quan hệ, đường dẫn đích trong zip)}."""
+    folder, name = posixpath.split(part_path)
+    rels_path = posixpath.join(folder, "_rels", f"{name}.rels")
+    try:
+        root = fromstring(archive.read(rels_path))
+    except KeyError:
+        return {}
+    relationships = {}
+    for rel in root.iter(f"{{{PACKAGE_REL_NS}}}Relationship"):
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        relationships[rel.get("Id")] = (rel.get("Type", ""), target)
+    return relationships
+
+def _find_part(relationships, type_suffix):
+    for rel_type, target in relationships.values():
+        if rel_type.endswith(type_suffix):
+            return target
+    return None
+
+def _text_content(element):
+    """Nội dung chữ của <si> hoặc <is>: phần <t> và các đoạn <r><t>, bỏ qua phiên âm (<rPh>)."""
+    snippets = []
+    plain = element.find(TEXT_TAG)
+    if plain is not None and plain.text is not None:
+        snippets.append(plain.text)
+    for run in element.findall(RUN_TAG):
+        text = run.findtext(TEXT_TAG)
+        if text is not None:
+            snippets.append(text)
+    return "".join(snippets)
+
+def _read_shared_strings(archive, path):
+    if path is None:
+        return []
+    strings = []
+    with archive.open(path) as source:
+        for _, node in iterparse(source):
+            if node.tag == SHARED_STRING_TAG:
+                strings.append(_text_content(node).replace("x005F_", ""))
+                node.clear()
+    return strings
+
+def _read_date_styles(archive, path):
+    """
+    Xác định các style ngày tháng theo đúng quy tắc của openpyxl. Trả về dict {giá trị thuộc tính s
+    của ô: True nếu là khoảng thời gian (ví dụ [h]:mm), False nếu là ngày/giờ}; style khác không có trong dict.
+    """
+    date_style_kinds = {}
+    if path is None:
+        return date_style_kinds
+    root = fromstring(archive.read(path))
+    custom_formats = {
+        int(num_fmt.get("numFmtId")): num_fmt.get("formatCode")
+        for num_fmt in root.iter(f"{{{MAIN_NS}}}numFmt")
+    }
+    cell_xfs = root.find(f"{{{MAIN_NS}}}cellXfs")
+    if cell_xfs is None:
+        return date_style_kinds
+    for style_id, xf in enumerate(cell_xfs.findall(f"{{{MAIN_NS}}}xf")):
+        num_fmt_id = int(xf.get("numFmtId", 0))
+        fmt = custom_formats[num_fmt_id] if num_fmt_id in custom_formats else BUILTIN_FORMATS.get(num_fmt_id)
+        if is_date_format(fmt):
+            date_style_kinds[str(style_id)] = is_timedelta_format(fmt)
+    # Ô không có thuộc tính s dùng style 0
+    if "0" in date_style_kinds:
+        date_style_kinds[None] = date_style_kinds[""] = date_style_kinds["0"]
+    return date_style_kinds
+
+def _open_active_sheet(archive):
+    """Tìm sheet đang chọn của workbook, trả về (đường dẫn sheet, shared strings, các style ngày tháng, epoch)."""
+    workbook_path = _find_part(_read_relationships(archive, ""), "/officeDocument")
+    if workbook_path is None:
+        raise UnsupportedWorkbookError("Không tìm thấy workbook trong file.")
+    workbook_root = fromstring(archive.read(workbook_path))
+    workbook_rels = _read_relationships(archive, workbook_path)
+
+    epoch = CALENDAR_WINDOWS_1900
+    workbook_pr = workbook_root.find(f"{{{MAIN_NS}}}workbookPr")
+    if workbook_pr is not None and workbook_pr.get("date1904", "").lower() in ("1", "true"):
+        epoch = CALENDAR_MAC_1904
+
+    active_index = 0
+    for view in workbook_root.iter(f"{{{MAIN_NS}}}workbookView"):
+        if view.get("activeTab") is not None:
+            active_index = int(view.get("activeTab"))
+            break
+
+    # Giống openpyxl: chỉ tính các sheet có r:id trỏ tới file có trong zip
+    names = set(archive.namelist())
+    sheets = []
+    for sheet in workbook_root.iter(f"{{{MAIN_NS}}}sheet"):
+        rel = workbook_rels.get(sheet.get(f"{{{REL_NS}}}id"))
+        if rel is not None and rel[1] in names:
+            sheets.append(rel)
+    if not 0 <= active_index < len(sheets) or not sheets[active_index][0].endswith("/worksheet"):
+        raise UnsupportedWorkbookError("Sheet đang chọn không phải worksheet.")
+
+    shared_strings = _read_shared_strings(archive, _find_part(workbook_rels, "/sharedStrings"))
+    date_style_kinds = _read_date_styles(archive, _find_part(workbook_rels, "/styles"))
+    return sheets[active_index][1], shared_strings, date_style_kinds, epoch
+
+def open_source(source):
+    """
+    Nguồn file .xlsx để mở bằng zipfile/openpyxl: bytes được bọc trong BytesIO (không sao chép),
+    đường dẫn được giữ nguyên, file nhị phân (file tạm của upload) được đưa về đầu file.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    source.seek(0)
+    return source
+
+def iter_sheet_values(source, min_row=1, max_col=None):
+    """
+    Đọc sheet đang chọn, trả về lần lượt tuple giá trị của từng dòng từ min_row tới dòng cuối
+    (giống iter_rows(min_row=..., max_col=..., values_only=True) sau reset_dimensions()).
+    source: bytes, đường dẫn hoặc file nhị phân (xem open_source).
+    max_col là bắt buộc: dòng nào cũng có đúng max_col giá trị.
+    """
+    if not max_col:
+        raise ValueError("max_col là bắt buộc.")
+    try:
+        archive = zipfile.ZipFile(open_source(source))
+    except zipfile.BadZipFile as e:
+        raise UnsupportedWorkbookError(str(e))
+    with archive:
+        sheet_path, shared_strings, date_style_kinds, epoch = _open_active_sheet(archive)
+        empty_row = (None,) * max_col
+        column_cache = {}
+        counter = min_row
+        row_number = 0
+
+        with archive.open(sheet_path) as source:
+            for element in _iter_row_elements(source):
+                if element.tag != ROW_TAG:
+                    continue
+                row_ref = element.get("r")
+                if row_ref is None:
+                    row_number += 1
+                else:
+                    try:
+                        row_number = int(row_ref)
+                    except ValueError:
+                        row_float = float(row_ref)
+                        if not row_float.is_integer():
+                            raise ValueError(f"{row_ref} is not a valid row number")
+                        row_number = int(row_float)
+
+                if row_number >= counter:
+                    # Các dòng bị thiếu trong file được trả về là dòng rỗng
+                    while counter < row_number:
+                        counter += 1
+                        yield empty_row
+                    yield _parse_row(element, max_col, shared_strings, date_style_kinds, epoch, column_cache)
+                    counter += 1
+
+def _iter_row_elements(source):
+    """
+    Trả về lần lượt các phần tử con của <sheetData> (các dòng).
+    Không dùng iterparse (mỗi thẻ XML tốn một lượt xử lý bằng Python): nội dung <sheetData> được cắt
+    thành từng khối gồm nhiều dòng hoàn chỉnh, mỗi khối được parse một lần bằng fromstring.
+    """
+    buffer = b""
+    header_match = data_match = None
+    while data_match is None:
+        chunk = source.read(READ_CHUNK_BYTES)
+        buffer += chunk
+        if header_match is None:
+            header_match = _WORKSHEET_TAG_PATTERN.search(buffer)
+        if header_match is not None:
+            prefix = header_match.group(1) or b""
+            data_match = re.compile(rb"<" + prefix + rb"sheetData\b[^>]*?(/?)>").search(buffer, header_match.end())
+        if data_match is None and not chunk:
+            raise UnsupportedWorkbookError("Không tìm thấy dữ liệu sheet.")
+    if data_match.group(1):
+        return
+
+    # Thẻ mở <worksheet ...> được giữ nguyên để các tiền tố namespace trong từng dòng vẫn hợp lệ
+    wrapper_open = header_match.group(0) + b"<" + prefix + b"sheetData>"
+    wrapper_close = b"</" + prefix + b"sheetData></" + prefix + b"worksheet>"
+    row_end_tag = b"</" + prefix + b"row>"
+    data_end_tag = b"</" + prefix + b"sheetData>"
+
+    buffer = buffer[data_match.end():]
+    while True:
+        data_end = buffer.find(data_end_tag)
+        if data_end >= 0:
+            cut = data_end
+        else:
+            cut = buffer.rfind(row_end_tag)
+            cut = cut + len(row_end_tag) if cut >= 0 else 0
+        if cut:
+            yield from fromstring(wrapper_open + buffer[:cut] + wrapper_close)[0]
+        if data_end >= 0:
+            return
+        buffer = buffer[cut:]
+        chunk = source.read(READ_CHUNK_BYTES)
+        if not chunk:
+            raise UnsupportedWorkbookError("Dữ liệu sheet bị cắt cụt.")
+        buffer += chunk
+
+def _parse_row(row_element, max_col, shared_strings, date_style_kinds, epoch, column_cache):
+    values = [None] * max_col
+    column = 0
+    for cell in row_element:
+        if cell.tag != CELL_TAG:
+            continue
+        ref = cell.get("r")
+        if ref is None:
+            column += 1
+        else:
+            letters = ref.rstrip("0123456789")
+            column = column_cache.get(letters)
+            if column is None:
+                column = column_cache[letters] = column_index_from_string(letters)
+        if column > max_col:
+            continue
+
+        data_type = cell.get("t", "n")
+        if data_type == "inlineStr":
+            inline = cell.find(INLINE_STRING_TAG)
+            values[column - 1] = _text_content(inline) if inline is not None else None
+            continue
+
+        value = cell.findtext(VALUE_TAG) or None
+        if value is None:
+            continue
+        if data_type == "n":
+            value = float(value) if "." in value or "E" in value or "e" in value else int(value)
+            is_timedelta = date_style_kinds.get(cell.get("s"))
+            if is_timedelta is not None:
+                try:
+                    value = from_excel(value, epoch, timedelta=is_timedelta)
+                except (OverflowError, ValueError):
+                    value = "#VALUE!"
+        elif data_type == "s":
+            value = shared_strings[int(value)]
+        elif data_type == "b":
+            value = bool(int(value))
+        elif data_type == "d":
+            value = from_ISO8601(value)
+        values[column - 1] = value
+    return tuple(values)
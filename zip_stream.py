@@ -0,0 +1,55 @@
+import io
+import os
+import zipfile
+
+# ==============================================================================
+# GHI FILE ZIP THEO LUỒNG (STREAMING)
+# ==============================================================================
+# Thay vì tạo cả file ZIP trong bộ nhớ rồi mới gửi, từng file UpSSE được ghi vào luồng ZIP
+# và gửi dần từng khối cho trình duyệt; file nào đã ghi xong thì được giải phóng ngay.
+# Các file .xlsx bên trong vốn đã được nén, nên mức nén ZIP mặc định thấp (1) cho nhanh;
+# đặt UPSSE_ZIP_LEVEL=0 để chỉ đóng gói không nén, 1-9 để nén nhiều hơn.
+
+ZIP_COMPRESSION_LEVEL = int(os.environ.get("UPSSE_ZIP_LEVEL", 1))
+STREAM_CHUNK_BYTES = 256 * 1024
+
+class _ChunkSink:
+    """Đích ghi không seek được: zipfile ghi vào đây, các khối dữ liệu được lấy ra dần để gửi đi."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._chunks:
+            data = b"".join(self._chunks)
+            self._chunks = []
+            yield data
+
+def iter_zip_chunks(named_outputs, compresslevel=None):
+    """
+    Trả về lần lượt các khối bytes của file ZIP chứa named_outputs = [(tên file, BytesIO hoặc bytes)].
+    Danh sách named_outputs được lấy dần ra (rỗng khi xong) để mỗi file được giải phóng ngay sau khi ghi.
+    """
+    level = ZIP_COMPRESSION_LEVEL if compresslevel is None else compresslevel
+    compression = zipfile.ZIP_STORED if level == 0 else zipfile.ZIP_DEFLATED
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression, compresslevel=level or None) as zipf:
+        while named_outputs:
+            file_name, output = named_outputs.pop(0)
+            data = output.getbuffer() if isinstance(output, io.BytesIO) else memoryview(output)
+            with zipf.open(file_name, "w") as entry:
+                for start in range(0, len(data), STREAM_CHUNK_BYTES):
+                    entry.write(data[start:start + STREAM_CHUNK_BYTES])
+                    yield from sink.drain()
+            data.release()
+            del output, data
+            yield from sink.drain()
+    # Thư mục trung tâm (central directory) ở cuối file ZIP
+    yield from sink.drain()